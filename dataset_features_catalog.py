@@ -0,0 +1,55 @@
+"""
+Create the catalog of the features of all patients, reading each patient events only once: the columns created by
+the hot encoding of the nominal features and the frequency of each feature in patients.
+It is used by dataset_nominal_to_hot_encoding.py.
+"""
+import json
+import os
+import pickle
+from functools import partial
+
+import pandas as pd
+
+from resources.features_catalog import add_stay_to_catalog, create_features_catalog, merge_features_catalogs
+from resources.progress import ProgressPool, report_progress
+from resources.scheduler import create_stays_tasks, get_stays_files_sizes
+from resources.storage import get_stay_storage
+
+
+def get_features_catalog(icustay_ids, events_storage=None):
+    catalog = create_features_catalog()
+    for icustay_id in icustay_ids:
+        report_progress()
+        if not events_storage.exists(icustay_id):
+            continue
+        add_stay_to_catalog(catalog, events_storage.read(icustay_id))
+    return catalog
+
+
+parametersFilePath = "parameters.json"
+
+# Loading parameters file
+print("====== Loading Parameters =====")
+parameters = None
+with open(parametersFilePath, 'r') as parametersFileHandler:
+    parameters = json.load(parametersFileHandler)
+if parameters is None:
+    exit(1)
+
+mimic_data_path = parameters['mimic_data_path']
+events_storage = get_stay_storage(mimic_data_path + parameters['raw_events_dirname'].format('raw_merged'))
+dataset = pd.read_csv(mimic_data_path + parameters['dataset_file_name'])
+icustay_ids = list(dataset['icustay_id'])
+
+print("====== Getting features catalog =====")
+with ProgressPool() as pool:
+    partial_get_features_catalog = partial(get_features_catalog, events_storage=events_storage)
+    tasks = create_stays_tasks(icustay_ids, get_stays_files_sizes(icustay_ids, [events_storage]))
+    results = pool.map(partial_get_features_catalog, tasks, len(icustay_ids))
+print()
+catalog = merge_features_catalogs(results)
+catalog['total_stays'] = len(dataset)
+print("Features: {}, nominal features: {}, columns after hot encoding: {}"
+      .format(len(catalog['features_frequency']), len(catalog['nominal_values']), len(catalog['columns'])))
+with open(mimic_data_path + parameters['features_catalog_file_name'], 'wb') as file:
+    pickle.dump(catalog, file)
@@ -2,59 +2,71 @@
 This script will fill all missing values.
 It's suppose to be used only with numerical features, so make sure to use dataset_nominal_to_hotencoding.py
 if that is not the case for the dataset. In the same manner, all the dataset have to have a csv file in the path.
+The values are filled in one pass over each patient matrix, which can also save the mask of the observed values and
+the hours since the last observation of each feature.
 """
 import os
-from datetime import timedelta
 from functools import partial
-from itertools import islice
-from math import ceil
 
-import numpy
+import numpy as np
 import pandas as pd
-import multiprocessing as mp
-
-import sys
 
 from resources import functions
+from resources.imputation import impute_matrix, pack_observed_mask
+from resources.progress import ProgressPool, report_progress
+from resources.scheduler import create_stays_tasks, get_stays_files_sizes
+from resources.storage import get_stay_storage
 
 
-def fill_missing_values(icustays, events_path=None, new_events_path=None, manager_queue=None):
+def fill_missing_values(icustays, events_storage=None, new_events_storage=None, masks_path=None,
+                        observed_mask=False, time_since_observed=False, datetime_pattern='%Y-%m-%d %H:%M:%S'):
     for icustay in icustays:
-        if manager_queue is not None:
-            manager_queue.put(icustay)
-        if os.path.exists(new_events_path+'{}.csv'.format(icustay)) \
-                or not os.path.exists(events_path + '{}.csv'.format(icustay)):
+        report_progress()
+        if new_events_storage.exists(icustay) or not events_storage.exists(icustay):
             continue
-        events = pd.read_csv(events_path+'{}.csv'.format(icustay))
-        events = events.fillna(method='ffill')
-        events = events.fillna(method='backfill')
-        events = events.fillna(0)
-        events.to_csv(new_events_path+'{}.csv'.format(icustay), index=False)
+        events = events_storage.read(icustay)
+        features = [column for column in events.columns if column != 'Unnamed: 0']
+        times = None
+        if 'Unnamed: 0' in events.columns:
+            times = pd.to_datetime(events['Unnamed: 0'], format=datetime_pattern)
+            times = ((times - times.min()) / pd.Timedelta(hours=1)).to_numpy()
+        matrix, observed, hours_since_observed = impute_matrix(events[features].to_numpy(dtype=float, copy=True),
+                                                               times=times, return_observed_mask=True,
+                                                               return_time_since_observed=True)
+        events[features] = matrix
+        masks = dict()
+        if observed_mask:
+            masks['observed_mask'] = pack_observed_mask(observed)
+        if time_since_observed:
+            masks['time_since_observed'] = hours_since_observed
+        if len(masks) != 0:
+            np.savez(masks_path + '{}.npz'.format(icustay), columns=np.array(features), **masks)
+        new_events_storage.write(events, icustay, index=False)
+
 
 parameters = functions.load_parameters_file()
-events_path =  parameters['mimic_data_path'] + "sepsis_all_features_raw_merged/"
+events_path = parameters['mimic_data_path'] + "sepsis_all_features_raw_merged/"
 new_events_path = parameters['mimic_data_path'] + "sepsis_all_features_no_missing/"
 if not os.path.exists(new_events_path):
     os.mkdir(new_events_path)
+masks_path = parameters['mimic_data_path'] + parameters['missing_values_masks_dirname']
+if (parameters['missing_values_observed_mask'] or parameters['missing_values_time_since_observed']) \
+        and not os.path.exists(masks_path):
+    os.mkdir(masks_path)
 
 dataset = pd.read_csv(parameters['mimic_data_path'] + parameters['dataset_file_name'])
 
 total_files = len(dataset)
 icustay_ids = list(dataset['icustay_id'])
-dataset_for_mp = numpy.array_split(icustay_ids, 10)
+events_storage = get_stay_storage(events_path)
+dataset_for_mp = create_stays_tasks(icustay_ids, get_stays_files_sizes(icustay_ids, [events_storage]))
 print(total_files)
-print(len(dataset_for_mp))
-print(dataset_for_mp)
-
-with mp.Pool(processes=4) as pool:
-    m = mp.Manager()
-    queue = m.Queue()
-    partial_fill_missing_values = partial(fill_missing_values, events_path=events_path, new_events_path=new_events_path,
-                                          manager_queue=queue)
-    map_obj = pool.map_async(partial_fill_missing_values, dataset_for_mp)
-    consumed = 0
-    while not map_obj.ready():
-        for _ in range(queue.qsize()):
-            queue.get()
-            consumed += 1
-        sys.stderr.write('\rdone {0:%}'.format(consumed / total_files))
+
+with ProgressPool() as pool:
+    partial_fill_missing_values = partial(fill_missing_values, events_storage=events_storage,
+                                          new_events_storage=get_stay_storage(new_events_path),
+                                          masks_path=masks_path,
+                                          observed_mask=parameters['missing_values_observed_mask'],
+                                          time_since_observed=parameters['missing_values_time_since_observed'],
+                                          datetime_pattern=parameters['datetime_pattern'])
+    pool.map(partial_fill_missing_values, dataset_for_mp, total_files)
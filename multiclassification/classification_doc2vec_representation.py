@@ -65,7 +65,8 @@ textual_input_shape = (None, embedding_size)
 preprocessing_pipeline = [whitespace_tokenize_text]
 
 texts_hourly_merged_dir = parameters['multiclassification_base_path'] + "textual_hourly_merged/"
-representation_model_data = [texts_hourly_merged_dir + x for x in os.listdir(texts_hourly_merged_dir)]
+representation_model_data = [texts_hourly_merged_dir + x for x in os.listdir(texts_hourly_merged_dir)
+                             if os.path.isfile(texts_hourly_merged_dir + x)]
 textual_representation_path = os.path.join(parameters['textual_representation_model_path'], str(embedding_size))
 textual_representation_model_path = os.path.join(textual_representation_path,
                                                     parameters['textual_representation_model_filename'])
@@ -31,6 +31,7 @@ from adapter import KerasAdapter
 from resources.data_generators import LengthLongitudinalDataGenerator, LongitudinalDataGenerator, \
     ArrayDataGenerator
 from resources.data_representation import EnsembleMetaLearnerDataCreator, TransformClinicalTextsRepresentations
+from resources.episodes import read_episode
 from ensemble_training import TrainEnsembleAdaBoosting, TrainEnsembleBagging, split_classes
 from resources.functions import test_model, print_with_time, escape_invalid_xml_characters, \
     escape_html_special_entities, \
@@ -174,7 +175,7 @@ if __name__ == '__main__':
                                                pickle_object_path= normalization_value_counts_path)
     normalization_values.prepare()
     # Get input shape
-    aux = pd.read_csv(structured_data[0])
+    aux = read_episode(structured_data[0])
     aux = remove_columns_for_classification(aux)
     structured_input_shape = (None, len(aux.columns))
 
@@ -192,7 +193,8 @@ if __name__ == '__main__':
     print_with_time("Training/Loading representation model")
     preprocessing_pipeline = [whitespace_tokenize_text]
     texts_hourly_merged_dir = parameters['multiclassification_base_path'] + "textual_hourly_merged/"
-    representation_model_data = [texts_hourly_merged_dir + x for x in os.listdir(texts_hourly_merged_dir)]
+    representation_model_data = [texts_hourly_merged_dir + x for x in os.listdir(texts_hourly_merged_dir)
+                                 if os.path.isfile(texts_hourly_merged_dir + x)]
     textual_representation_model_path = os.path.join(parameters['textual_representation_model_path'], str(embedding_size),
                                                         parameters['textual_representation_model_filename'])
     if not os.path.exists(textual_representation_model_path):
@@ -540,6 +542,11 @@ if __name__ == '__main__':
 
 
     kf = StratifiedKFold(n_splits=5, shuffle=True, random_state=15)
+    print_with_time("Getting values for normalization of all folds")
+    folds_normalization_values = normalization_values.get_folds_normalization_values(
+        [structured_data[testIndex] for trainIndex, testIndex in kf.split(structured_data, classes)],
+        saved_file_names=[training_directory + parameters['fold_normalization_values_filename'].format(fold)
+                          for fold in range(kf.get_n_splits())])
     fold = 0
     structured_predictions = None
     structured_representations = None
@@ -621,9 +628,7 @@ if __name__ == '__main__':
         structured_ensemble = None
         model_adapters = []
         print_with_time("Getting values for normalization")
-        fold_normalization_values_path = training_directory + parameters['fold_normalization_values_filename'].format(fold)
-        values = normalization_values.get_normalization_values(structured_data[trainIndex],
-                                                               saved_file_name=fold_normalization_values_path)
+        values = folds_normalization_values[fold]
         fold_normalization_temporary_data_path = training_directory \
                                                  + parameters['fold_normalization_temporary_data_directory'].format(fold)
         normalizer = Normalization(values, temporary_path=fold_normalization_temporary_data_path)
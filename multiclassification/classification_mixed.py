@@ -14,6 +14,7 @@ from adapter import KerasAdapter
 from data_generators import LengthLongitudinalDataGenerator, LongitudinalDataGenerator, MetaLearnerDataGenerator, \
     ArrayDataGenerator, MixedLengthDataGenerator
 from resources.data_representation import EnsembleMetaLearnerDataCreator, TransformClinicalTextsRepresentations
+from resources.episodes import read_episode
 from ensemble_training import TrainEnsembleAdaBoosting, TrainEnsembleBagging, split_classes
 from resources.functions import test_model, print_with_time, escape_invalid_xml_characters, escape_html_special_entities, \
     text_to_lower, remove_sepsis_mentions, remove_only_special_characters_tokens, whitespace_tokenize_text, \
@@ -76,7 +77,7 @@ normalization_values = NormalizationValues(structured_data,
                                            pickle_object_path= normalization_value_counts_path)
 normalization_values.prepare()
 # Get input shape
-aux = pd.read_csv(structured_data[0])
+aux = read_episode(structured_data[0])
 aux = remove_columns_for_classification(aux)
 structured_input_shape = (None, len(aux.columns))
 
@@ -94,7 +95,8 @@ textual_input_shape = (None, embedding_size)
 print_with_time("Training/Loading representation model")
 preprocessing_pipeline = [whitespace_tokenize_text]
 texts_hourly_merged_dir = parameters['multiclassification_base_path'] + "textual_hourly_merged/"
-representation_model_data = [texts_hourly_merged_dir + x for x in os.listdir(texts_hourly_merged_dir)]
+representation_model_data = [texts_hourly_merged_dir + x for x in os.listdir(texts_hourly_merged_dir)
+                             if os.path.isfile(texts_hourly_merged_dir + x)]
 textual_representation_model_path = parameters['textual_representation_model_path'] + \
                                      "{}/{}".format(embedding_size, parameters['textual_representation_model_filename'])
 if not os.path.exists(parameters['textual_representation_model_path'] + "{}/".format(embedding_size)):
@@ -23,11 +23,12 @@ from multiclassification.parameters.classification_parameters import model_tuner
 
 from resources import functions
 from resources.data_generators import LengthLongitudinalDataGenerator, LongitudinalDataGenerator
+from resources.episodes import read_episode
 from resources.functions import test_model, print_with_time
 from resources.keras_callbacks import Metrics
 from resources.model_creators import MultilayerKerasRecurrentNNCreator, MultilayerTemporalConvolutionalNNCreator, \
     KerasTunerModelCreator, MultilayerTemporalConvolutionalNNHyperModel
-from resources.normalization import Normalization, NormalizationValues
+from resources.normalization import Normalization, NormalizationTransform, NormalizationValues
 import kerastuner as kt
 
 def focal_loss(y_true, y_pred):
@@ -81,7 +82,7 @@ normalization_value_counts_path = training_directory + parameters['normalization
 normalization_values = NormalizationValues(data, pickle_object_path=normalization_value_counts_path)
 normalization_values.prepare()
 # Get input shape
-aux = pd.read_csv(data[0])
+aux = read_episode(data[0])
 aux = functions.remove_columns_for_classification(aux)
 inputShape = (None, len(aux.columns))
 
@@ -145,7 +146,8 @@ values = normalization_values.get_normalization_values(optimization_sdata,
                                                        saved_file_name=opt_normalization_values_path)
 opt_normalization_temporary_data_path = training_directory + parameters[
     'optimization_normalization_temporary_data_directory']
-normalizer = Normalization(values, temporary_path=opt_normalization_temporary_data_path)
+normalizer = Normalization(values, temporary_path=opt_normalization_temporary_data_path,
+                           normalization_type=parameters['normalization_type'])
 print_with_time("Normalizing optimization data")
 normalizer.normalize_files(optimization_sdata)
 normalized_data = np.array(normalizer.get_new_paths(optimization_sdata))
@@ -183,7 +185,8 @@ eval_values = normalization_values.get_normalization_values(evaluation_data,
                                                        saved_file_name=eval_normalization_values_path)
 eval_normalization_temporary_data_path = training_directory + parameters[
     'evaluation_normalization_temporary_data_directory']
-eval_normalizer = Normalization(eval_values, temporary_path=eval_normalization_temporary_data_path)
+eval_normalizer = Normalization(eval_values, temporary_path=eval_normalization_temporary_data_path,
+                                normalization_type=parameters['normalization_type'])
 print_with_time("Normalizing evaluation data")
 eval_normalizer.normalize_files(evaluation_data)
 eval_normalized_data = np.array(eval_normalizer.get_new_paths(evaluation_data))
@@ -199,6 +202,20 @@ evaluationGenerator.create_batches()
 classes = np.asarray(data['label'].tolist())
 data = np.asarray(data['structured_path'].tolist())
 
+print_with_time("Getting values for normalization of all folds")
+folds_normalization_values = normalization_values.get_folds_normalization_values(
+    [data[testIndex] for trainIndex, testIndex in kf.split(data, classes)],
+    saved_file_names=[training_directory + parameters['fold_normalization_values_filename'].format(fold)
+                      for fold in range(kf.get_n_splits())])
+
+# The matrices are written once, and the generators of each fold normalize them with the fold values
+print_with_time("Preparing data matrices")
+lazy_normalization_temporary_data_path = training_directory + parameters['lazy_normalization_temporary_data_directory']
+matrices_columns = list(aux.columns)
+matrices_writer = Normalization(None, temporary_path=lazy_normalization_temporary_data_path, columns=matrices_columns)
+matrices_writer.normalize_files(data)
+matrices_data = np.array(matrices_writer.get_new_paths(data))
+
 fold = 0
 # ====================== Script that start training new models
 result_file_path = checkpoint_directory + parameters['result_filename']
@@ -215,36 +232,34 @@ with open(result_file_path, 'a+') as cvsFileHandler, open(eval_file_path, 'a+')
         print_with_time("Fold {}".format(fold))
         print_with_time("Getting values for normalization")
         # normalization_values = Normalization.get_normalization_values(data[trainIndex])
-        fold_normalization_values_path = training_directory + parameters['fold_normalization_values_filename'].format(fold)
-        values = normalization_values.get_normalization_values(data[trainIndex],
-                                                               saved_file_name=fold_normalization_values_path)
-        fold_normalization_temporary_data_path = training_directory + parameters['fold_normalization_temporary_data_directory'].format(fold)
-        normalizer = Normalization(values, temporary_path=fold_normalization_temporary_data_path)
-        print_with_time("Normalizing fold data")
-        normalizer.normalize_files(data)
-        normalized_data = np.array(normalizer.get_new_paths(data))
+        values = folds_normalization_values[fold]
+        transform = NormalizationTransform(values, matrices_columns, normalization_type=parameters['normalization_type'])
         print_with_time("Creating generators")
         # dataTrainGenerator = LongitudinalDataGenerator(normalized_data[trainIndex],
         #                                                classes[trainIndex], parameters['batchSize'])
         # dataTestGenerator = LongitudinalDataGenerator(normalized_data[testIndex],
         #                                               classes[testIndex], parameters['batchSize'])
 
-        training_events_sizes_file_path = training_directory + parameters['training_events_sizes_filename'].format(fold)
-        training_events_sizes_labels_file_path = training_directory + parameters['training_events_sizes_labels_filename'].format(fold)
-        testing_events_sizes_file_path = training_directory + parameters['testing_events_sizes_filename'].format(fold)
-        testing_events_sizes_labels_file_path = training_directory + parameters['testing_events_sizes_labels_filename'].format(fold)
+        # The sizes of the folds normalized in their own directories had the paths for those matrices
+        sizes_key = 'lazy_{}'.format(fold)
+        training_events_sizes_file_path = training_directory + parameters['training_events_sizes_filename'].format(sizes_key)
+        training_events_sizes_labels_file_path = training_directory + parameters['training_events_sizes_labels_filename'].format(sizes_key)
+        testing_events_sizes_file_path = training_directory + parameters['testing_events_sizes_filename'].format(sizes_key)
+        testing_events_sizes_labels_file_path = training_directory + parameters['testing_events_sizes_labels_filename'].format(sizes_key)
 
-        train_sizes, train_labels = functions.divide_by_events_lenght(normalized_data[trainIndex]
+        train_sizes, train_labels = functions.divide_by_events_lenght(matrices_data[trainIndex]
                                                                       , classes[trainIndex]
                                                                       , sizes_filename=training_events_sizes_file_path
                                                                       , classes_filename=training_events_sizes_labels_file_path)
-        test_sizes, test_labels = functions.divide_by_events_lenght(normalized_data[testIndex], classes[testIndex]
+        test_sizes, test_labels = functions.divide_by_events_lenght(matrices_data[testIndex], classes[testIndex]
                                                                     , sizes_filename = testing_events_sizes_file_path
                                                                     , classes_filename = testing_events_sizes_labels_file_path)
 
-        dataTrainGenerator = LengthLongitudinalDataGenerator(train_sizes, train_labels, max_batch_size=parameters['batchSize'])
+        dataTrainGenerator = LengthLongitudinalDataGenerator(train_sizes, train_labels, max_batch_size=parameters['batchSize'],
+                                                             transform=transform)
         dataTrainGenerator.create_batches()
-        dataTestGenerator = LengthLongitudinalDataGenerator(test_sizes, test_labels, max_batch_size=parameters['batchSize'])
+        dataTestGenerator = LengthLongitudinalDataGenerator(test_sizes, test_labels, max_batch_size=parameters['batchSize'],
+                                                            transform=transform)
         dataTestGenerator.create_batches()
         if not os.path.exists(trained_model_path):
             kerasAdapter = modelCreator.create(model_summary_filename=checkpoint_directory+'model_summary.txt')
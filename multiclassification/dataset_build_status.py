@@ -0,0 +1,44 @@
+"""
+Show which files of the dataset stages are stale, using the keys saved by the build cache: files whose stage code
+changed, or whose inputs were created again since them. These files are created again the next time their stage runs.
+"""
+import os
+
+import pandas as pd
+
+from resources.bucketing import get_buckets_dirname
+from resources.build_cache import read_manifest
+
+from multiclassification.parameters.dataset_parameters import parameters
+
+multiclassification_base_path = os.path.join(parameters['mimic_data_path'], parameters['multiclassification_directory'])
+
+stages_dirnames = [parameters['raw_events_dirname'].format(table_name)
+                   for table_name in ['noteevents', 'chartevents', 'labevents']]
+stages_dirnames += [parameters['merged_events_dirname'], parameters['features_filtered_dirname']]
+for resolution in parameters['buckets_resolutions']:
+    stages_dirnames.append(get_buckets_dirname(resolution, parameters['events_buckets_merged_dirname'],
+                                               parameters['events_hourly_merged_dirname']))
+    stages_dirnames.append(parameters['events_buckets_statistics_dirname'].format(resolution))
+stages_dirnames += [parameters['noteevents_anonymized_tokens_normalized'],
+                    parameters['noteevents_anonymized_tokens_normalized_preprocessed']]
+for resolution in parameters['buckets_resolutions']:
+    stages_dirnames.append(get_buckets_dirname(resolution, parameters['noteevents_buckets_merged_dirname'],
+                                               parameters['noteevents_hourly_merged_dirname']))
+stages_dirnames += [os.path.join(parameters['mortality_directory'], parameters['structured_dirname']),
+                    os.path.join(parameters['mortality_directory'], parameters['textual_dirname'])]
+
+status = []
+for stage_dirname in stages_dirnames:
+    stage_path = os.path.join(multiclassification_base_path, stage_dirname)
+    if not os.path.exists(stage_path):
+        continue
+    manifest = read_manifest(stage_path)
+    status.append({'directory': stage_dirname,
+                   'files': len(manifest),
+                   'stale': int(manifest['is_stale'].sum()),
+                   'missing': int((~manifest['exists'].astype(bool)).sum()),
+                   'code_changed': int(manifest['code_changed'].astype(bool).sum()),
+                   'inputs_changed': int(manifest['inputs_changed'].map(len).astype(bool).sum())})
+status = pd.DataFrame(status, columns=['directory', 'files', 'stale', 'missing', 'code_changed', 'inputs_changed'])
+print(status.to_string(index=False))
@@ -0,0 +1,63 @@
+"""
+Convert the csv files of the dataset stages that were already created to the format set at the
+stays_storage_format parameter, so the pipeline can continue from them without running the stages again.
+The csv files are kept, remove them after checking the converted ones.
+"""
+import os
+from functools import partial
+
+import pandas as pd
+
+from resources.progress import ProgressPool, report_progress
+from resources.scheduler import create_stays_tasks, get_stays_files_sizes
+from resources.storage import get_stay_storage, CSV_FORMAT
+
+# Columns that have the time of the events, stored as datetime so the next stages don't need to parse them
+TIME_COLUMNS = ['Unnamed: 0', 'starttime', 'endtime', 'charttime']
+
+
+def convert_files(icustay_ids, csv_storage=None, new_storage=None, datetime_pattern='%Y-%m-%d %H:%M:%S'):
+    for icustay_id in icustay_ids:
+        report_progress()
+        if new_storage.exists(icustay_id):
+            continue
+        events = csv_storage.read(icustay_id)
+        for column in TIME_COLUMNS:
+            # Text columns can be object or str, depending on the pandas version
+            if column in events.columns and (pd.api.types.is_object_dtype(events[column])
+                                             or pd.api.types.is_string_dtype(events[column])):
+                events[column] = pd.to_datetime(events[column], format=datetime_pattern)
+        new_storage.write(events, icustay_id, index=False)
+
+
+from multiclassification.parameters.dataset_parameters import parameters
+
+if parameters['stays_storage_format'] == CSV_FORMAT:
+    print("stays_storage_format is csv, nothing to convert")
+    exit()
+
+stages_dirnames = [parameters['raw_events_dirname'].format(table_name)
+                   for table_name in ['noteevents', 'chartevents', 'labevents']]
+stages_dirnames += [parameters['merged_events_dirname'], parameters['features_filtered_dirname'],
+                    parameters['events_hourly_merged_dirname'],
+                    parameters['noteevents_anonymized_tokens_normalized'],
+                    parameters['noteevents_anonymized_tokens_normalized_preprocessed'],
+                    parameters['noteevents_hourly_merged_dirname']]
+
+for stage_dirname in stages_dirnames:
+    stage_path = parameters['mimic_data_path'] + parameters['multiclassification_directory'] + stage_dirname
+    if not os.path.exists(stage_path):
+        continue
+    print("===== Converting {} =====".format(stage_dirname))
+    csv_storage = get_stay_storage(stage_path, CSV_FORMAT)
+    new_storage = get_stay_storage(stage_path, parameters['stays_storage_format'])
+    icustay_ids = csv_storage.icustay_ids()
+    total_files = len(icustay_ids)
+    if total_files == 0:
+        continue
+    with ProgressPool() as pool:
+        partial_convert_files = partial(convert_files, csv_storage=csv_storage, new_storage=new_storage,
+                                        datetime_pattern=parameters['datetime_pattern'])
+        pool.map(partial_convert_files,
+                 create_stays_tasks(icustay_ids, get_stays_files_sizes(icustay_ids, [csv_storage])), total_files)
+    print()
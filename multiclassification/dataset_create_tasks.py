@@ -0,0 +1,90 @@
+"""
+Create the episodes of all prediction tasks declared at the prediction_tasks parameter, reading the buckets of each
+icu stay only once. The episodes are references to the bucket files, so no bucket is copied.
+"""
+import os
+from functools import partial
+
+import pandas as pd
+
+from resources.progress import ProgressPool, report_progress
+from resources.scheduler import create_stays_tasks, get_stays_files_sizes
+from resources.storage import get_stay_storage
+from resources.tasks import TASK_COLUMNS, create_stay_episodes, create_tasks_specs
+
+
+def create_episodes(dataset, tasks=None, structured_events_storage=None, note_events_storage=None,
+                    datetime_pattern='%Y-%m-%d %H:%M:%S'):
+    """
+    Create the episodes of all tasks for the icu stays
+    :param dataset: the icu stays
+    :param tasks: the list of TaskSpec
+    :param structured_events_storage: the storage for the structured buckets
+    :param note_events_storage: the storage for the notes buckets
+    :param datetime_pattern: the pattern used to store time
+    :return: a dict from the task name to a DataFrame with the episodes of the icu stays
+    """
+    tasks_episodes = {task.name: [] for task in tasks}
+    for index, icustay in dataset.iterrows():
+        report_progress()
+        icustay_id = icustay['ICUSTAY_ID']
+        if not structured_events_storage.exists(icustay_id):
+            continue
+        textual_events = None
+        if note_events_storage.exists(icustay_id):
+            textual_events = note_events_storage.read(icustay_id)
+        stay_episodes = create_stay_episodes(tasks, icustay, structured_events_storage.read(icustay_id),
+                                             structured_events_storage.file_path(icustay_id),
+                                             textual_events=textual_events,
+                                             textual_path=note_events_storage.file_path(icustay_id),
+                                             datetime_pattern=datetime_pattern)
+        for task_name, episodes in stay_episodes.items():
+            if len(episodes) != 0:
+                tasks_episodes[task_name].append(episodes)
+    return {task_name: pd.concat(episodes) if len(episodes) != 0 else pd.DataFrame(columns=TASK_COLUMNS)
+            for task_name, episodes in tasks_episodes.items()}
+
+
+from multiclassification.parameters.dataset_parameters import parameters
+
+multiclassification_base_path = os.path.join(parameters['mimic_data_path'], parameters['multiclassification_directory'])
+structured_events_path = os.path.join(multiclassification_base_path, parameters['events_hourly_merged_dirname'])
+note_events_path = os.path.join(multiclassification_base_path, parameters['noteevents_hourly_merged_dirname'])
+tasks_path = os.path.join(multiclassification_base_path, parameters['tasks_directory'])
+if not os.path.exists(tasks_path):
+    os.mkdir(tasks_path)
+
+tasks = create_tasks_specs(parameters['prediction_tasks'])
+dataset = pd.read_csv(os.path.join(multiclassification_base_path, parameters['all_stays_csv_w_events']))
+if 'Unnamed: 0' in dataset.columns:
+    dataset = dataset.drop(columns=['Unnamed: 0'])
+dataset['INTIME'] = pd.to_datetime(dataset['INTIME'], format=parameters['datetime_pattern'])
+dataset['OUTTIME'] = pd.to_datetime(dataset['OUTTIME'], format=parameters['datetime_pattern'])
+dataset['DEATHTIME'] = pd.to_datetime(dataset['DEATHTIME'], format=parameters['datetime_pattern'])
+total_files = len(dataset)
+icustay_ids = list(dataset['ICUSTAY_ID'])
+structured_events_storage = get_stay_storage(structured_events_path, parameters['stays_storage_format'])
+note_events_storage = get_stay_storage(note_events_path, parameters['stays_storage_format'])
+dataset_for_mp = create_stays_tasks(dataset, get_stays_files_sizes(icustay_ids, [structured_events_storage,
+                                                                                 note_events_storage]))
+tasks_files = {task.name: open(os.path.join(tasks_path, task.name + '.csv'), 'w') for task in tasks}
+try:
+    for tasks_file in tasks_files.values():
+        pd.DataFrame(columns=TASK_COLUMNS).to_csv(tasks_file)
+    episodes_counts = {task.name: 0 for task in tasks}
+    with ProgressPool() as pool:
+        partial_create_episodes = partial(create_episodes, tasks=tasks,
+                                          structured_events_storage=structured_events_storage,
+                                          note_events_storage=note_events_storage,
+                                          datetime_pattern=parameters['datetime_pattern'])
+        # The episodes of each icu stay are written when they are ready, without keeping all of them
+        for tasks_episodes in pool.imap(partial_create_episodes, dataset_for_mp, total_files):
+            for task_name, episodes in tasks_episodes.items():
+                episodes.to_csv(tasks_files[task_name], header=False)
+                episodes_counts[task_name] += len(episodes)
+        print()
+finally:
+    for tasks_file in tasks_files.values():
+        tasks_file.close()
+for task_name, count in episodes_counts.items():
+    print(task_name, count)
@@ -3,9 +3,7 @@ Filter all events
 """
 
 import csv
-import multiprocessing as mp
 import os
-import sys
 from functools import partial
 from itertools import product
 
@@ -13,55 +11,101 @@ import numpy as np
 import pandas as pd
 
 from resources import functions
+from resources.build_cache import StageCache
+from resources.progress import ProgressPool, report_progress
+from resources.scheduler import create_stays_tasks, get_stays_los
+from resources.storage import get_stay_storage
 
 
-def filter_events(df_split, table_name, mimic_data_path="", manager_queue=None, events_dirname=""):
+def pivot_events(itemids, charttimes, values):
+    """
+    Build the charttime x itemid matrix of a patient in one pass.
+    Itemids are ordered by their first appearance, and charttimes by their first appearance following the itemids
+    order. When an itemid has more than one value at the same charttime, the last one is kept.
+    :param itemids: the itemid of each event
+    :param charttimes: the charttime of each event
+    :param values: the value of each event
+    :return: a pandas.DataFrame indexed by charttime, with one column for each itemid
+    """
+    events = pd.DataFrame({'itemid': itemids.values, 'charttime': charttimes.values, 'value': values.values})
+    itemids_order, columns = pd.factorize(events['itemid'])
+    events = events.iloc[np.argsort(itemids_order, kind='stable')]
+    index = pd.unique(events['charttime'])
+    events = events.drop_duplicates(subset=['itemid', 'charttime'], keep='last')
+    patient_data = events.pivot(index='charttime', columns='itemid', values='value')
+    patient_data = patient_data.reindex(index=index, columns=columns)
+    patient_data.index.name = None
+    patient_data.columns.name = 'itemid'
+    return patient_data
+
+
+def read_partitioned_events(partitioned_events_path, icustay_id):
+    """
+    Read the events of an icu stay from a table partitioned by dataset_partition_events.py
+    :param partitioned_events_path: the path for the partitioned dataset of the table
+    :param icustay_id: the icu stay
+    :return: a pandas.DataFrame with the events, or None if the icu stay has no events at the table
+    """
+    stay_events_path = partitioned_events_path + 'ICUSTAY_ID={}/'.format(icustay_id)
+    if not os.path.exists(stay_events_path):
+        return None
+    events_df = pd.read_parquet(stay_events_path)
+    # Missing text values are read as None, using nan as pd.read_csv does
+    text_columns = events_df.select_dtypes(exclude=['number', 'datetime']).columns
+    events_df.loc[:, text_columns] = events_df[text_columns].fillna(np.nan)
+    return events_df
+
+
+def filter_events(df_split, table_name, mimic_data_path="", events_dirname="",
+                  events_source="admission_csv", partitioned_events_dirname="", storage_format="csv",
+                  stage_caches=None):
     events_csv_path = mimic_data_path + table_name + '/'
-    filtered_events_file_path = mimic_data_path + events_dirname.format(table_name.lower())
+    partitioned_events_path = mimic_data_path + partitioned_events_dirname.format(table_name.lower())
+    filtered_events_storage = get_stay_storage(mimic_data_path + events_dirname.format(table_name.lower()),
+                                               storage_format=storage_format)
     # Loop through all patients that fits the sepsis 3 definition
     for index, row in df_split.iterrows():
-        if manager_queue is not None:
-            manager_queue.put(index)
-        # Ignore this icustay if already have their events filtered
-        filtered_events_file_name = filtered_events_file_path + '{}.csv'.format(row['ICUSTAY_ID'])
-        if os.path.exists(filtered_events_file_name):
-            continue
-        # If the file isn't found, ignore this admission
-        csv_events_file_name = events_csv_path + '{}_{}.csv'.format(table_name, row['HADM_ID'])
-        if not os.path.exists(csv_events_file_name):
+        report_progress()
+        if events_source == "partitioned":
+            events_input_path = partitioned_events_path + 'ICUSTAY_ID={}/'.format(row['ICUSTAY_ID'])
+        else:
+            events_input_path = events_csv_path + '{}_{}.csv'.format(table_name, row['HADM_ID'])
+        # Ignore this icustay if already have their events filtered from the same events
+        filtered_events_path = filtered_events_storage.file_path(row['ICUSTAY_ID'])
+        stay_key = stage_caches[table_name].get_key([events_input_path], values=[row['INTIME'], row['OUTTIME']])
+        if stage_caches[table_name].is_up_to_date(filtered_events_path, stay_key):
             continue
+        stage_caches[table_name].remove(filtered_events_path)
+        if events_source == "partitioned":
+            # If the icu stay has no partition, ignore it
+            events_df = read_partitioned_events(partitioned_events_path, row['ICUSTAY_ID'])
+            if events_df is None:
+                continue
+        else:
+            # If the file isn't found, ignore this admission
+            csv_events_file_name = events_csv_path + '{}_{}.csv'.format(table_name, row['HADM_ID'])
+            if not os.path.exists(csv_events_file_name):
+                continue
+            # Loading event csv
+            events_df = pd.read_csv(csv_events_file_name)
 
         intime = row['INTIME']
         outtime = row['OUTTIME']
-        events_in_patient = dict()
-        cut_poe = outtime
-        # Loading event csv
-        events_df = pd.read_csv(csv_events_file_name)
+        events_df.loc[:, 'CHARTTIME'] = pd.to_datetime(events_df['CHARTTIME'], format=datetime_pattern)
+        # Check which events are errors. As each table has their error columns, we pass the event label
+        is_error = functions.events_error_mask(table_name, events_df,
+                                               noteevent_category_to_delete=["discharge summary"])
         # Filter events that occurs between ICU intime and ICU outtime, as the csv corresponds to events that occurs
         # to all hospital admission
-        events_df.loc[:, 'CHARTTIME'] = pd.to_datetime(events_df['CHARTTIME'], format=datetime_pattern)
-        for index, event in events_df.iterrows():
-            # Check if event was an error.
-            # As each table has their error columns, we pass the event label to the check function
-            # If is a error, pass this event
-            if functions.event_is_error(table_name, event, noteevent_category_to_delete=["discharge summary"]):
-                continue
-            if event['CHARTTIME'] >= intime and event['CHARTTIME'] <= cut_poe:
-                event_timestamp = event['CHARTTIME']
-                itemid, event_value = functions.get_event_itemid_and_value(table_name, event)
-                # If the id is not in events yet, create it and assign a empty dictionary to it
-                if itemid not in events_in_patient.keys():
-                    events_in_patient[itemid] = dict()
-                    events_in_patient[itemid]['itemid'] = itemid
-                events_in_patient[itemid][event_timestamp] = event_value
-        patient_data = pd.DataFrame([])
-        for event_id in events_in_patient.keys():
-            events = pd.DataFrame(events_in_patient[event_id], index=[0])
-            patient_data = pd.concat([patient_data, events], ignore_index=True)
-        if len(patient_data) != 0:
-            patient_data = patient_data.set_index(['itemid'])
-            patient_data = patient_data.T
-            patient_data.to_csv(filtered_events_file_name, quoting=csv.QUOTE_NONNUMERIC)
+        is_in_icu = (events_df['CHARTTIME'] >= intime) & (events_df['CHARTTIME'] <= outtime)
+        events_df = events_df[~is_error & is_in_icu]
+        if len(events_df) != 0:
+            itemids, values = functions.get_events_itemid_and_values(table_name, events_df)
+            patient_data = pivot_events(itemids, events_df['CHARTTIME'], values)
+            # Saving sorted by time, so the next stage can merge the tables reading them as streams
+            patient_data = patient_data.sort_index(kind='stable')
+            filtered_events_storage.write(patient_data, row['ICUSTAY_ID'], quoting=csv.QUOTE_NONNUMERIC)
+            stage_caches[table_name].save_key(filtered_events_path, stay_key)
 
 
 from multiclassification.parameters.dataset_parameters import parameters
@@ -86,20 +130,27 @@ df = df.sort_values(by=['HADM_ID', 'INTIME'])
 sepsis3_hadm_ids = df['HADM_ID'].values
 total_files = len(df) * len(table_names)
 
-with mp.Pool(processes=6) as pool:
-    manager = mp.Manager()
-    queue = manager.Queue()
+stage_caches = dict()
+for table_name in table_names:
+    stage_caches[table_name] = StageCache('filter_events',
+                                          {'table_name': table_name,
+                                           'events_source': parameters['raw_events_source'],
+                                           'datetime_pattern': datetime_pattern},
+                                          ['multiclassification.dataset_filter_events', 'resources.functions',
+                                           'resources.storage'],
+                                          enabled=parameters['build_cache'])
+
+with ProgressPool() as pool:
     partial_filter_events = partial(filter_events,
-                                    mimic_data_path=mimic_data_path, manager_queue=queue,
+                                    mimic_data_path=mimic_data_path,
                                     events_dirname= parameters['multiclassification_directory'] \
-                                                        + parameters["raw_events_dirname"])
-    df_split = np.array_split(df, 10)
-    product_parameters = product(df_split, table_names)
-    # pool.starmap(partial_filter_events, product_parameters)
-    map_obj = pool.starmap_async(partial_filter_events, product_parameters)
-    consumed = 0
-    while not map_obj.ready():
-        for _ in range(queue.qsize()):
-            queue.get()
-            consumed += 1
-        sys.stderr.write('\rdone {0:%}'.format(consumed / total_files))
\ No newline at end of file
+                                                        + parameters["raw_events_dirname"],
+                                    events_source=parameters['raw_events_source'],
+                                    partitioned_events_dirname=parameters['multiclassification_directory'] \
+                                                               + parameters['partitioned_events_dirname'],
+                                    storage_format=parameters['stays_storage_format'],
+                                    stage_caches=stage_caches)
+    # The events files are not created yet, so the length of stay is used as the size of the stays
+    stays_tasks = create_stays_tasks(df, get_stays_los(df))
+    product_parameters = product(stays_tasks, table_names)
+    pool.starmap(partial_filter_events, product_parameters, total_files)
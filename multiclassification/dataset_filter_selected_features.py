@@ -1,60 +1,63 @@
 """
 Filter selected features ids in mimic dataset and gets statistical values about the filtered features
 """
-import multiprocessing as mp
 import os
 import pprint
 import sys
 from functools import partial
 
-import numpy as np
 import pandas as pd
 
+from resources.build_cache import StageCache
+from resources.concepts import compile_concepts, merge_concepts, load_concepts
+from resources.features_schema import align_events, create_features_schema, save_features_schema
+from resources.progress import ProgressPool, report_progress
+from resources.scheduler import create_stays_tasks, get_stays_files_sizes
+from resources.storage import get_stay_storage
 
-def filter_features(files_list, events_ids, dataset_filtered_files_path, manager_queue=None):
-    all_ids = []
-    for key in events_ids.keys():
-        all_ids.extend(events_ids[key])
+
+# Columns only used to derive other features, removed from the filtered events
+DERIVATION_ONLY_FEATURES = ["gcs_verbal", "gcs_motor", "gcs_eyes", "gcs_calc", "temperature_fahrenheit"]
+
+
+def get_filtered_features(events_ids):
+    """
+    Get the features of the filtered events, in the order they are saved
+    :param events_ids: the concepts used to filter the events
+    :return: the list of features
+    """
+    return [concept for concept in events_ids.keys() if concept not in DERIVATION_ONLY_FEATURES] + ['pulse_pressure']
+
+
+def filter_features(icustay_ids, events_ids, merged_events_storage, filtered_events_storage, itemids_concepts=None,
+                    stage_cache=None, schema=None):
+    # The itemids index can be created once for all the icu stays and given as itemids_concepts
+    if itemids_concepts is None:
+        itemids_concepts = compile_concepts(events_ids)
     data_statistic = dict()
-    for f in files_list:
-        if os.path.exists(dataset_filtered_files_path + os.path.basename(f)):
-            if manager_queue is not None:
-                manager_queue.put(f)
+    for key in events_ids.keys():
+        data_statistic[key] = dict()
+        data_statistic[key]["missing_patients"] = 0
+        data_statistic[key]["missing_events"] = 0
+        data_statistic[key]["total_events"] = 0
+    for icustay_id in icustay_ids:
+        report_progress()
+        filtered_events_path = filtered_events_storage.file_path(icustay_id)
+        stay_key = stage_cache.get_key([merged_events_storage.file_path(icustay_id)])
+        if stage_cache.is_up_to_date(filtered_events_path, stay_key):
             continue
-        patient_events = pd.read_csv(f)
-        ids_in_patients = ['Unnamed: 0']
-        for column in patient_events.columns:
-            if "Unnamed" in column:
-                continue
-            column_id = int(column.split('_')[1])
-            if column != 'Unnamed: 0' and column_id in all_ids:
-                ids_in_patients.append(column)
-            # except Exception as e:
-            #     print(e)
-            #     print(column)
-        patient_events = patient_events[ids_in_patients]
-        patient_events.loc[:, 'Unnamed: 0'] = pd.to_datetime(patient_events['Unnamed: 0'],
-                                                             format=parameters['datetime_pattern'])
+        patient_events = merged_events_storage.read(icustay_id)
+        patient_events['Unnamed: 0'] = pd.to_datetime(patient_events['Unnamed: 0'],
+                                                      format=parameters['datetime_pattern'])
         patient_events = patient_events.set_index(['Unnamed: 0'])
         # Transforming and getting the meaning of equal features with different ids
-        new_features = dict()
+        patient_events, missing_concepts = merge_concepts(patient_events, itemids_concepts, events_ids.keys())
+        for key in missing_concepts:
+            data_statistic[key]["missing_patients"] += 1
+        missing_events = patient_events.isna().sum()
         for key in events_ids.keys():
-            if key not in data_statistic.keys():
-                data_statistic[key] = dict()
-                data_statistic[key]["missing_patients"] = 0
-                data_statistic[key]["missing_events"] = 0
-                data_statistic[key]["total_events"] = 0
-            new_features[key] = patient_events[
-                [x for x in ids_in_patients if x != 'Unnamed: 0' and int(x.split('_')[1]) in events_ids[key]]
-            ]
-            if new_features[key].empty:
-                new_features[key] = pd.Series(np.nan, index=patient_events.index)
-                data_statistic[key]["missing_patients"] += 1
-            else:
-                new_features[key] = new_features[key].mean(axis=1, skipna=True)
-            data_statistic[key]["missing_events"] += len([x for x in new_features[key].isna() if x is True])
-            data_statistic[key]["total_events"] += len(new_features[key])
-        patient_events = pd.DataFrame(new_features)
+            data_statistic[key]["missing_events"] += int(missing_events[key])
+            data_statistic[key]["total_events"] += len(patient_events)
 
         patient_events['pulse_pressure'] = patient_events['systolic_blood_pressure'] \
             .sub(patient_events['diastolic_blood_pressure'], fill_value=0)
@@ -62,15 +65,13 @@ def filter_features(files_list, events_ids, dataset_filtered_files_path, manager
             patient_events['gcs_eyes'].add(patient_events['gcs_verbal'], fill_value=0)
             , fill_value = 0
         )
-        patient_events['gcs'] = patient_events.apply(lambda r: r['gcs_calc'] if pd.isna(r["gcs"]) else r['gcs'], axis=1)
-        patient_events.loc[:, 'temperature_fahrenheit'] = (patient_events['temperature_fahrenheit'] - 32) / 1.8
-        patient_events.loc[:, 'temperature_celsius'] = patient_events[['temperature_fahrenheit', 'temperature_celsius']]\
+        patient_events['gcs'] = patient_events['gcs'].fillna(patient_events['gcs_calc'])
+        patient_events['temperature_fahrenheit'] = (patient_events['temperature_fahrenheit'] - 32) / 1.8
+        patient_events['temperature_celsius'] = patient_events[['temperature_fahrenheit', 'temperature_celsius']]\
             .mean(axis=1, skipna=True)
-        patient_events = patient_events.drop(
-            columns=["gcs_verbal", "gcs_motor", "gcs_eyes", "gcs_calc", "temperature_fahrenheit"])
-        patient_events.to_csv(dataset_filtered_files_path + os.path.basename(f))
-        if manager_queue is not None:
-            manager_queue.put(f)
+        patient_events = align_events(patient_events, schema)
+        filtered_events_storage.write(patient_events, icustay_id)
+        stage_cache.save_key(filtered_events_path, stay_key)
     return data_statistic
 
 pd.set_option('display.max_rows', None)
@@ -83,6 +84,8 @@ dataset_filtered_files_path = parameters['mimic_data_path'] + parameters['multic
                                 + parameters['features_filtered_dirname']
 if not os.path.exists(dataset_filtered_files_path):
     os.mkdir(dataset_filtered_files_path)
+merged_events_storage = get_stay_storage(dataset_merged_files_path, parameters['stays_storage_format'])
+filtered_events_storage = get_stay_storage(dataset_filtered_files_path, parameters['stays_storage_format'])
 
 events_ids = {
     "systolic_blood_pressure" : [6, 51, 442, 455, 3313, 3315, 3317, 3321, 3323, 6701, 224167, 227243, 220050, 220179, 225309],
@@ -114,31 +117,34 @@ events_ids = {
     "gcs_motor" : [454, 223901],
     "gcs_eyes" : [184, 220739]
 }
+if parameters['features_concepts_file'] is not None:
+    events_ids = load_concepts(parameters['features_concepts_file'])
 
+stage_cache = StageCache('filter_selected_features',
+                         {'events_ids': events_ids, 'datetime_pattern': parameters['datetime_pattern']},
+                         ['multiclassification.dataset_filter_selected_features', 'resources.concepts',
+                          'resources.features_schema', 'resources.storage'],
+                         enabled=parameters['build_cache'])
 
+# The filtered events of all icu stays have the same columns, registered once for the stages that read them
+schema = create_features_schema(get_filtered_features(events_ids), key_columns=['Unnamed: 0'])
+save_features_schema(schema, dataset_filtered_files_path)
 
-files_list = [dataset_merged_files_path + x for x in os.listdir(dataset_merged_files_path)]
-total_files = len(files_list)
-with mp.Pool(processes=6) as pool:
-    manager = mp.Manager()
-    queue = manager.Queue()
+icustay_ids = merged_events_storage.icustay_ids()
+total_files = len(icustay_ids)
+with ProgressPool() as pool:
     # Generate data to be used by the processes
-    files_list = np.array_split(files_list, 10)
+    icustay_ids = create_stays_tasks(icustay_ids, get_stays_files_sizes(icustay_ids, [merged_events_storage]))
     # Creating a partial maintaining some arguments with fixed values
     partial_filter_features = partial(filter_features,
-                                      dataset_filtered_files_path=dataset_filtered_files_path,
+                                      merged_events_storage=merged_events_storage,
+                                      filtered_events_storage=filtered_events_storage,
                                       events_ids=events_ids,
-                                      manager_queue=queue)
+                                      itemids_concepts=compile_concepts(events_ids),
+                                      stage_cache=stage_cache,
+                                      schema=schema)
     print("===== Filtering events =====")
-    # Using starmap to pass the tuple as separated parameters to the functions
-    map_obj = pool.map_async(partial_filter_features, files_list)
-    consumed = 0
-    while not map_obj.ready():
-        for _ in range(queue.qsize()):
-            queue.get()
-            consumed += 1
-        sys.stderr.write('\rdone {0:%}'.format(consumed / total_files))
-    results = map_obj.get()
+    results = pool.map(partial_filter_features, icustay_ids, total_files)
     statistics = dict()
     for result in results:
         for key in result.keys():
@@ -154,23 +160,22 @@ with mp.Pool(processes=6) as pool:
     data_csv = pd.read_csv(parameters['mimic_data_path'] + parameters['multiclassification_directory']
                            + parameters['all_stays_csv'])
     data_csv = data_csv.set_index(['ICUSTAY_ID'])
-    new_files_list = [dataset_filtered_files_path + x for x in os.listdir(dataset_filtered_files_path)]
+    new_icustay_ids = filtered_events_storage.icustay_ids()
     print("==== Removing patients with no events ====")
     consumed = 0
     icustay_to_remove = []
-    for f in new_files_list:
+    for icustay_id in new_icustay_ids:
         sys.stderr.write('\rdone {0:%}'.format(consumed / total_files))
-        icustay_id = int(os.path.basename(f).split('.')[0])
-        new_patient_events = pd.read_csv(f)
+        new_patient_events = filtered_events_storage.read(icustay_id)
         # Don't have any events from insight, remove it from the csv and delete the file
         if new_patient_events.dropna(how='all').empty:
-            os.remove(f)
+            stage_cache.remove(filtered_events_storage.file_path(icustay_id))
             if icustay_id in data_csv.index:
                 icustay_to_remove.append(icustay_id)
         else:
             # if not empty, do the na filling of values
             # new_patient_events = new_patient_events.ffill().bfill()
-            new_patient_events.to_csv(f, index=False)
+            filtered_events_storage.write(new_patient_events, icustay_id, index=False)
         consumed += 1
     print("Patients with empty events: {} ".format(len(icustay_to_remove)))
     data_csv = data_csv.drop(icustay_to_remove)
@@ -1,15 +1,17 @@
 """
 Creates the binary columns for nominal data, adding the columns that doesn't appear at each patients events
 """
-import csv
-import multiprocessing as mp
 import os
-import sys
 from functools import partial
 
-import numpy
 import pandas as pd
 
+from resources.build_cache import StageCache
+from resources.events_merge import UnsortedEventsError, merge_events_in_memory, stream_merge_events
+from resources.progress import ProgressPool, report_progress
+from resources.scheduler import create_stays_tasks, get_stays_files_sizes
+from resources.storage import get_stay_storage
+
 parametersFilePath = "parameters.json"
 
 #Loading parameters file
@@ -29,56 +31,44 @@ labevents_files_path= mimic_data_path + parameters['multiclassification_director
 dataset_csv = pd.read_csv(parameters['mimic_data_path'] + parameters['multiclassification_directory']
                           + parameters['all_stays_csv'])
 
-def merge_events(icustay_ids, chartevents_files_path, labevents_files_path, new_events_files_path, datetime_pattern,
-                 manager_queue=None):
+def merge_events(icustay_ids, chartevents_storage, labevents_storage, new_events_storage, datetime_pattern,
+                 stage_cache=None):
     for icustay_id in icustay_ids:
-        if not os.path.exists(new_events_files_path+'{}.csv'.format(icustay_id)) :
-            if os.path.exists(chartevents_files_path + '{}.csv'.format(icustay_id)):
-                chartevents = pd.read_csv(chartevents_files_path + '{}.csv'.format(icustay_id))
-                chartevents.loc[:, 'Unnamed: 0'] = pd.to_datetime(chartevents['Unnamed: 0'], format=datetime_pattern)
-                chartevents = chartevents.set_index(["Unnamed: 0"])
-            else:
-                chartevents = None
-            if os.path.exists(labevents_files_path + '{}.csv'.format(icustay_id)):
-                labevents = pd.read_csv(labevents_files_path + '{}.csv'.format(icustay_id))
-                labevents.loc[:, 'Unnamed: 0'] = pd.to_datetime(labevents['Unnamed: 0'], format=datetime_pattern)
-                labevents = labevents.set_index(["Unnamed: 0"])
-            else:
-                labevents = None
-            if chartevents is None and labevents is None:
+        report_progress()
+        new_events_path = new_events_storage.file_path(icustay_id)
+        stay_key = stage_cache.get_key([chartevents_storage.file_path(icustay_id),
+                                        labevents_storage.file_path(icustay_id)])
+        if not stage_cache.is_up_to_date(new_events_path, stay_key):
+            stage_cache.remove(new_events_path)
+            if not chartevents_storage.exists(icustay_id) and not labevents_storage.exists(icustay_id):
                 continue
-            if chartevents is None:
-                chartevents = pd.DataFrame([])
-            if labevents is None:
-                labevents = pd.DataFrame([])
-            chartevents = chartevents.add_prefix('chartevents_')
-            labevents = labevents.add_prefix('labevents_')
-            events = pd.merge(chartevents, labevents, how='outer', left_index=True, right_index=True)
-            if 'labevents_Unnamed: 0' in events.columns:
-                events = events.drop(columns=['labevents_Unnamed: 0'])
-            if 'chartevents_Unnamed: 0' in events.columns:
-                events = events.drop(columns=['chartevents_Unnamed: 0'])
-            events.to_csv(new_events_files_path + '{}.csv'.format(icustay_id), quoting=csv.QUOTE_NONNUMERIC)
-            if manager_queue is not None:
-                manager_queue.put(icustay_id)
+            try:
+                stream_merge_events(icustay_id, chartevents_storage, labevents_storage, new_events_storage,
+                                    datetime_pattern)
+            except UnsortedEventsError:
+                merge_events_in_memory(icustay_id, chartevents_storage, labevents_storage, new_events_storage,
+                                       datetime_pattern)
+            stage_cache.save_key(new_events_path, stay_key)
 
 total_files = len(dataset_csv)
+chartevents_storage = get_stay_storage(chartevents_files_path, parameters['stays_storage_format'])
+labevents_storage = get_stay_storage(labevents_files_path, parameters['stays_storage_format'])
 # Using as arg only the icustay_id, bc of fixating the others parameters
-args = numpy.array_split(list(dataset_csv['ICUSTAY_ID']), 10)
+icustay_ids = list(dataset_csv['ICUSTAY_ID'])
+args = create_stays_tasks(icustay_ids,
+                          get_stays_files_sizes(icustay_ids, [chartevents_storage, labevents_storage]))
 # Creating a partial maintaining some arguments with fixed values
-with mp.Pool(processes=6) as pool:
-    m = mp.Manager()
-    queue = m.Queue()
+with ProgressPool() as pool:
     partial_merge_events = partial(merge_events,
-                                   chartevents_files_path=chartevents_files_path,
-                                   labevents_files_path=labevents_files_path,
-                                   new_events_files_path=new_events_files_path,
+                                   chartevents_storage=chartevents_storage,
+                                   labevents_storage=labevents_storage,
+                                   new_events_storage=get_stay_storage(new_events_files_path,
+                                                                       parameters['stays_storage_format']),
                                    datetime_pattern=parameters['datetime_pattern'],
-                                   manager_queue=queue)
-    map_obj = pool.map_async(partial_merge_events, args)
-    consumed = 0
-    while not map_obj.ready():
-        for _ in range(queue.qsize()):
-            queue.get()
-            consumed += 1
-        sys.stderr.write('\rdone {0:%}'.format(consumed / total_files))
\ No newline at end of file
+                                   stage_cache=StageCache('merge_chartevents_labevents',
+                                                          {'datetime_pattern': parameters['datetime_pattern']},
+                                                          ['multiclassification.dataset_merge_chartevents_labevents',
+                                                           'resources.events_merge',
+                                                           'resources.storage'],
+                                                          enabled=parameters['build_cache']))
+    pool.map(partial_merge_events, args, total_files)
@@ -1,70 +1,123 @@
 """
-This script will merge all events that occur at the same hour (taking patient's intime at the icu as the start),
+This script will merge all events that occur at the same time bucket (taking patient's intime at the icu as the start),
 into one events, using the mean of the values at this window.
+The buckets are created for each size at the buckets_resolutions parameter, reading the events only once:
+the count, sum, min and max of the events at the smallest buckets are saved, and the bigger buckets are
+created by merging them.
 This script will also remove any patient file that doesn't have any events.
 """
-import multiprocessing as mp
 import os
-import sys
 from datetime import timedelta
 from functools import partial
 
 import numpy
 import pandas as pd
 
+from resources.bucketing import get_buckets_statistics, merge_buckets_statistics, statistics_to_buckets, \
+    get_buckets_dirname, get_buckets_statistics_columns, get_num_buckets
+from resources.build_cache import StageCache
+from resources.features_schema import align_events, create_features_schema, load_features_schema, \
+    save_features_schema
+from resources.progress import ProgressPool, report_progress
+from resources.scheduler import create_stays_tasks, get_stays_files_sizes
+from resources.storage import get_stay_storage
 
-def process_events(dataset, events_path, new_events_path, datetime_pattern='%Y-%m-%d %H:%M:%S',
-                   manager_queue=None):
+
+def get_stay_statistics(patient, events_storage, statistics_storage, starttime, cut_time, window,
+                        datetime_pattern='%Y-%m-%d %H:%M:%S', stage_cache=None, stay_key=None):
+    """
+    Get the statistics of the events of an icu stay for buckets of size window, using the saved ones
+    when they are up to date, cover all the buckets until cut_time and have the columns of the events
+    :param patient: the icu stay
+    :param events_storage: the storage for the events
+    :param statistics_storage: the storage for the statistics, None to not save them, as when only one resolution
+    is created and they are not used again
+    :param starttime: the start of the first bucket
+    :param cut_time: the time where the buckets stop
+    :param window: the size of the buckets
+    :param datetime_pattern: the pattern used to store time
+    :param stage_cache: the StageCache of the stage
+    :param stay_key: the key of the icu stay at the stage
+    :return: the statistics, indexed by bucket
+    """
+    if statistics_storage is not None:
+        statistics_path = statistics_storage.file_path(patient['ICUSTAY_ID'])
+        if stage_cache.is_up_to_date(statistics_path, stay_key):
+            statistics = statistics_storage.read(patient['ICUSTAY_ID']).set_index('bucket')
+            # The time column has no name at the header of the csv files
+            events_columns = [column for column, _ in events_storage.columns_types(patient['ICUSTAY_ID'])
+                              if column not in ['', 'Unnamed: 0']]
+            if len(statistics) == get_num_buckets(starttime, cut_time, window=window) \
+                    and list(statistics.columns) == get_buckets_statistics_columns(events_columns):
+                return statistics
+    events = events_storage.read(patient['ICUSTAY_ID'])
+    # Unnamed: 0 here represents the time for the events
+    events['Unnamed: 0'] = pd.to_datetime(events['Unnamed: 0'], format=datetime_pattern)
+    statistics = get_buckets_statistics(events, starttime, cut_time, time_column='Unnamed: 0', window=window)
+    if statistics_storage is not None:
+        statistics_storage.write(statistics, patient['ICUSTAY_ID'])
+        stage_cache.save_key(statistics_path, stay_key)
+    return statistics
+
+
+def get_buckets_schema(events_schema):
+    """
+    Get the schema of the buckets created from events with a schema
+    :param events_schema: the schema of the events
+    :return: the schema with the mean, min and max of each events column
+    """
+    columns = [column + suffix for column in events_schema['columns'] for suffix in ['', '_min', '_max']]
+    return create_features_schema(columns, key_columns=['starttime', 'endtime', 'bucket'])
+
+
+def process_events(dataset, events_storage, statistics_storage, new_events_storages,
+                   datetime_pattern='%Y-%m-%d %H:%M:%S', stage_cache=None, schema=None):
+    """
+    Create the buckets of each icu stay for all resolutions
+    :param dataset: the icu stays
+    :param events_storage: the storage for the filtered events
+    :param statistics_storage: the storage for the statistics of the smallest buckets, None to not save them
+    :param new_events_storages: a dict from the buckets size, in minutes, to the storage for these buckets
+    :param datetime_pattern: the pattern used to store time
+    :param stage_cache: the StageCache of the stage
+    :param schema: the schema of the buckets, None when the events don't have one
+    :return: the icu stays that don't have any bucket
+    """
     icustays_to_remove = []
+    resolutions = sorted(new_events_storages.keys())
+    window = timedelta(minutes=resolutions[0])
     for index, patient in dataset.iterrows():
-        if not os.path.exists(events_path+'{}.csv'.format(patient['ICUSTAY_ID'])) or \
-                    os.path.exists(new_events_path+'{}.csv'.format(patient['ICUSTAY_ID'])):
+        report_progress()
+        if not events_storage.exists(patient['ICUSTAY_ID']):
+            continue
+        new_events_paths = [new_events_storages[resolution].file_path(patient['ICUSTAY_ID'])
+                            for resolution in resolutions]
+        stay_key = stage_cache.get_key([events_storage.file_path(patient['ICUSTAY_ID'])],
+                                       values=[patient['INTIME'], patient['OUTTIME']])
+        if all(stage_cache.is_up_to_date(path, stay_key) for path in new_events_paths):
             continue
-        events = pd.read_csv(events_path+'{}.csv'.format(patient['ICUSTAY_ID']))
-        # Unnamed: 0 here represents the time for the events
-        events.loc[:, 'Unnamed: 0'] = pd.to_datetime(events['Unnamed: 0'], format=datetime_pattern)
-        # events.loc[: 'starttime']
+        for path in new_events_paths:
+            stage_cache.remove(path)
         starttime = patient['INTIME'].replace(minute=0, second=0)
-        buckets = []
-        cut_time = patient['OUTTIME']
-        bucket_num = 0
-        while starttime < cut_time:
-            endtime = starttime + timedelta(hours=1)
-            bucket = dict()
-            bucket['starttime'] = starttime
-            bucket['endtime'] = endtime
-            bucket['bucket'] = bucket_num
-            bucket_events = events[(events['Unnamed: 0'] > starttime) & (events['Unnamed: 0'] <= endtime)]
-            for column in bucket_events.columns:
-                if column == 'Unnamed: 0':
-                    continue
-                # if '_categorical' in column \
-                #     or '_categorical' not in column and '_numeric' not in column and len(column.split('_')) >= 3:
-                #     if 1 in bucket_events[column].tolist():
-                #         bucket[column] = 1
-                #     else:
-                #         bucket[column] = 0
-                # else:
-                values = bucket_events[column].dropna().tolist()
-                if len(values) != 0:
-                    bucket[column] = sum(values)/len(values)
-                    bucket[column + "_min"] = min(values)
-                    bucket[column + "_max"] = max(values)
-                else:
-                    bucket[column] = numpy.nan
-                    bucket[column + "_min"] = numpy.nan
-                    bucket[column + "_max"] = numpy.nan
-            buckets.append(bucket)
-            starttime += timedelta(hours=1)
-            bucket_num += 1
-        buckets = pd.DataFrame(buckets)
-        buckets = buckets.sort_values(by=['starttime'])
-        if buckets.empty:
-            icustays_to_remove.append(patient['ICUSTAY_ID'])
-        else:
-            buckets.to_csv(new_events_path+'{}.csv'.format(patient['ICUSTAY_ID']))
-        if manager_queue is not None:
-            manager_queue.put(index)
+        # The last bucket of each resolution has the events until its endtime, even after OUTTIME,
+        # so the smallest buckets must go until the end of the last biggest bucket
+        biggest_window = timedelta(minutes=resolutions[-1])
+        cut_time = starttime + get_num_buckets(starttime, patient['OUTTIME'], window=biggest_window) * biggest_window
+        statistics = get_stay_statistics(patient, events_storage, statistics_storage, starttime, cut_time, window,
+                                         datetime_pattern=datetime_pattern, stage_cache=stage_cache,
+                                         stay_key=stay_key)
+        for resolution in resolutions:
+            new_window = timedelta(minutes=resolution)
+            resolution_statistics = merge_buckets_statistics(statistics, starttime, patient['OUTTIME'], window,
+                                                             new_window)
+            buckets = statistics_to_buckets(resolution_statistics, starttime, window=new_window)
+            if buckets.empty:
+                icustays_to_remove.append(patient['ICUSTAY_ID'])
+                break
+            if schema is not None:
+                buckets = align_events(buckets, schema)
+            new_events_storages[resolution].write(buckets, patient['ICUSTAY_ID'])
+            stage_cache.save_key(new_events_storages[resolution].file_path(patient['ICUSTAY_ID']), stay_key)
     return icustays_to_remove
 
 
@@ -72,10 +125,32 @@ from multiclassification.parameters.dataset_parameters import parameters
 
 events_path =  parameters['mimic_data_path'] + parameters['multiclassification_directory'] \
                + parameters['features_filtered_dirname']
-new_events_path = parameters['mimic_data_path'] + parameters['multiclassification_directory'] \
-                  + parameters['events_hourly_merged_dirname']
-if not os.path.exists(new_events_path):
-    os.mkdir(new_events_path)
+resolutions = sorted(parameters['buckets_resolutions'])
+for resolution in resolutions:
+    if resolution % resolutions[0] != 0:
+        raise ValueError("Buckets of {} minutes can't be created from buckets of {} minutes"
+                         .format(resolution, resolutions[0]))
+new_events_storages = dict()
+for resolution in resolutions:
+    new_events_path = parameters['mimic_data_path'] + parameters['multiclassification_directory'] \
+                      + get_buckets_dirname(resolution, parameters['events_buckets_merged_dirname'],
+                                            parameters['events_hourly_merged_dirname'])
+    if not os.path.exists(new_events_path):
+        os.mkdir(new_events_path)
+    new_events_storages[resolution] = get_stay_storage(new_events_path, parameters['stays_storage_format'])
+# The statistics are only saved to create the other resolutions again without reading the events
+statistics_storage = None
+if len(resolutions) > 1:
+    statistics_path = parameters['mimic_data_path'] + parameters['multiclassification_directory'] \
+                      + parameters['events_buckets_statistics_dirname'].format(resolutions[0])
+    if not os.path.exists(statistics_path):
+        os.mkdir(statistics_path)
+    statistics_storage = get_stay_storage(statistics_path, parameters['stays_storage_format'])
+schema = load_features_schema(events_path)
+if schema is not None:
+    schema = get_buckets_schema(schema)
+    for new_events_storage in new_events_storages.values():
+        save_features_schema(schema, new_events_storage.path)
 
 dataset = pd.read_csv(parameters['mimic_data_path'] + parameters['multiclassification_directory']
                       + parameters['all_stays_csv_w_events'])
@@ -85,20 +160,24 @@ dataset.loc[:, 'OUTTIME'] = pd.to_datetime(dataset['OUTTIME'], format=parameters
 original_len = len(dataset)
 total_files = len(dataset)
 icustay_ids = list(dataset['ICUSTAY_ID'])
-dataset_for_mp = numpy.array_split(dataset, 10)
+events_storage = get_stay_storage(events_path, parameters['stays_storage_format'])
+dataset_for_mp = create_stays_tasks(dataset, get_stays_files_sizes(icustay_ids, [events_storage]))
 
 
-with mp.Pool(processes=6) as pool:
-    m = mp.Manager()
-    queue = m.Queue()
-    partial_normalize_files = partial(process_events, events_path=events_path, new_events_path=new_events_path,
-                                  manager_queue=queue)
-    map_obj = pool.map_async(partial_normalize_files, dataset_for_mp)
-    consumed = 0
-    while not map_obj.ready():
-        for _ in range(queue.qsize()):
-            queue.get()
-            consumed += 1
-        sys.stderr.write('\rdone {0:%}'.format(consumed / total_files))
-    result = map_obj.get()
+with ProgressPool() as pool:
+    partial_normalize_files = partial(process_events,
+                                      events_storage=events_storage,
+                                      statistics_storage=statistics_storage,
+                                      new_events_storages=new_events_storages,
+                                      datetime_pattern=parameters['datetime_pattern'],
+                                      stage_cache=StageCache('merge_hourly_events',
+                                                             {'buckets_resolutions': resolutions,
+                                                              'datetime_pattern': parameters['datetime_pattern'],
+                                                              'schema': schema},
+                                                             ['multiclassification.dataset_merge_hourly_events',
+                                                              'resources.bucketing', 'resources.features_schema',
+                                                              'resources.storage'],
+                                                             enabled=parameters['build_cache']),
+                                      schema=schema)
+    result = pool.map(partial_normalize_files, dataset_for_mp, total_files)
     result = numpy.concatenate(result, axis=0)
@@ -1,46 +1,67 @@
-import multiprocessing as mp
 import os
 import re
-import sys
-from functools import partial
+from functools import lru_cache, partial
 
-import numpy
 import pandas as pd
 
+from resources.build_cache import StageCache
+from resources.progress import ProgressPool, report_progress
+from resources.scheduler import create_stays_tasks, get_stays_files_sizes
+from resources.storage import get_stay_storage
 
-def get_replacements(tokens):
-    replacements = dict()
-    for token in tokens:
-        if re.match("\d*-\d*-\d*", token):
-            replacement = "date"
-        elif re.match("\d*-\d*", token):
-            replacement = ""
-        elif re.match("^[0-9 ]+$", token.strip()):
-            replacement = "number"
-        else:
-            replacement = re.sub("[\(\[].*?[\)\]]", "", token)
-            replacement = replacement.lower().replace(" ", "")
-            replacement = ''.join(e for e in replacement if e.isalpha())
-        replacements["[**{}**]".format(token)] = "[**{}**]".format(replacement)
-    return replacements
 
+# The tokens that the MIMIC-III anonymization put in place of the private data, as [**Hospital 1**]
+ANONYMIZED_TOKEN_PATTERN = re.compile(r'\[\*\*(.*?)\*\*\]')
+DATE_TOKEN_PATTERN = re.compile(r"\d*-\d*-\d*")
+PARTIAL_DATE_TOKEN_PATTERN = re.compile(r"\d*-\d*")
+NUMBER_TOKEN_PATTERN = re.compile(r"^[0-9 ]+$")
+BRACKETS_PATTERN = re.compile(r"[\(\[].*?[\)\]]")
 
-def process_notes(icustays, noteevents_data_path=None, new_noteevents_path=None, manager_queue=None):
+
+@lru_cache(maxsize=None)
+def get_replacement(token):
+    """
+    Get the category that replaces an anonymized token: date, number, empty for partial dates, or the token name
+    without its numbers, as hospital for [**Hospital 1**]. The replacements are kept for all notes of the process,
+    as the same tokens appear in many notes.
+    :param token: the text inside the token brackets
+    :return: the token with the category inside the brackets
+    """
+    if DATE_TOKEN_PATTERN.match(token):
+        replacement = "date"
+    elif PARTIAL_DATE_TOKEN_PATTERN.match(token):
+        replacement = ""
+    elif NUMBER_TOKEN_PATTERN.match(token.strip()):
+        replacement = "number"
+    else:
+        replacement = BRACKETS_PATTERN.sub("", token)
+        replacement = replacement.lower().replace(" ", "")
+        replacement = ''.join(e for e in replacement if e.isalpha())
+    return "[**{}**]".format(replacement)
+
+
+def anonymize_notes(notes):
+    """
+    Replace the anonymized tokens of the notes by their categories, with one pass over each note
+    :param notes: a pandas.Series with the notes text
+    :return: the notes with the tokens replaced
+    """
+    return notes.str.replace(ANONYMIZED_TOKEN_PATTERN, lambda match: get_replacement(match.group(1)), regex=True)
+
+
+def process_notes(icustays, noteevents_storage=None, new_noteevents_storage=None, stage_cache=None):
     for icustay in icustays:
-        if manager_queue is not None:
-            manager_queue.put(icustay)
-        if not os.path.exists(noteevents_data_path + "{}.csv".format(icustay)):
+        report_progress()
+        if not noteevents_storage.exists(icustay):
+            continue
+        new_noteevents_path = new_noteevents_storage.file_path(icustay)
+        stay_key = stage_cache.get_key([noteevents_storage.file_path(icustay)])
+        if stage_cache.is_up_to_date(new_noteevents_path, stay_key):
             continue
-        patient_noteevents = pd.read_csv(noteevents_data_path + "{}.csv".format(icustay))
-        new_noteevents = []
-        for index, row in patient_noteevents.iterrows():
-            tokens = re.findall(r'\[\*\*(.*?)\*\*\]', row['Note'])
-            replacements = get_replacements(tokens)
-            for token, replacement in replacements.items():
-                row['Note'] = row['Note'].replace(token, replacement)
-            new_noteevents.append(row.copy())
-        new_noteevents = pd.DataFrame(new_noteevents)
-        new_noteevents.to_csv(new_noteevents_path + "{}.csv".format(icustay), index=False)
+        new_noteevents = noteevents_storage.read(icustay)
+        new_noteevents['Note'] = anonymize_notes(new_noteevents['Note'])
+        new_noteevents_storage.write(new_noteevents, icustay, index=False)
+        stage_cache.save_key(new_noteevents_path, stay_key)
 
 
 from multiclassification.parameters.dataset_parameters import parameters
@@ -49,26 +70,23 @@ dataset = pd.read_csv(parameters['mimic_data_path'] + parameters['multiclassific
                       + parameters['all_stays_csv_w_events'])
 noteevents_data_path = parameters['mimic_data_path'] + parameters['multiclassification_directory'] \
                        + parameters['raw_events_dirname'].format('noteevents')
+noteevents_storage = get_stay_storage(noteevents_data_path, parameters['stays_storage_format'])
 icustays = dataset['ICUSTAY_ID'].tolist()
-icustays = numpy.array_split(icustays, 10)
+icustays = create_stays_tasks(icustays, get_stays_files_sizes(icustays, [noteevents_storage]))
 new_events_path = parameters['mimic_data_path'] + parameters['multiclassification_directory']  \
                               + parameters['noteevents_anonymized_tokens_normalized']
 if not os.path.exists(new_events_path):
     os.mkdir(new_events_path)
 
-with mp.Pool(processes=4) as pool:
-    m = mp.Manager()
-    queue = m.Queue()
+with ProgressPool() as pool:
     partial_process_notes = partial(process_notes,
-                                    noteevents_data_path=noteevents_data_path,
-                                    new_noteevents_path=new_events_path,
-                                    manager_queue=queue)
+                                    noteevents_storage=noteevents_storage,
+                                    new_noteevents_storage=get_stay_storage(new_events_path,
+                                                                            parameters['stays_storage_format']),
+                                    stage_cache=StageCache('notes_anonymized_tokens', {},
+                                                           ['multiclassification.dataset_notes_anonymized_tokens',
+                                                            'resources.storage'],
+                                                           enabled=parameters['build_cache']))
 
     print("===== Processing events =====")
-    map_obj = pool.map_async(partial_process_notes, icustays)
-    consumed = 0
-    while not map_obj.ready():
-        for _ in range(queue.qsize()):
-            queue.get()
-            consumed += 1
-        sys.stderr.write('\rdone {0:%}'.format(consumed / len(dataset)))
+    pool.map(partial_process_notes, icustays, len(dataset))
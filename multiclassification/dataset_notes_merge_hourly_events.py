@@ -1,56 +1,82 @@
 """
-This script will concatenate all noteevents that occur at the same hour (taking patient's intime at the icu as the start),
-into one events, using the mean of the values at this window.
+This script will concatenate all noteevents that occur at the same time bucket (taking patient's intime at the icu
+as the start), into one events, joining the text of the notes at this window.
+The buckets are created for each size at the buckets_resolutions parameter, reading the notes only once.
 This script will also remove any patient file that doesn't have any events.
 """
-import multiprocessing as mp
 import os
-import sys
 from datetime import timedelta
 from functools import partial
 
 import numpy
 import pandas as pd
 
+from resources.bucketing import create_buckets_frame, get_buckets_dirname, get_events_buckets, get_num_buckets
+from resources.build_cache import StageCache
+from resources.progress import ProgressPool, report_progress
+from resources.scheduler import create_stays_tasks, get_stays_files_sizes
+from resources.storage import get_stay_storage
 
-def process_events(dataset, events_path, new_events_path, datetime_pattern='%Y-%m-%d %H:%M:%S',
-                   manager_queue=None):
+
+def merge_notes_in_buckets(events, starttime, cut_time, window=timedelta(hours=1)):
+    """
+    Concatenate the text of the notes inside each bucket of size window, from starttime until cut_time.
+    Buckets without text are left out, as well as the notes with any missing value.
+    :param events: the notes, with their time at charttime and their text at preprocessed_note
+    :param starttime: the start of the first bucket
+    :param cut_time: the time where the buckets stop
+    :param window: the size of the buckets
+    :return: a DataFrame with starttime, endtime, bucket and text
+    """
+    events = events.dropna()
+    num_buckets = get_num_buckets(starttime, cut_time, window=window)
+    events_buckets = get_events_buckets(events['charttime'], starttime, num_buckets, window=window)
+    in_buckets = events_buckets != -1
+    # Only the buckets that have notes are joined, each note keeping its order inside the bucket
+    texts = events.loc[in_buckets, 'preprocessed_note'].astype(str).groupby(events_buckets[in_buckets]).agg(' '.join)
+    texts = texts[texts.str.strip().str.len() != 0]
+    if texts.empty:
+        return pd.DataFrame()
+    buckets = create_buckets_frame(starttime, num_buckets, window=window).loc[texts.index]
+    buckets['text'] = texts
+    return buckets.reset_index(drop=True)
+
+
+def process_events(dataset, events_storage, new_events_storages, datetime_pattern='%Y-%m-%d %H:%M:%S',
+                   stage_cache=None):
+    """
+    Create the notes buckets of each icu stay for all resolutions
+    :param dataset: the icu stays
+    :param events_storage: the storage for the preprocessed notes
+    :param new_events_storages: a dict from the buckets size, in minutes, to the storage for these buckets
+    :param datetime_pattern: the pattern used to store time
+    :param stage_cache: the StageCache for this stage
+    :return: the icu stays that don't have any bucket
+    """
     icustays_to_remove = []
     for index, patient in dataset.iterrows():
-        if not os.path.exists(events_path+'{}.csv'.format(patient['ICUSTAY_ID'])) or \
-                    os.path.exists(new_events_path+'{}.csv'.format(patient['ICUSTAY_ID'])):
+        report_progress()
+        if not events_storage.exists(patient['ICUSTAY_ID']):
+            continue
+        new_events_paths = {resolution: storage.file_path(patient['ICUSTAY_ID'])
+                            for resolution, storage in new_events_storages.items()}
+        stay_key = stage_cache.get_key([events_storage.file_path(patient['ICUSTAY_ID'])],
+                                       values=[patient['INTIME'], patient['OUTTIME']])
+        if all(stage_cache.is_up_to_date(path, stay_key) for path in new_events_paths.values()):
             continue
-        events = pd.read_csv(events_path+'{}.csv'.format(patient['ICUSTAY_ID']))
-        # Unnamed: 0 here represents the time for the events
-        events.loc[:, 'charttime'] = pd.to_datetime(events['charttime'], format=datetime_pattern)
-        # events.loc[: 'starttime']
+        for path in new_events_paths.values():
+            stage_cache.remove(path)
+        events = events_storage.read(patient['ICUSTAY_ID'])
+        events['charttime'] = pd.to_datetime(events['charttime'], format=datetime_pattern)
         starttime = patient['INTIME'].replace(minute=0, second=0)
-        buckets = []
-        cut_time = patient['OUTTIME']
-        bucket_num = 0
-        while starttime < cut_time:
-            endtime = starttime + timedelta(hours=1)
-            bucket = dict()
-            bucket['starttime'] = starttime
-            bucket['endtime'] = endtime
-            bucket['bucket'] = bucket_num
-            bucket_events = events[(events['charttime'] > starttime) & (events['charttime'] <= endtime)].dropna()
-            if not bucket_events.empty:
-                text = bucket_events['preprocessed_note'].str.cat(sep=" ")
-                if not pd.isna(text) and not len(text.strip()) == 0:
-                    bucket['text'] = text
-                    buckets.append(bucket)
-            starttime += timedelta(hours=1)
-            bucket_num += 1
-        buckets = pd.DataFrame(buckets)
-        buckets = buckets.sort_values(by=['starttime'])
-        buckets = buckets.dropna()
-        if buckets.empty:
-            icustays_to_remove.append(patient['ICUSTAY_ID'])
-        else:
-            buckets.to_csv(new_events_path+'{}.csv'.format(patient['ICUSTAY_ID']))
-        if manager_queue is not None:
-            manager_queue.put(index)
+        for resolution in sorted(new_events_storages.keys()):
+            buckets = merge_notes_in_buckets(events, starttime, patient['OUTTIME'],
+                                             window=timedelta(minutes=resolution))
+            if buckets.empty:
+                icustays_to_remove.append(patient['ICUSTAY_ID'])
+                break
+            new_events_storages[resolution].write(buckets, patient['ICUSTAY_ID'])
+            stage_cache.save_key(new_events_paths[resolution], stay_key)
     return icustays_to_remove
 
 
@@ -58,10 +84,14 @@ from multiclassification.parameters.dataset_parameters import parameters
 
 events_path =  parameters['mimic_data_path'] + parameters['multiclassification_directory'] \
                + parameters['noteevents_anonymized_tokens_normalized_preprocessed']
-new_events_path = parameters['mimic_data_path'] + parameters['multiclassification_directory'] \
-                  + parameters['noteevents_hourly_merged_dirname']
-if not os.path.exists(new_events_path):
-    os.mkdir(new_events_path)
+new_events_storages = dict()
+for resolution in parameters['buckets_resolutions']:
+    new_events_path = parameters['mimic_data_path'] + parameters['multiclassification_directory'] \
+                      + get_buckets_dirname(resolution, parameters['noteevents_buckets_merged_dirname'],
+                                            parameters['noteevents_hourly_merged_dirname'])
+    if not os.path.exists(new_events_path):
+        os.mkdir(new_events_path)
+    new_events_storages[resolution] = get_stay_storage(new_events_path, parameters['stays_storage_format'])
 
 dataset = pd.read_csv(parameters['mimic_data_path'] + parameters['multiclassification_directory']
                       + parameters['all_stays_csv_w_events'])
@@ -73,20 +103,21 @@ dataset.loc[:, 'OUTTIME'] = pd.to_datetime(dataset['OUTTIME'], format=parameters
 original_len = len(dataset)
 total_files = len(dataset)
 icustay_ids = list(dataset['ICUSTAY_ID'])
-dataset_for_mp = numpy.array_split(dataset, 10)
+events_storage = get_stay_storage(events_path, parameters['stays_storage_format'])
+dataset_for_mp = create_stays_tasks(dataset, get_stays_files_sizes(icustay_ids, [events_storage]))
 
 
-with mp.Pool(processes=6) as pool:
-    m = mp.Manager()
-    queue = m.Queue()
-    partial_normalize_files = partial(process_events, events_path=events_path, new_events_path=new_events_path,
-                                  manager_queue=queue)
-    map_obj = pool.map_async(partial_normalize_files, dataset_for_mp)
-    consumed = 0
-    while not map_obj.ready():
-        for _ in range(queue.qsize()):
-            queue.get()
-            consumed += 1
-        sys.stderr.write('\rdone {0:%}'.format(consumed / total_files))
-    result = map_obj.get()
+with ProgressPool() as pool:
+    partial_normalize_files = partial(process_events,
+                                      events_storage=events_storage,
+                                      new_events_storages=new_events_storages,
+                                      datetime_pattern=parameters['datetime_pattern'],
+                                      stage_cache=StageCache('notes_merge_hourly_events',
+                                                             {'buckets_resolutions':
+                                                                  sorted(new_events_storages.keys()),
+                                                              'datetime_pattern': parameters['datetime_pattern']},
+                                                             ['multiclassification.dataset_notes_merge_hourly_events',
+                                                              'resources.bucketing', 'resources.storage'],
+                                                             enabled=parameters['build_cache']))
+    result = pool.map(partial_normalize_files, dataset_for_mp, total_files)
     result = numpy.concatenate(result, axis=0)
@@ -1,13 +1,14 @@
-import multiprocessing
 import os
-import sys
 from functools import partial
 
-import numpy
 import pandas as pd
 
-from resources.functions import print_with_time, escape_invalid_xml_characters, escape_html_special_entities, \
-    text_to_lower, remove_only_special_characters_tokens, whitespace_tokenize_text
+from resources.functions import print_with_time
+from resources.build_cache import StageCache
+from resources.progress import ProgressPool, report_progress
+from resources.scheduler import create_stays_tasks, get_stays_files_sizes
+from resources.storage import get_stay_storage
+from resources.text_preprocessing import preprocess_note
 from multiclassification.parameters.dataset_parameters import parameters
 
 new_representation_path = parameters['mimic_data_path'] + parameters['multiclassification_directory']  \
@@ -15,51 +16,54 @@ new_representation_path = parameters['mimic_data_path'] + parameters['multiclass
 if not os.path.exists(new_representation_path):
     os.mkdir(new_representation_path)
 
-def transform_representations(icustays, representation_path=None, new_representation_path=None, manager_queue=None):
+def preprocess_chunks(chunks):
+    """
+    Preprocess the notes of a stream of DataFrames, keeping the same columns order as the whole stay would have
+    :param chunks: the DataFrames with the notes at the Note column and the charttime as Unnamed: 0
+    :return: a generator of the DataFrames with the preprocessed_note and charttime columns
+    """
+    for textual_data in chunks:
+        textual_data['preprocessed_note'] = [preprocess_note(text) for text in textual_data['Note']]
+        textual_data['charttime'] = textual_data['Unnamed: 0']
+        yield textual_data.drop(columns=['Unnamed: 0'])
+
+
+def transform_representations(icustays, representation_storage=None, new_representation_storage=None,
+                              stage_cache=None, chunksize=1000):
     for icustay in icustays:
-        if manager_queue is not None:
-            manager_queue.put(icustay)
-        if not os.path.exists(representation_path + "{}.csv".format(icustay)) \
-            or os.path.exists(new_representation_path + "{}.csv".format(icustay)):
+        report_progress()
+        if not representation_storage.exists(icustay):
             continue
-        textual_data = pd.read_csv(representation_path + "{}.csv".format(icustay))
-        preprocessed_texts = []
-        for text_index, text_row in textual_data.iterrows():
-            text = text_row['Note']
-            for func in preprocessing_pipeline:
-                text = func(text)
-            preprocessed_texts.append(text)
-        textual_data['preprocessed_note'] = [' '.join(text) for text in preprocessed_texts]
-        textual_data['charttime'] = textual_data['Unnamed: 0']
-        textual_data = textual_data.drop(columns=['Unnamed: 0'])
-        textual_data.to_csv(new_representation_path + "{}.csv".format(icustay), index=False)
+        new_representation_file_path = new_representation_storage.file_path(icustay)
+        stay_key = stage_cache.get_key([representation_storage.file_path(icustay)])
+        if stage_cache.is_up_to_date(new_representation_file_path, stay_key):
+            continue
+        # The notes are streamed from one file to the other, so a stay never has all its text in memory
+        new_representation_storage.write_chunks(
+            preprocess_chunks(representation_storage.iter_chunks(icustay, chunksize=chunksize)), icustay,
+            index=False)
+        stage_cache.save_key(new_representation_file_path, stay_key)
 
 representation_path = parameters['mimic_data_path'] + parameters['multiclassification_directory']  \
                               + parameters['noteevents_anonymized_tokens_normalized']
 
-preprocessing_pipeline = [escape_invalid_xml_characters, escape_html_special_entities, text_to_lower,
-                              whitespace_tokenize_text, remove_only_special_characters_tokens]
 print_with_time("Loading data")
 data_csv = pd.read_csv(parameters['mimic_data_path'] + parameters['multiclassification_directory']
                       + parameters['all_stays_csv_w_events'])
 icustays = data_csv['ICUSTAY_ID'].tolist()
 
-with multiprocessing.Pool(processes=1) as pool:
-    manager = multiprocessing.Manager()
-    manager_queue = manager.Queue()
+representation_storage = get_stay_storage(representation_path, parameters['stays_storage_format'])
+with ProgressPool() as pool:
     partial_transform_representation = partial(transform_representations,
-                                               representation_path=representation_path,
-                                               new_representation_path=new_representation_path,
-                                                manager_queue=manager_queue)
-    data = numpy.array_split(icustays, 6)
-    # self.transform_representations(data[0], new_representation_path=new_representation_path, manager_queue=manager_queue)
-    # exit()
+                                               representation_storage=representation_storage,
+                                               new_representation_storage=get_stay_storage(
+                                                   new_representation_path, parameters['stays_storage_format']),
+                                               stage_cache=StageCache(
+                                                   'notes_preprocessing',
+                                                   {'preprocessing': preprocess_note.__name__},
+                                                   ['multiclassification.dataset_notes_preprocessing',
+                                                    'resources.text_preprocessing', 'resources.storage'],
+                                                   enabled=parameters['build_cache']))
+    data = create_stays_tasks(icustays, get_stays_files_sizes(icustays, [representation_storage]))
     total_files = len(icustays)
-    map_obj = pool.map_async(partial_transform_representation, data)
-    consumed = 0
-    while not map_obj.ready() or manager_queue.qsize() != 0:
-        for _ in range(manager_queue.qsize()):
-            manager_queue.get()
-            consumed += 1
-        sys.stderr.write('\rdone {0:%}'.format(consumed / total_files))
-    result = map_obj.get()
\ No newline at end of file
+    result = pool.map(partial_transform_representation, data, total_files)
\ No newline at end of file
@@ -0,0 +1,47 @@
+"""
+Read the raw CHARTEVENTS, LABEVENTS and NOTEEVENTS tables only once, in chunks, routing each event to the icu stays
+from all_stays.csv whose INTIME and OUTTIME interval contains it.
+The events are saved in a parquet dataset partitioned by ICUSTAY_ID, that dataset_filter_events.py uses
+when the raw_events_source parameter is "partitioned", instead of the per admission csv files.
+"""
+import os
+import shutil
+import sys
+
+import pandas as pd
+
+from resources.events_partition import PARTITIONED_MARKER, partition_events
+
+from multiclassification.parameters.dataset_parameters import parameters
+
+datetime_pattern = parameters['datetime_pattern']
+table_names = ['NOTEEVENTS', 'CHARTEVENTS', 'LABEVENTS']
+mimic_data_path = parameters['mimic_data_path']
+csv_files_path = mimic_data_path + parameters['csv_files_directory']
+
+stays = pd.read_csv(mimic_data_path + parameters['multiclassification_directory'] + parameters["all_stays_csv"])
+stays = stays[['HADM_ID', 'ICUSTAY_ID', 'INTIME', 'OUTTIME']].copy()
+stays['INTIME'] = pd.to_datetime(stays['INTIME'], format=datetime_pattern)
+stays['OUTTIME'] = pd.to_datetime(stays['OUTTIME'], format=datetime_pattern)
+
+for table_name in table_names:
+    partitioned_events_path = mimic_data_path + parameters['multiclassification_directory'] \
+                              + parameters['partitioned_events_dirname'].format(table_name.lower())
+    # The table was already partitioned
+    if os.path.exists(partitioned_events_path + PARTITIONED_MARKER):
+        continue
+    # Restart a table that was not read until the end
+    if os.path.exists(partitioned_events_path):
+        shutil.rmtree(partitioned_events_path)
+    print("===== Partitioning {} =====".format(table_name))
+    os.mkdir(partitioned_events_path)
+    read_events = 0
+    saved_events = 0
+    for chunk_index, chunk in enumerate(pd.read_csv(csv_files_path + '{}.csv'.format(table_name), dtype=str,
+                                                    chunksize=parameters['raw_events_chunksize'])):
+        read_events += len(chunk)
+        saved_events += partition_events(chunk, stays, partitioned_events_path, chunk_index,
+                                         datetime_pattern=datetime_pattern)
+        sys.stderr.write('\rRead {} events, saved {} events'.format(read_events, saved_events))
+    open(partitioned_events_path + PARTITIONED_MARKER, 'w').close()
+    print()
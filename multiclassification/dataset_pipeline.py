@@ -1,6 +1,15 @@
 from py._builtin import execfile
 import os
 
+# print("############################################################\n" +
+#       "##                                                        ##\n" +
+#       "##           Partitioning raw tables by icu stay          ##\n" +
+#       "##                                                        ##\n" +
+#       "############################################################\n")
+# execfile("dataset_partition_events.py")
+# print("\n############################################################\n")
+#
+#
 # print("############################################################\n" +
 #       "##                                                        ##\n" +
 #       "##            Filtering events from all stays             ##\n" +
@@ -64,4 +73,11 @@ print("############################################################\n" +
       "##                                                        ##\n" +
       "############################################################\n")
 execfile("decompensation/dataset_create.py")
-print("\n############################################################\n")
\ No newline at end of file
+print("\n############################################################\n")
+# print("############################################################\n" +
+#       "##                                                        ##\n" +
+#       "##        Creating the episodes of all prediction tasks   ##\n" +
+#       "##                                                        ##\n" +
+#       "############################################################\n")
+# execfile("dataset_create_tasks.py")
+# print("\n############################################################\n")
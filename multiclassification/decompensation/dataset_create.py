@@ -1,73 +1,79 @@
-import multiprocessing as mp
-import os
-import sys
 from functools import partial
 
-import numpy
+import numpy as np
 import pandas as pd
 
-# TODO: change to comply with icustay_id required in ensemble
-def create_episodes(dataset, manager_queue, structured_events_path=None, note_events_path=None,
-                     structured_decompensation_events_path=None, textual_decompensation_events_path=None):
-    total = len(dataset)
-    consumed = 0
+from resources.episodes import create_episode_reference, get_hours_until
+from resources.progress import ProgressPool, report_progress
+from resources.scheduler import create_stays_tasks, get_stays_files_sizes
+from resources.storage import get_stay_storage
+
+DECOMPENSATION_COLUMNS = ['episode', 'icustay_id', 'structured_path', 'end_bucket', 'label', 'textual_path']
+
+
+def get_stay_episodes(events, events_path, icustay_id, deathtime, is_label_inclusive=False):
+    """
+    Get the episodes of the buckets of a stay: one episode for each bucket since the third one that doesn't start
+    after the death, labeled 1 if the death happens until 24 hours after the bucket start
+    :param events: the buckets of the stay
+    :param events_path: the path for the buckets file, used by the episode references
+    :param icustay_id: the icu stay
+    :param deathtime: the time of death, missing if the patient didn't die
+    :param is_label_inclusive: if a death at exactly 24 hours is labeled 1
+    :return: a DataFrame indexed by episode, with the path, end_bucket and label of each episode
+    """
+    starttimes = pd.to_datetime(events['starttime'], format=parameters['datetime_pattern'])
+    buckets = events['bucket'].to_numpy()
+    positions = np.flatnonzero((buckets >= 3) & ~(starttimes > deathtime).to_numpy())
+    hours = get_hours_until(starttimes.iloc[positions], deathtime)
+    labels = hours <= 24 if is_label_inclusive else hours < 24
+    return pd.DataFrame({'path': [create_episode_reference(events_path, position) for position in positions],
+                         'end_bucket': buckets[positions], 'label': labels.astype(int)},
+                        index=["{}_{}".format(bucket, icustay_id) for bucket in buckets[positions]])
+
+
+def create_episodes(dataset, structured_events_storage=None, note_events_storage=None):
+    """
+    Create the decompensation episodes of each icu stay. The episodes are references to the stay files, created by
+    create_episode_reference, so the buckets are only sliced when the episode is read.
+    :param dataset: the icu stays
+    :param structured_events_storage: the storage for the structured buckets
+    :param note_events_storage: the storage for the notes buckets
+    :return: a DataFrame with the DECOMPENSATION_COLUMNS for the episodes of the icu stays, indexed by episode
+    """
+    stays_episodes = []
     for index, icustay in dataset.iterrows():
-        # consumed += 1
-        # sys.stderr.write('\rdone {0:%}'.format(consumed / total))
+        report_progress()
         icustay_id = icustay['ICUSTAY_ID']
-        intime = icustay['INTIME']
-        outtime = icustay['OUTTIME']
         deathtime = icustay['DEATHTIME']
-        icustay_structured_path = os.path.join(structured_decompensation_events_path, str(icustay_id))
-        if not os.path.exists(icustay_structured_path):
-            os.mkdir(icustay_structured_path)
-        icu_structured_events_path = os.path.join(structured_events_path, '{}.csv'.format(icustay_id))
-        if not os.path.exists(icu_structured_events_path):
+        if not structured_events_storage.exists(icustay_id):
             continue
-        structured_events = pd.read_csv(icu_structured_events_path)
-        structured_events.loc[:, 'starttime'] = pd.to_datetime(structured_events['starttime'],
-                                                               format=parameters['datetime_pattern'])
-        textual_events = None
-        icustay_textual_path = None
-        if os.path.exists(note_events_path + '{}.csv'.format(icustay_id)):
-            textual_events = pd.read_csv(os.path.join(note_events_path, '{}.csv'.format(icustay_id)))
-            textual_events.loc[:, 'starttime'] = pd.to_datetime(textual_events['starttime'],
-                                                                   format=parameters['datetime_pattern'])
-            icustay_textual_path = os.path.join(textual_decompensation_events_path, str(icustay_id))
-            if not os.path.exists(icustay_textual_path):
-                os.mkdir(icustay_textual_path)
-        if len(structured_events) >= 4:
-            for event_index, event in structured_events.iterrows():
-                if event['bucket'] < 3 or event['starttime'] > deathtime:
-                    continue
-                episode = "{}_{}".format(event['bucket'], icustay_id)
-                episode_path = os.path.join(icustay_structured_path, episode + '.csv')
-                is_dead_in_24h = 0
-                if not pd.isna(deathtime):
-                    difference = deathtime - event['starttime']
-                    hours = (difference.days * 24) + (difference.seconds // 3600)
-                    if hours < 24:
-                        is_dead_in_24h = 1
-                episode_events = structured_events.loc[:event_index]
-                episode_events.to_csv(episode_path)
-                manager_queue.put([episode, 'structured', episode_path, is_dead_in_24h])
-            if textual_events is not None:
-                for event_index, event in textual_events.iterrows():
-                    if event['bucket'] < 3 or event['starttime'] > deathtime:
-                        continue
-                    episode = "{}_{}".format(event['bucket'], icustay_id)
-                    is_dead_in_24h = 0
-                    if not pd.isna(deathtime):
-                        difference = deathtime - event['starttime']
-                        hours = (difference.days * 24) + (difference.seconds // 3600)
-                        if hours <= 24:
-                            is_dead_in_24h = 1
-                    episode_events = textual_events.loc[:event_index]
-                    episode_path = os.path.join(icustay_textual_path, episode + '.csv')
-                    episode_events.to_csv(episode_path)
-                    manager_queue.put([episode, 'textual', episode_path, is_dead_in_24h])
-    # return manager_queue
-
+        structured_events = structured_events_storage.read(icustay_id)
+        if len(structured_events) < 4:
+            continue
+        episodes = get_stay_episodes(structured_events, structured_events_storage.file_path(icustay_id),
+                                     icustay_id, deathtime)
+        episodes = episodes.rename(columns={'path': 'structured_path'})
+        if note_events_storage.exists(icustay_id):
+            textual_episodes = get_stay_episodes(note_events_storage.read(icustay_id),
+                                                 note_events_storage.file_path(icustay_id), icustay_id, deathtime,
+                                                 is_label_inclusive=True)
+            episodes = pd.concat([episodes, textual_episodes.rename(columns={'path': 'textual_path',
+                                                                             'end_bucket': 'textual_end_bucket',
+                                                                             'label': 'textual_label'})],
+                                 axis=1, sort=False)
+            # Episodes with both types use the textual label, and episodes with only notes don't have a label
+            has_both_types = episodes['structured_path'].notna() & episodes['textual_path'].notna()
+            episodes['label'] = episodes['label'].where(~has_both_types, episodes['textual_label'])
+            episodes['end_bucket'] = episodes['end_bucket'].fillna(episodes['textual_end_bucket'])
+        episodes['episode'] = episodes.index
+        episodes['icustay_id'] = icustay_id
+        stays_episodes.append(episodes.reindex(columns=DECOMPENSATION_COLUMNS))
+    if len(stays_episodes) == 0:
+        return pd.DataFrame(columns=DECOMPENSATION_COLUMNS)
+    stays_episodes = pd.concat(stays_episodes)
+    stays_episodes[['end_bucket', 'label']] = stays_episodes[['end_bucket', 'label']].astype('Int64')
+    return stays_episodes
 
 
 from multiclassification.parameters.dataset_parameters import parameters
@@ -77,15 +83,6 @@ structured_events_path =  parameters['mimic_data_path'] + parameters['multiclass
 note_events_path = parameters['mimic_data_path'] + parameters['multiclassification_directory'] \
                   + parameters['noteevents_hourly_merged_dirname']
 
-structured_decompensation_events_path = parameters['mimic_data_path'] + parameters['multiclassification_directory'] \
-                                        + parameters['decompensation_directory'] + parameters['structured_dirname']
-if not os.path.exists(structured_decompensation_events_path):
-    os.mkdir(structured_decompensation_events_path)
-textual_decompensation_events_path = parameters['mimic_data_path'] + parameters['multiclassification_directory'] \
-                                        + parameters['decompensation_directory'] + parameters['textual_dirname']
-if not os.path.exists(textual_decompensation_events_path):
-    os.mkdir(textual_decompensation_events_path)
-
 dataset = pd.read_csv(parameters['mimic_data_path'] + parameters['multiclassification_directory']
                       + parameters['all_stays_csv_w_events'])
 if 'Unnamed: 0' in dataset.columns:
@@ -96,48 +93,17 @@ dataset.loc[:, 'DEATHTIME'] = pd.to_datetime(dataset['DEATHTIME'], format=parame
 original_len = len(dataset)
 total_files = len(dataset)
 icustay_ids = list(dataset['ICUSTAY_ID'])
-dataset_for_mp = numpy.array_split(dataset, 20)
-with mp.Pool(processes=4) as pool:
-    m = mp.Manager()
-    queue = m.Queue()
-    partial_normalize_files = partial(create_episodes, manager_queue=queue,
-                                      structured_events_path=structured_events_path,
-                                      note_events_path=note_events_path,
-                                      structured_decompensation_events_path=structured_decompensation_events_path,
-                                      textual_decompensation_events_path=textual_decompensation_events_path)
-    # queue = partial_normalize_files(dataset_for_mp)
-    map_obj = pool.map_async(partial_normalize_files, dataset_for_mp)
-    consumed = 0
-    decompensation_dataset = dict()
-    while not map_obj.ready():
-        for _ in range(queue.qsize()):
-            returned_data = queue.get()
-            if returned_data[0] not in decompensation_dataset.keys():
-                decompensation_dataset[returned_data[0]] = dict()
-                decompensation_dataset[returned_data[0]]['episode'] = returned_data[0]
-            if returned_data[1] == 'structured':
-                decompensation_dataset[returned_data[0]]['structured_path'] = returned_data[2]
-                decompensation_dataset[returned_data[0]]['label'] = returned_data[3]
-            elif returned_data[1] == 'textual':
-                decompensation_dataset[returned_data[0]]['textual_path'] = returned_data[2]
-                if 'label' in decompensation_dataset[returned_data[0]].keys():
-                    decompensation_dataset[returned_data[0]]['label'] = returned_data[3]
-            consumed += 1
-            sys.stderr.write('\rConssumed {} events'.format(consumed))
-    if queue.qsize() != 0 :
-        for _ in range(queue.qsize()):
-            returned_data = queue.get()
-            if returned_data[0] not in decompensation_dataset.keys():
-                decompensation_dataset[returned_data[0]] = dict()
-                decompensation_dataset[returned_data[0]]['episode'] = returned_data[0]
-            if returned_data[1] == 'structured':
-                decompensation_dataset[returned_data[0]]['structured_path'] = returned_data[2]
-                decompensation_dataset[returned_data[0]]['label'] = returned_data[3]
-            elif returned_data[1] == 'textual':
-                decompensation_dataset[returned_data[0]]['textual_path'] = returned_data[2]
-                if 'label' in decompensation_dataset[returned_data[0]].keys():
-                    decompensation_dataset[returned_data[0]]['label'] = returned_data[3]
-    decompensation_dataset = pd.DataFrame(decompensation_dataset)
-    decompensation_dataset = decompensation_dataset.T
-    decompensation_dataset.to_csv(parameters['mimic_data_path'] + parameters['multiclassification_directory'] \
-                                    + parameters['decompensation_directory'] + parameters['decompensation_dataset_csv'])
+structured_events_storage = get_stay_storage(structured_events_path, parameters['stays_storage_format'])
+# Each bucket of a stay creates an episode, so the size of the stay is given by its buckets file
+dataset_for_mp = create_stays_tasks(dataset, get_stays_files_sizes(icustay_ids, [structured_events_storage]))
+decompensation_dataset_path = parameters['mimic_data_path'] + parameters['multiclassification_directory'] \
+                              + parameters['decompensation_directory'] + parameters['decompensation_dataset_csv']
+with ProgressPool() as pool, open(decompensation_dataset_path, 'w') as decompensation_dataset_file:
+    partial_normalize_files = partial(create_episodes,
+                                      structured_events_storage=structured_events_storage,
+                                      note_events_storage=get_stay_storage(
+                                          note_events_path, parameters['stays_storage_format']))
+    # The episodes of each task are written when they are ready, without keeping all of them
+    pd.DataFrame(columns=DECOMPENSATION_COLUMNS).to_csv(decompensation_dataset_file)
+    for episodes in pool.imap(partial_normalize_files, dataset_for_mp, total_files):
+        episodes.to_csv(decompensation_dataset_file, header=False)
@@ -1,23 +1,32 @@
-import multiprocessing as mp
 import os
-import sys
+from collections import Counter
 from datetime import timedelta
 from functools import partial
 
-import numpy
 import pandas as pd
 
-from multiclassification import constants
+from resources.build_cache import StageCache
+from resources.episodes import fill_missing_text_buckets
+from resources.progress import ProgressPool, report_progress
+from resources.scheduler import create_stays_tasks, get_stays_files_sizes
+from resources.storage import get_stay_storage
 
+MORTALITY_COLUMNS = ['episode', 'icustay_id', 'structured_path', 'label', 'textual_path']
 
-def create_episodes(dataset, manager_queue, hours_since_intime=24,
-                    structured_events_path=None, note_events_path=None,
-                    structured_mortality_events_path=None, textual_mortality_events_path=None):
-    total = len(dataset)
-    consumed = 0
+
+def create_episodes(dataset, hours_since_intime=24,
+                    structured_events_storage=None, note_events_storage=None,
+                    structured_mortality_events_path=None, textual_mortality_events_path=None, stage_cache=None):
+    """
+    Create the mortality episode of each icu stay, with its buckets until hours_since_intime. Buckets without notes
+    get NO_TEXT_CONSTANT as text.
+    :return: a DataFrame with the MORTALITY_COLUMNS for the episodes, indexed by episode, and the reasons why
+    the other icu stays were removed
+    """
+    episodes = []
+    removed_reasons = []
     for index, icustay in dataset.iterrows():
-        # consumed += 1
-        # sys.stderr.write('\rdone {0:%}'.format(consumed / total))
+        report_progress()
         icustay_id = icustay['ICUSTAY_ID']
         intime = icustay['INTIME']
         outtime = icustay['OUTTIME']
@@ -29,67 +38,45 @@ def create_episodes(dataset, manager_queue, hours_since_intime=24,
             los_diff = (deathtime - intime)
         new_structured_events_path = structured_mortality_events_path + '{}.csv'.format(icustay_id)
         new_textual_events_path = textual_mortality_events_path + '{}.csv'.format(icustay_id)
-        if os.path.exists(new_structured_events_path):
-            manager_queue.put([icustay_id, icustay_id, 'structured', new_structured_events_path, label])
-            if os.path.exists(new_textual_events_path):
-                manager_queue.put([icustay_id, icustay_id, 'textual', new_textual_events_path, label])
-                continue
+        episode = [icustay_id, icustay_id, new_structured_events_path, label, new_textual_events_path]
+        stay_key = stage_cache.get_key([structured_events_storage.file_path(icustay_id),
+                                        note_events_storage.file_path(icustay_id)],
+                                       values=[intime, outtime, deathtime])
+        if stage_cache.is_up_to_date(new_structured_events_path, stay_key) \
+                and stage_cache.is_up_to_date(new_textual_events_path, stay_key):
+            episodes.append(episode)
+            continue
+        stage_cache.remove(new_structured_events_path)
+        stage_cache.remove(new_textual_events_path)
         los = los_diff.days * 24 + (los_diff.seconds // 3600)
         if los is None or los < hours_since_intime:
-            manager_queue.put(['removed', 'short_los', icustay_id])
+            removed_reasons.append('short_los')
             continue
-        icu_structured_events_path = os.path.join(structured_events_path, '{}.csv'.format(icustay_id))
-        if not os.path.exists(icu_structured_events_path):
-            manager_queue.put(['removed', 'no_origin_file', icustay_id])
+        if not structured_events_storage.exists(icustay_id):
+            removed_reasons.append('no_origin_file')
             continue
-        structured_events = pd.read_csv(icu_structured_events_path)
-        structured_events.loc[:, 'endtime'] = pd.to_datetime(structured_events['endtime'],
-                                                               format=parameters['datetime_pattern'])
-        structured_events = structured_events[structured_events['endtime'] <=
-                                              intime + timedelta(hours=hours_since_intime)]
+        cut_time = intime + timedelta(hours=hours_since_intime)
+        structured_events = structured_events_storage.read(icustay_id)
+        structured_events['endtime'] = pd.to_datetime(structured_events['endtime'],
+                                                      format=parameters['datetime_pattern'])
+        structured_events = structured_events[structured_events['endtime'] <= cut_time]
         if len(structured_events.dropna(how="all")) == 0:
-            manager_queue.put(['removed', 'only_missing_events'], icustay_id)
+            removed_reasons.append('only_missing_events')
             continue
         structured_events.to_csv(new_structured_events_path, index=False)
-        manager_queue.put([icustay_id, icustay_id, 'structured', new_structured_events_path, label])
-        icustay_textual_path = os.path.join(note_events_path, '{}.csv'.format(icustay_id))
-        if os.path.exists(icustay_textual_path):
-            textual_events = pd.read_csv(icustay_textual_path)
-            textual_events.loc[:, 'endtime'] = pd.to_datetime(textual_events['endtime'],
-                                                                   format=parameters['datetime_pattern'])
-            textual_events = textual_events[textual_events['endtime'] <=
-                                                  intime + timedelta(hours=hours_since_intime)]
-            empty_rows = []
-            bucket_tolist = textual_events['bucket'].tolist()
-            for index, srow in structured_events.iterrows():
-                if srow['bucket'] not in bucket_tolist:
-                    empty_row = dict()
-                    empty_row['starttime'] = srow['starttime']
-                    empty_row['endtime'] = srow['endtime']
-                    empty_row['bucket'] = srow['bucket']
-                    empty_row['text'] = constants.NO_TEXT_CONSTANT
-                    empty_rows.append(empty_row)
-            empty_rows = pd.DataFrame(empty_rows)
-            new_textual_events = pd.concat([empty_rows, textual_events], ignore_index=True)
-            new_textual_events = new_textual_events.sort_values(by='bucket')
-            textual_events = new_textual_events
-            textual_events.to_csv(new_textual_events_path, index=False)
-            manager_queue.put([icustay_id, icustay_id, 'textual', new_textual_events_path, label])
-        else:
-            empty_rows = []
-            for index, srow in structured_events.iterrows():
-                empty_row = dict()
-                empty_row['starttime'] = srow['starttime']
-                empty_row['endtime'] = srow['endtime']
-                empty_row['bucket'] = srow['bucket']
-                empty_row['text'] = constants.NO_TEXT_CONSTANT
-                empty_rows.append(empty_row)
-            empty_rows = pd.DataFrame(empty_rows)
-            empty_rows = empty_rows.sort_values(by='bucket')
-            empty_rows.to_csv(new_textual_events_path, index=False)
-            manager_queue.put([icustay_id, icustay_id, 'textual', new_textual_events_path, label])
-    # return manager_queue
-
+        stage_cache.save_key(new_structured_events_path, stay_key)
+        textual_events = None
+        if note_events_storage.exists(icustay_id):
+            textual_events = note_events_storage.read(icustay_id)
+            textual_events['endtime'] = pd.to_datetime(textual_events['endtime'],
+                                                       format=parameters['datetime_pattern'])
+            textual_events = textual_events[textual_events['endtime'] <= cut_time]
+        textual_events = fill_missing_text_buckets(structured_events, textual_events)
+        textual_events.to_csv(new_textual_events_path, index=False)
+        stage_cache.save_key(new_textual_events_path, stay_key)
+        episodes.append(episode)
+    episodes = pd.DataFrame(episodes, columns=MORTALITY_COLUMNS)
+    return episodes.set_index(episodes['episode'].rename(None)), removed_reasons
 
 
 from multiclassification.parameters.dataset_parameters import parameters
@@ -120,74 +107,36 @@ dataset.loc[:, 'DEATHTIME'] = pd.to_datetime(dataset['DEATHTIME'], format=parame
 original_len = len(dataset)
 total_files = len(dataset)
 icustay_ids = list(dataset['ICUSTAY_ID'])
-dataset_for_mp = numpy.array_split(dataset, 20)
-# dataset_for_mp = numpy.array_split(dataset_for_mp[0], 20)
-# dataset_for_mp = numpy.array_split(dataset_for_mp[0], 20)
-with mp.Pool(processes=4) as pool:
-    m = mp.Manager()
-    queue = m.Queue()
-    partial_normalize_files = partial(create_episodes, manager_queue=queue,
-                                      structured_events_path=structured_events_path,
-                                      note_events_path=note_events_path,
+structured_events_storage = get_stay_storage(structured_events_path, parameters['stays_storage_format'])
+dataset_for_mp = create_stays_tasks(dataset, get_stays_files_sizes(icustay_ids, [structured_events_storage]))
+mortality_dataset_path = parameters['mimic_data_path'] + parameters['multiclassification_directory'] \
+                         + parameters['mortality_directory'] + parameters['mortality_dataset_csv']
+with ProgressPool() as pool, open(mortality_dataset_path, 'w') as mortality_dataset_file:
+    partial_normalize_files = partial(create_episodes,
+                                      structured_events_storage=structured_events_storage,
+                                      note_events_storage=get_stay_storage(
+                                          note_events_path, parameters['stays_storage_format']),
                                       hours_since_intime=48,
                                       structured_mortality_events_path=structured_mortality_events_path,
-                                      textual_mortality_events_path=textual_mortality_events_path)
-    # queue = partial_normalize_files(dataset_for_mp)
-    # partial_normalize_files(dataset_for_mp[0])
-    # exit()
-    removed_icustays = dict()
-    map_obj = pool.map_async(partial_normalize_files, dataset_for_mp)
-    consumed = 0
-    mortality_dataset = dict()
-    while not map_obj.ready():
-        for _ in range(queue.qsize()):
-            returned_data = queue.get()
-            if returned_data[0] == 'removed':
-                if returned_data[1] not in removed_icustays.keys():
-                    removed_icustays[returned_data[1]] = 0
-                removed_icustays[returned_data[1]] += 1
-            else:
-                if returned_data[0] not in mortality_dataset.keys():
-                    mortality_dataset[returned_data[0]] = dict()
-                    mortality_dataset[returned_data[0]]['episode'] = returned_data[0]
-                    mortality_dataset[returned_data[0]]['icustay_id'] = returned_data[1]
-                if returned_data[2] == 'structured':
-                    mortality_dataset[returned_data[0]]['structured_path'] = returned_data[3].replace(multiclassification_base_dir, '')
-                    mortality_dataset[returned_data[0]]['label'] = returned_data[4]
-                elif returned_data[2] == 'textual':
-                    mortality_dataset[returned_data[0]]['textual_path'] = returned_data[3].replace(multiclassification_base_dir, '')
-                    if 'label' in mortality_dataset[returned_data[0]].keys():
-                        mortality_dataset[returned_data[0]]['label'] = returned_data[4]
-            consumed += 1
-            sys.stderr.write('\rConssumed {} events\n'.format(consumed))
-    if queue.qsize() != 0 :
-        for _ in range(queue.qsize()):
-            returned_data = queue.get()
-            if returned_data[0] == 'removed':
-                if returned_data[1] not in removed_icustays.keys():
-                    removed_icustays[returned_data[1]] = 0
-                removed_icustays[returned_data[1]] += 1
-            else:
-                if returned_data[0] not in mortality_dataset.keys():
-                    mortality_dataset[returned_data[0]] = dict()
-                    mortality_dataset[returned_data[0]]['episode'] = returned_data[0]
-                    mortality_dataset[returned_data[0]]['icustay_id'] = returned_data[1]
-                if returned_data[2] == 'structured':
-                    mortality_dataset[returned_data[0]]['structured_path'] = returned_data[3].replace(multiclassification_base_dir, '')
-                    mortality_dataset[returned_data[0]]['label'] = returned_data[4]
-                elif returned_data[2] == 'textual':
-                    mortality_dataset[returned_data[0]]['textual_path'] = returned_data[3].replace(multiclassification_base_dir, '')
-                    if 'label' in mortality_dataset[returned_data[0]].keys():
-                        mortality_dataset[returned_data[0]]['label'] = returned_data[4]
-        consumed += 1
-        sys.stderr.write('\rConssumed {} events\n'.format(consumed))
-    mortality_dataset = pd.DataFrame(mortality_dataset)
-    mortality_dataset = mortality_dataset.T
-    mortality_dataset.to_csv(parameters['mimic_data_path'] + parameters['multiclassification_directory'] \
-                             + parameters['mortality_directory'] + parameters['mortality_dataset_csv'])
-    print(mortality_dataset['label'].value_counts())
+                                      textual_mortality_events_path=textual_mortality_events_path,
+                                      stage_cache=StageCache('mortality_create_episodes',
+                                                             {'hours_since_intime': 48,
+                                                              'datetime_pattern': parameters['datetime_pattern']},
+                                                             ['multiclassification.mortality.dataset_create',
+                                                              'multiclassification.constants', 'resources.episodes',
+                                                              'resources.storage'],
+                                                             enabled=parameters['build_cache']))
+    # The episodes of each task are written when they are ready, without keeping all of them
+    labels_counts = Counter()
+    removed_icustays = Counter()
+    pd.DataFrame(columns=MORTALITY_COLUMNS).to_csv(mortality_dataset_file)
+    for episodes, removed_reasons in pool.imap(partial_normalize_files, dataset_for_mp, total_files):
+        for column in ['structured_path', 'textual_path']:
+            episodes[column] = episodes[column].str.replace(multiclassification_base_dir, '', regex=False)
+        episodes.to_csv(mortality_dataset_file, header=False)
+        labels_counts.update(episodes['label'])
+        removed_icustays.update(removed_reasons)
+    print()
+    print(pd.Series(labels_counts, name='label').sort_values(ascending=False))
     for key in removed_icustays.keys():
         print(key, removed_icustays[key])
-    # for index, row in mortality_dataset.iterrows():
-    #     events = pd.read_csv(row['structured_path'])
-    #     print(len(events))
\ No newline at end of file
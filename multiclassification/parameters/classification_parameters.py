@@ -21,8 +21,10 @@ timeseries_execution_saving_parameters = {
     "execution_parameters_filename": "training_parameters.pkl",
 
     "normalization_value_counts_directory" : "value_counts/",
+    "normalization_type" : "z_score",
     "fold_normalization_values_filename": "normalization_values_{}.pkl",
     "fold_normalization_temporary_data_directory" : "data_tmp_{}/",
+    "lazy_normalization_temporary_data_directory" : "data_tmp_lazy/",
     'tunning_directory' : 'tunning/',
 
     "training_events_sizes_filename" : "training_sizes_{}.pkl",
@@ -13,6 +13,26 @@ parameters = {
     "mortality_directory" : "mortality/",
     "mortality_dataset_csv" : "mortality.csv",
 
+    # Tasks created by dataset_create_tasks.py, each one saved as <task name>.csv at tasks_directory. The values are
+    # the arguments of resources.tasks.TaskSpec
+    "tasks_directory" : "tasks/",
+    "prediction_tasks" : {
+        "mortality" : {"episodes" : "stay", "label" : "death", "observation_hours" : 48},
+        "decompensation" : {"episodes" : "bucket", "label" : "death_in_horizon", "horizon_hours" : 24,
+                            "first_bucket" : 3, "min_buckets" : 4},
+        "length_of_stay" : {"episodes" : "bucket", "label" : "remaining_los", "first_bucket" : 3, "min_buckets" : 4},
+    },
+
+    # "admission_csv" reads the {TABLE}_{HADM_ID}.csv files, "partitioned" reads the tables partitioned by
+    # dataset_partition_events.py
+    "raw_events_source" : "admission_csv",
+    "raw_events_chunksize" : 1000000,
+    "partitioned_events_dirname" : "{}_partitioned/",
+    # If the dataset stages only create again the icu stays whose inputs, parameters or code changed since they
+    # were created. When False, any existing file is used, as without the build cache
+    "build_cache" : True,
+    # Format of the per icu stay files between the dataset stages: "csv", "parquet" or "feather"
+    "stays_storage_format" : "csv",
     "raw_events_dirname" : "{}_timeseries/",
     "merged_events_dirname": "merged_timeseries/",
     "features_filtered_dirname": "filtered_timeseries/",
@@ -20,6 +40,16 @@ parameters = {
     "noteevents_anonymized_tokens_normalized" : "textual_anonymized_data/",
     "noteevents_anonymized_tokens_normalized_preprocessed" : "textual_normalized_preprocessed/",
     "noteevents_hourly_merged_dirname" : "textual_hourly_merged/",
+    # Json file with the concepts used by dataset_filter_selected_features.py, as {concept: [itemids]}.
+    # When None, the concepts defined at the script are used. The concepts used to derive pulse_pressure, gcs
+    # and temperature_celsius must be kept
+    "features_concepts_file" : None,
+    # Size of the buckets, in minutes, created by the merge hourly events stages. Every resolution must be a multiple
+    # of the smallest one, and the 60 minutes buckets are saved at the hourly merged directories
+    "buckets_resolutions" : [60],
+    "events_buckets_merged_dirname" : "bucket_timeseries_{}min/",
+    "events_buckets_statistics_dirname" : "bucket_statistics_{}min/",
+    "noteevents_buckets_merged_dirname" : "textual_merged_{}min/",
 
     "structured_dirname" : "structured_data/",
     "textual_dirname" : "textual_data/",
@@ -5,6 +5,7 @@ import sys
 from multiclassification import constants
 from multiclassification.parameters.classification_parameters import timeseries_textual_training_parameters as parameters
 from resources.data_representation import ClinicalTokenizer
+from resources.episodes import read_episode
 from resources.functions import whitespace_tokenize_text
 
 problem = 'mortality'
@@ -26,7 +27,7 @@ if not os.path.exists(vocabulary_count_path):
         sys.stderr.write('\rdone {0:%}'.format(consumed / total_files))
         consumed += 1
         path = row['textual_path']
-        patient_noteevents = pd.read_csv(path)
+        patient_noteevents = read_episode(path)
         patient_id = os.path.basename(path).split('.')[0]
         for index, text_row in patient_noteevents.iterrows():
             text = text_row['text']
@@ -0,0 +1,181 @@
+"""
+Functions to merge the events of an icu stay into time buckets, starting from the icu intime
+"""
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+
+def get_num_buckets(starttime, cut_time, window=timedelta(hours=1)):
+    """
+    Get how many buckets of size window are needed to go from starttime until cut_time
+    :param starttime: the start of the first bucket
+    :param cut_time: the time where the buckets stop
+    :param window: the size of the buckets
+    :return: the number of buckets
+    """
+    if cut_time <= starttime:
+        return 0
+    window = pd.Timedelta(window)
+    return int(-(-pd.Timedelta(cut_time - starttime).value // window.value))
+
+
+def get_events_buckets(events_times, starttime, num_buckets, window=timedelta(hours=1)):
+    """
+    Get the bucket of each event. The bucket i has the events that happened after starttime + i * window
+    and until starttime + (i + 1) * window.
+    :param events_times: the time of each event
+    :param starttime: the start of the first bucket
+    :param num_buckets: the number of buckets
+    :param window: the size of the buckets
+    :return: a numpy array with the bucket of each event, -1 for events outside the buckets
+    """
+    window = pd.Timedelta(window)
+    elapsed = (pd.to_datetime(pd.Series(events_times)) - starttime).to_numpy(dtype='timedelta64[ns]')
+    elapsed = elapsed.astype('int64')
+    buckets = (elapsed - 1) // window.value
+    # Missing times have the smallest int64 as elapsed time, so they are left out too
+    buckets[(elapsed <= 0) | (buckets >= num_buckets)] = -1
+    return buckets
+
+
+def create_buckets_frame(starttime, num_buckets, window=timedelta(hours=1)):
+    """
+    Create the starttime, endtime and bucket columns for the buckets
+    :param starttime: the start of the first bucket
+    :param num_buckets: the number of buckets
+    :param window: the size of the buckets
+    :return: a DataFrame indexed by bucket
+    """
+    window = pd.Timedelta(window)
+    buckets_num = np.arange(num_buckets)
+    buckets_starttime = starttime + window * buckets_num
+    return pd.DataFrame({'starttime': buckets_starttime, 'endtime': buckets_starttime + window,
+                         'bucket': buckets_num}, index=buckets_num)
+
+
+def get_buckets_statistics(events, starttime, cut_time, time_column='Unnamed: 0', window=timedelta(hours=1)):
+    """
+    Get the count, sum, min and max of each column for the events inside each bucket of size window, from starttime
+    until cut_time. These statistics are enough to get the buckets for any window that is a multiple of this one.
+    :param events: the events, with their time at time_column
+    :param starttime: the start of the first bucket
+    :param cut_time: the time where the buckets stop
+    :param time_column: the column that has the time of the events
+    :param window: the size of the buckets
+    :return: a DataFrame indexed by bucket, with <column>_count, <column>_sum, <column>_min and <column>_max
+    for each events column
+    """
+    num_buckets = get_num_buckets(starttime, cut_time, window=window)
+    columns = [column for column in events.columns if column != time_column]
+    events_buckets = get_events_buckets(events[time_column], starttime, num_buckets, window=window)
+    in_buckets = events_buckets != -1
+    grouped_events = events.loc[in_buckets, columns].groupby(events_buckets[in_buckets])
+    statistics = pd.concat([grouped_events.count().add_suffix('_count'), grouped_events.sum().add_suffix('_sum'),
+                            grouped_events.min().add_suffix('_min'), grouped_events.max().add_suffix('_max')],
+                           axis=1)
+    return _arrange_statistics(statistics, columns, num_buckets)
+
+
+def merge_buckets_statistics(statistics, starttime, cut_time, window, new_window):
+    """
+    Merge the statistics of buckets into buckets of a bigger window, without going back to the events
+    :param statistics: the statistics got by get_buckets_statistics
+    :param starttime: the start of the first bucket
+    :param cut_time: the time where the buckets stop
+    :param window: the size of the buckets of the statistics
+    :param new_window: the size of the new buckets, a multiple of window
+    :return: the statistics for the buckets of size new_window
+    """
+    window = pd.Timedelta(window)
+    new_window = pd.Timedelta(new_window)
+    if new_window.value % window.value != 0:
+        raise ValueError("Buckets of {} can't be created from buckets of {}".format(new_window, window))
+    num_buckets = get_num_buckets(starttime, cut_time, window=new_window)
+    columns = get_statistics_columns(statistics)
+    grouped_statistics = statistics.groupby(statistics.index * window.value // new_window.value)
+    new_statistics = pd.concat([grouped_statistics[[column + '_count' for column in columns]].sum(),
+                                grouped_statistics[[column + '_sum' for column in columns]].sum(),
+                                grouped_statistics[[column + '_min' for column in columns]].min(),
+                                grouped_statistics[[column + '_max' for column in columns]].max()], axis=1)
+    return _arrange_statistics(new_statistics, columns, num_buckets)
+
+
+def get_statistics_columns(statistics):
+    """
+    Get the events columns that have statistics
+    :param statistics: the statistics got by get_buckets_statistics
+    :return: the list of columns
+    """
+    return [column[:-len('_count')] for column in statistics.columns if column.endswith('_count')]
+
+
+def statistics_to_buckets(statistics, starttime, window=timedelta(hours=1)):
+    """
+    Create the buckets from their statistics
+    :param statistics: the statistics got by get_buckets_statistics or merge_buckets_statistics
+    :param starttime: the start of the first bucket
+    :param window: the size of the buckets
+    :return: a DataFrame with starttime, endtime and bucket, followed by <column>, <column>_min and <column>_max
+    for each events column, where <column> is the mean of the events in the bucket
+    """
+    buckets = create_buckets_frame(starttime, len(statistics), window=window)
+    values = dict()
+    for column in get_statistics_columns(statistics):
+        counts = statistics[column + '_count']
+        values[column] = statistics[column + '_sum'].where(counts != 0) / counts.where(counts != 0)
+        values[column + '_min'] = statistics[column + '_min']
+        values[column + '_max'] = statistics[column + '_max']
+    values = pd.DataFrame(values, index=buckets.index)
+    return pd.concat([buckets, values], axis=1).reset_index(drop=True)
+
+
+def merge_events_in_buckets(events, starttime, cut_time, time_column='Unnamed: 0', window=timedelta(hours=1)):
+    """
+    Merge the events into buckets of size window, from starttime until cut_time, getting the mean, min and max
+    of each column for the events inside each bucket. Buckets without events have missing values.
+    :param events: the events, with their time at time_column
+    :param starttime: the start of the first bucket
+    :param cut_time: the time where the buckets stop
+    :param time_column: the column that has the time of the events
+    :param window: the size of the buckets
+    :return: a DataFrame with starttime, endtime and bucket, followed by <column>, <column>_min and <column>_max
+    for each events column
+    """
+    statistics = get_buckets_statistics(events, starttime, cut_time, time_column=time_column, window=window)
+    return statistics_to_buckets(statistics, starttime, window=window)
+
+
+def get_buckets_dirname(resolution, dirname, hourly_dirname):
+    """
+    Get the directory for the buckets of a resolution. The hourly buckets keep their directory, so the stages that
+    read them don't change.
+    :param resolution: the size of the buckets, in minutes
+    :param dirname: the directory name pattern, formatted with the resolution
+    :param hourly_dirname: the directory name for the hourly buckets
+    :return: the directory name
+    """
+    if resolution == 60:
+        return hourly_dirname
+    return dirname.format(resolution)
+
+
+def get_buckets_statistics_columns(columns):
+    """
+    Get the columns of the statistics of events columns, in the order that get_buckets_statistics gives them
+    :param columns: the events columns, without the time column
+    :return: the list of statistics columns
+    """
+    return [column + suffix for column in columns for suffix in ['_count', '_sum', '_min', '_max']]
+
+
+def _arrange_statistics(statistics, columns, num_buckets):
+    """
+    Put all buckets and the statistics columns in order, filling the buckets without events
+    """
+    statistics = statistics.reindex(index=range(num_buckets), columns=get_buckets_statistics_columns(columns))
+    counts_and_sums = [column + suffix for column in columns for suffix in ['_count', '_sum']]
+    statistics.loc[:, counts_and_sums] = statistics[counts_and_sums].fillna(0)
+    statistics.index.name = 'bucket'
+    return statistics
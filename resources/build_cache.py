@@ -0,0 +1,260 @@
+"""
+Incremental build cache for the per icu stay files created by the dataset stages.
+Each created file has a key file at the _build_keys/ directory next to it, with the hash of the stage parameters,
+the stage code and the keys of the files used to create it. A stay is only created again when this key changes,
+and the key files can be read to know which stays are stale.
+The inputs that are not created by a stage, as the raw events files, are keyed by the hash of their content, which
+is saved at the _input_fingerprints/ directory next to them with their size and modification time, so their
+content is only read again when these change.
+"""
+import hashlib
+import importlib.util
+import json
+import os
+
+import pandas as pd
+
+KEYS_DIRNAME = '_build_keys'
+FINGERPRINTS_DIRNAME = '_input_fingerprints'
+# Key used for the inputs that don't exist
+MISSING_INPUT_KEY = 'missing'
+
+
+def hash_values(values):
+    """
+    Get the hash of a list of strings
+    :param values: the list of strings
+    :return: the hex digest of the hash
+    """
+    hasher = hashlib.sha256()
+    for value in values:
+        hasher.update(str(value).encode('utf-8'))
+        hasher.update(b'\0')
+    return hasher.hexdigest()
+
+
+def get_file_hash(file_path, block_size=1 << 20):
+    """
+    Get the hash of the content of a file
+    :param file_path: the path for the file
+    :param block_size: how many bytes are read at once
+    :return: the hex digest of the hash
+    """
+    hasher = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def get_key_path(file_path):
+    """
+    Get the path for the key file of a file or directory created by a stage
+    :param file_path: the path for the created file or directory
+    :return: the path for its key file
+    """
+    file_path = file_path.rstrip('/')
+    return os.path.join(os.path.dirname(file_path), KEYS_DIRNAME, os.path.basename(file_path) + '.json')
+
+
+def get_fingerprint_path(file_path):
+    """
+    Get the path for the fingerprint file of a file or directory used by a stage
+    :param file_path: the path for the file or directory
+    :return: the path for its fingerprint file
+    """
+    file_path = file_path.rstrip('/')
+    return os.path.join(os.path.dirname(file_path), FINGERPRINTS_DIRNAME, os.path.basename(file_path) + '.json')
+
+
+def get_files_hashes(input_path, files_paths):
+    """
+    Get the hash of the content of the files of an input, reading only the files whose size or modification time
+    changed since their hash was saved at the input fingerprint file
+    :param input_path: the path for the input file or directory
+    :param files_paths: the paths for the files of the input
+    :return: a dict from each file path to its hash
+    """
+    fingerprint_path = get_fingerprint_path(input_path)
+    saved_fingerprints = dict()
+    if os.path.exists(fingerprint_path):
+        try:
+            with open(fingerprint_path) as fingerprint_file:
+                saved_fingerprints = json.load(fingerprint_file)
+        except ValueError:
+            saved_fingerprints = dict()
+    fingerprints = dict()
+    for path in files_paths:
+        stat = os.stat(path)
+        name = os.path.relpath(path, os.path.dirname(input_path.rstrip('/')))
+        fingerprint = saved_fingerprints.get(name)
+        if fingerprint is None or fingerprint[:2] != [stat.st_size, stat.st_mtime_ns]:
+            fingerprint = [stat.st_size, stat.st_mtime_ns, get_file_hash(path)]
+        fingerprints[name] = fingerprint
+    if fingerprints != saved_fingerprints:
+        try:
+            os.makedirs(os.path.dirname(fingerprint_path), exist_ok=True)
+            # Other workers may be saving the same fingerprint file
+            temporary_fingerprint_path = '{}.{}.tmp'.format(fingerprint_path, os.getpid())
+            with open(temporary_fingerprint_path, 'w') as fingerprint_file:
+                json.dump(fingerprints, fingerprint_file)
+            os.replace(temporary_fingerprint_path, fingerprint_path)
+        except OSError:
+            # The inputs directory may be read only, then the hashes are computed again at the next run
+            pass
+    return {path: fingerprints[os.path.relpath(path, os.path.dirname(input_path.rstrip('/')))][2]
+            for path in files_paths}
+
+
+def read_key_file(file_path):
+    """
+    Read the key file of a file created by a stage
+    :param file_path: the path for the created file
+    :return: the dict saved at the key file, or None if it has no key file
+    """
+    key_path = get_key_path(file_path)
+    if not os.path.exists(key_path):
+        return None
+    with open(key_path) as key_file:
+        return json.load(key_file)
+
+
+def get_input_key(file_path):
+    """
+    Get the key of a file used by a stage. Files created by other stages use their saved key, so the content
+    of the previous stages files is not read again. The other files, and directories, use the hash of their content,
+    which is only computed again when their size or modification time changes.
+    :param file_path: the path for the file or directory
+    :return: the key of the file
+    """
+    key = read_key_file(file_path)
+    if key is not None:
+        return key['key']
+    if os.path.isfile(file_path):
+        return get_files_hashes(file_path, [file_path])[file_path]
+    if os.path.isdir(file_path):
+        files_paths = []
+        for directory, _, files_names in sorted(os.walk(file_path)):
+            for file_name in sorted(files_names):
+                files_paths.append(os.path.join(directory, file_name))
+        hashes = get_files_hashes(file_path, files_paths)
+        files_hashes = []
+        for path in files_paths:
+            files_hashes.extend([os.path.relpath(path, file_path), hashes[path]])
+        return hash_values(files_hashes)
+    return MISSING_INPUT_KEY
+
+
+def get_code_hash(code_modules):
+    """
+    Get the hash of the source code of a list of modules, without importing them
+    :param code_modules: the names of the modules, as 'resources.bucketing'
+    :return: the hex digest of the hash
+    """
+    modules_hashes = []
+    for module in sorted(code_modules):
+        modules_hashes.extend([module, get_file_hash(importlib.util.find_spec(module).origin)])
+    return hash_values(modules_hashes)
+
+
+class StageCache(object):
+    """
+    Decide which files of a stage must be created again, from the stage parameters, the stage code and the stage
+    inputs for each icu stay
+    """
+
+    def __init__(self, stage_name, stage_parameters, code_modules, enabled=True):
+        """
+        :param stage_name: the name of the stage
+        :param stage_parameters: a dict with all parameters that change the stage results, it must be json
+        serializable (values that are not are converted to string)
+        :param code_modules: the names of the modules with the stage code
+        :param enabled: if False, a file is up to date whenever it exists, as without the cache
+        """
+        self.stage_name = stage_name
+        self.code_modules = sorted(code_modules)
+        self.parameters_hash = hash_values([json.dumps(stage_parameters, sort_keys=True, default=str)])
+        self.code_hash = get_code_hash(self.code_modules)
+        self.enabled = enabled
+
+    def get_key(self, inputs_paths, values=()):
+        """
+        Get the key for the file of an icu stay
+        :param inputs_paths: the files used to create it
+        :param values: other values used to create it, as the icu stay times
+        :return: a dict with the key and what was used to create it, to be given to is_up_to_date and save_key
+        """
+        inputs = {path: get_input_key(path) for path in inputs_paths}
+        values = [str(value) for value in values]
+        key = hash_values([self.stage_name, self.parameters_hash, self.code_hash]
+                          + [inputs[path] for path in inputs_paths] + values)
+        return {'key': key, 'stage': self.stage_name, 'parameters_hash': self.parameters_hash,
+                'code_modules': self.code_modules, 'code_hash': self.code_hash, 'inputs': inputs, 'values': values}
+
+    def is_up_to_date(self, file_path, key):
+        """
+        Check if a file was created with the same key, so it can be used without creating it again
+        :param file_path: the path for the created file or directory
+        :param key: the key got by get_key
+        :return: True if the file is up to date
+        """
+        if not os.path.exists(file_path):
+            return False
+        if not self.enabled:
+            return True
+        saved_key = read_key_file(file_path)
+        return saved_key is not None and saved_key['key'] == key['key']
+
+    def save_key(self, file_path, key):
+        """
+        Save the key of a file after creating it
+        :param file_path: the path for the created file or directory
+        :param key: the key got by get_key
+        """
+        key_path = get_key_path(file_path)
+        os.makedirs(os.path.dirname(key_path), exist_ok=True)
+        temporary_key_path = key_path + '.tmp'
+        with open(temporary_key_path, 'w') as key_file:
+            json.dump(key, key_file)
+        os.replace(temporary_key_path, key_path)
+
+    def remove(self, file_path):
+        """
+        Remove a file that a stage doesn't create anymore, with its key
+        :param file_path: the path for the created file
+        """
+        for path in [file_path, get_key_path(file_path)]:
+            if os.path.isfile(path):
+                os.remove(path)
+
+
+def read_manifest(directory):
+    """
+    Read the keys of all files created at a directory, checking which ones are stale: their stage code changed,
+    or one of their inputs changed or was created again since them. Changes at the stage parameters are only
+    known by the stage, when it runs again.
+    :param directory: the directory of the created files
+    :return: a DataFrame with one row for each created file, with its stage, key and if it is stale and why
+    """
+    keys_path = os.path.join(directory, KEYS_DIRNAME)
+    manifest = []
+    if not os.path.exists(keys_path):
+        return pd.DataFrame(manifest, columns=['file', 'stage', 'key', 'exists', 'code_changed', 'inputs_changed',
+                                               'is_stale'])
+    codes_hashes = dict()
+    for key_file_name in sorted(os.listdir(keys_path)):
+        if not key_file_name.endswith('.json'):
+            continue
+        file_path = os.path.join(directory, key_file_name[:-len('.json')])
+        key = read_key_file(file_path)
+        code_modules = tuple(key['code_modules'])
+        if code_modules not in codes_hashes.keys():
+            codes_hashes[code_modules] = get_code_hash(code_modules)
+        code_changed = codes_hashes[code_modules] != key['code_hash']
+        inputs_changed = [path for path, input_key in key['inputs'].items() if get_input_key(path) != input_key]
+        exists = os.path.exists(file_path)
+        manifest.append({'file': file_path, 'stage': key['stage'], 'key': key['key'], 'exists': exists,
+                         'code_changed': code_changed, 'inputs_changed': inputs_changed,
+                         'is_stale': not exists or code_changed or len(inputs_changed) != 0})
+    return pd.DataFrame(manifest, columns=['file', 'stage', 'key', 'exists', 'code_changed', 'inputs_changed',
+                                           'is_stale'])
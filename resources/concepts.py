@@ -0,0 +1,80 @@
+"""
+Map the itemids of the merged events to clinical concepts, merging the columns of the same concept
+"""
+import json
+
+import numpy as np
+import pandas as pd
+
+
+def load_concepts(concepts_file_path):
+    """
+    Load the concepts from a json file, with the concept names as keys and the list of their itemids as values
+    :param concepts_file_path: the path for the json file
+    :return: a dict from concept to the list of its itemids
+    """
+    with open(concepts_file_path) as concepts_file:
+        concepts = json.load(concepts_file)
+    return {concept: [int(itemid) for itemid in itemids] for concept, itemids in concepts.items()}
+
+
+def compile_concepts(concepts):
+    """
+    Create the index from itemid to concept, to be created once and used for all icu stays
+    :param concepts: a dict from concept to the list of its itemids
+    :return: a dict from itemid to concept
+    """
+    itemids_concepts = dict()
+    for concept, itemids in concepts.items():
+        for itemid in itemids:
+            if itemid in itemids_concepts.keys() and itemids_concepts[itemid] != concept:
+                raise ValueError("Itemid {} is at concepts {} and {}".format(itemid, itemids_concepts[itemid],
+                                                                             concept))
+            itemids_concepts[itemid] = concept
+    return itemids_concepts
+
+
+def get_columns_concepts(columns, itemids_concepts):
+    """
+    Get the concept of the events columns, named as <table>_<itemid>, that are at the concepts index
+    :param columns: the events columns
+    :param itemids_concepts: the index created by compile_concepts
+    :return: a pandas.Series indexed by the columns that have a concept, with their concept
+    """
+    columns_concepts = dict()
+    for column in columns:
+        if "Unnamed" in column:
+            continue
+        itemid = int(column.split('_')[1])
+        if itemid in itemids_concepts.keys():
+            columns_concepts[column] = itemids_concepts[itemid]
+    return pd.Series(columns_concepts, dtype=object)
+
+
+def merge_concepts(events, itemids_concepts, concepts):
+    """
+    Merge the events columns of each concept using the mean of their values at each row.
+    Values that are not numbers are ignored.
+    :param events: the events, with one column for each <table>_<itemid>
+    :param itemids_concepts: the index created by compile_concepts
+    :param concepts: the concepts to be created, in the order of the new columns
+    :return: a DataFrame with the same index as events and one column for each concept,
+    and the list of the concepts that don't have any column at the events
+    """
+    columns_concepts = get_columns_concepts(events.columns, itemids_concepts)
+    values = events[list(columns_concepts.index)].apply(pd.to_numeric, errors='coerce')
+    values = values.to_numpy(dtype=float).reshape(len(events), len(columns_concepts))
+    concepts_order = {concept: position for position, concept in enumerate(concepts)}
+    columns_positions = columns_concepts.map(concepts_order).to_numpy(dtype=int)
+    # Sum and count of the values of each concept at each row, using one reduction for all concepts
+    is_value = ~np.isnan(values)
+    sums = np.zeros((len(events), len(concepts)))
+    counts = np.zeros((len(events), len(concepts)))
+    np.add.at(sums.T, columns_positions, np.where(is_value, values, 0).T)
+    np.add.at(counts.T, columns_positions, is_value.T)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+    merged_events = pd.DataFrame(means, index=events.index, columns=list(concepts))
+    present_concepts = set(columns_concepts.values)
+    missing_concepts = [concept for concept in concepts if concept not in present_concepts]
+    return merged_events, missing_concepts
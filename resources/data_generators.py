@@ -18,6 +18,7 @@ from ast import literal_eval
 from nltk import WhitespaceTokenizer
 
 from resources.data_representation import Word2VecEmbeddingCreator, ClinicalTokenizer
+from resources.episodes import load_episode_matrix
 
 from tensorflow.python.keras.utils.data_utils import Sequence as tsSeq
 
@@ -88,13 +89,18 @@ class BertDataGenerator(tsSeq):
 
 class LengthLongitudinalDataGenerator(tsSeq):
 
-    def __init__(self, sizes_data_paths, labels, max_batch_size=50, iterForever=False, ndmin=None):
+    def __init__(self, sizes_data_paths, labels, max_batch_size=50, iterForever=False, ndmin=None, transform=None):
+        """
+        :param transform: a NormalizationTransform for the matrices written without normalization values, applied
+        when each batch is loaded
+        """
         self.max_batch_size = max_batch_size
         self.batches = sizes_data_paths
         self.labels = labels
         self.iterForever = iterForever
         self.__iterPos = 0
         self.ndmin = ndmin
+        self.transform = transform
 
     def create_batches(self):
         new_batches = dict()
@@ -114,8 +120,7 @@ class LengthLongitudinalDataGenerator(tsSeq):
     def __load(self, filesNames):
         x = []
         for fileName in filesNames:
-            with open(fileName, 'rb') as data_file:
-                data = pickle.load(data_file)
+            data = load_episode_matrix(fileName, transform=self.transform)
             x.append(data)
             # if max_len is None or len(data) > max_len:
             #     max_len = len(data)
@@ -141,8 +146,7 @@ class LengthLongitudinalDataGenerator(tsSeq):
             x = []
             for fileName in filesNames:
                 print(fileName)
-                with open(fileName, 'rb') as data_file:
-                    data = pickle.load(data_file)
+                data = load_episode_matrix(fileName, transform=self.transform)
                 test = np.array(data)
                 x.append(data)
                 try:
@@ -212,14 +216,10 @@ class MixedLengthDataGenerator(tsSeq):
         instances = []
         for index, row in data_df.iterrows():
             instance = []
-            with open(row[self.structured_df_column], 'rb') as data_file:
-                # print("===== Structured =====")
-                data = np.asarray(pickle.load(data_file))
-                    # new_data.append(np.asarray(d))
-                # data = np.asarray(new_data)
-                instance.append(data)
-                structured_data.append(data)
-                # instance.append(data)
+            # print("===== Structured =====")
+            data = np.asarray(load_episode_matrix(row[self.structured_df_column]))
+            instance.append(data)
+            structured_data.append(data)
             with open(row[self.textual_df_column], 'rb') as data_file:
                 # print("===== Textual =====")
                 data = np.asarray(pickle.load(data_file))
@@ -317,8 +317,7 @@ class LongitudinalDataGenerator(tsSeq):
         max_len = None
         columns_len = None
         for fileName in filesNames:
-            with open(fileName, 'rb') as data_file:
-                data = pickle.load(data_file)
+            data = load_episode_matrix(fileName)
             x.append(data)
             if max_len is None or len(data) > max_len:
                 max_len = len(data)
@@ -26,6 +26,8 @@ import pandas
 import sys
 
 from multiclassification import constants
+from resources.episodes import load_episode_matrix, read_episode
+from resources.progress import ProgressPool, report_progress
 
 class TransformClinicalTextsRepresentations():
     """
@@ -136,7 +138,7 @@ class TransformClinicalTextsRepresentations():
                 labels.append(row['label'])
                 continue
             path = row[text_paths_column]
-            data = pandas.read_csv(path)
+            data = read_episode(path)
             transformed_texts = self.transform_texts(data, preprocessing_pipeline=preprocessing_pipeline,
                                                      remove_temporal_axis=remove_temporal_axis,
                                                      remove_no_text_constant=remove_no_text_constant)
@@ -166,57 +168,34 @@ class TransformClinicalTextsRepresentations():
             zeros[: len(value)] = value
             return zeros
 
-    def pad_patient_text(self, doc_paths, pad_max_len=None, pad_data_path=None, manager_queue=None):
-        new_paths = dict()
-        for path in doc_paths:
-            filename = path.split('/')[-1]
-            if manager_queue is not None:
-                manager_queue.put(path)
-            transformed_doc_path = pad_data_path + os.path.splitext(filename)[0] + '.pkl'
-            if os.path.exists(transformed_doc_path):
-                new_paths[path] = transformed_doc_path
-                continue
-            with open(path, 'rb') as fhandler:
-                data = pickle.load(fhandler)
-            padded_data = []
-            for value in data:
-                padded_value = self.pad_sequence(value, pad_max_len)
-                if padded_value is not None:
-                    padded_data.append(padded_value)
-            if len(padded_data) != 0:
-                padded_data = numpy.array(padded_data)
-                with open(transformed_doc_path, 'wb') as handler:
-                    pickle.dump(padded_data, handler)
-                new_paths[path] = transformed_doc_path
-        return new_paths
+    def pad_patient_text(self, path, pad_max_len=None, pad_data_path=None):
+        filename = path.split('/')[-1]
+        report_progress()
+        transformed_doc_path = pad_data_path + os.path.splitext(filename)[0] + '.pkl'
+        if os.path.exists(transformed_doc_path):
+            return path, transformed_doc_path
+        with open(path, 'rb') as fhandler:
+            data = pickle.load(fhandler)
+        padded_data = []
+        for value in data:
+            padded_value = self.pad_sequence(value, pad_max_len)
+            if padded_value is not None:
+                padded_data.append(padded_value)
+        if len(padded_data) != 0:
+            padded_data = numpy.array(padded_data)
+            with open(transformed_doc_path, 'wb') as handler:
+                pickle.dump(padded_data, handler)
+            return path, transformed_doc_path
+        return None
 
     def pad_new_representation(self, docs_paths, pad_max_len, pad_data_path=None):
         if not os.path.exists(pad_data_path):
             os.mkdir(pad_data_path)
-        with multiprocessing.Pool(processes=6) as pool:
-            manager = multiprocessing.Manager()
-            manager_queue = manager.Queue()
-            self.lock = manager.Lock()
-            partial_transform_docs = partial(self.pad_patient_text, pad_max_len=pad_max_len, pad_data_path=pad_data_path,
-                                             manager_queue=manager_queue)
-            # docs_paths = self.new_paths.values()
-            # print(docs_paths)
-            # exit()
-            data = numpy.array_split(docs_paths, 6)
-            total_files = len(docs_paths)
-            map_obj = pool.map_async(partial_transform_docs, data)
-            consumed = 0
-            while not map_obj.ready() or manager_queue.qsize() != 0:
-                for _ in range(manager_queue.qsize()):
-                    manager_queue.get()
-                    consumed += 1
-                sys.stderr.write('\rdone {0:%}'.format(consumed / total_files))
+        with ProgressPool() as pool:
+            partial_transform_docs = partial(self.pad_patient_text, pad_max_len=pad_max_len, pad_data_path=pad_data_path)
+            result = pool.map(partial_transform_docs, docs_paths, len(docs_paths))
             print()
-            result = map_obj.get()
-            padded_paths = dict()
-            for r in result:
-                padded_paths.update(r)
-            self.new_paths = padded_paths
+            self.new_paths = dict(r for r in result if r is not None)
 
 
     def get_new_paths(self, files_list):
@@ -488,15 +467,13 @@ class EnsembleMetaLearnerDataCreator():
             data = []
             for p in path:
                 if 'pkl' in p.split('.')[-1]:
-                    with open(p, 'rb') as fhandler:
-                        data.append(pickle.load(fhandler))
+                    data.append(load_episode_matrix(p))
                 elif 'csv' in p.split('.')[-1]:
                     data.append(pandas.read_csv(p).values)
             return data
         elif isinstance(path, str):
             if 'pkl' in path.split('.')[-1]:
-                with open(path, 'rb') as fhandler:
-                    return pickle.load(fhandler)
+                return load_episode_matrix(path)
             elif 'csv' in path.split('.')[-1]:
                 return pandas.read_csv(path).values
 
@@ -584,7 +561,7 @@ class ClinicalBertTextRepresentationTransform():
                 new_paths.append(episode_representation_path)
                 labels.append(row['label'])
                 continue
-            texts_df = pandas.read_csv(row[text_paths_column], index_col='bucket').sort_index()
+            texts_df = read_episode(row[text_paths_column]).set_index('bucket').sort_index()
             ids_series:pandas.Series = self.clinical_tokenizer.process_texts_df_for_bert(texts_df,
                                                                                          text_strategy=tokenization_strategy,
                                                                                          n_tokens=n_tokens,
@@ -0,0 +1,154 @@
+"""
+Episodes that are the first buckets of an icu stay. Instead of having their own file, they are referenced as
+<stay file path>#<position of their last bucket>, and the buckets are only sliced from the stay file when the
+episode is read.
+"""
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from multiclassification import constants
+from resources.imputation import impute_matrix
+from resources.storage import iter_events_file_chunks, read_events_file
+
+EPISODE_REFERENCE_SEPARATOR = '#'
+
+
+def create_episode_reference(stay_path, end_position):
+    """
+    Create the reference for the episode with the buckets of a stay until end_position
+    :param stay_path: the path for the stay file
+    :param end_position: the position, at the stay file, of the last bucket of the episode
+    :return: the episode reference, used as its path
+    """
+    return '{}{}{}'.format(stay_path, EPISODE_REFERENCE_SEPARATOR, end_position)
+
+
+def split_episode_reference(episode_path):
+    """
+    Get the stay file and the last bucket of an episode
+    :param episode_path: the episode reference, or the path for a file that has only the episode
+    :return: the path for the file and the position of the last bucket, which is None when the file
+    has only the episode
+    """
+    if episode_path.rfind(EPISODE_REFERENCE_SEPARATOR) <= episode_path.rfind('/'):
+        return episode_path, None
+    stay_path, end_position = episode_path.rsplit(EPISODE_REFERENCE_SEPARATOR, 1)
+    return stay_path, int(end_position)
+
+
+def get_episode_name(episode_path):
+    """
+    Get a name for an episode that is unique between the episodes of the same stay, to be used for the files
+    created from it
+    :param episode_path: the episode reference, or the path for a file that has only the episode
+    :return: the name of the file without extension, followed by _<position> for episode references
+    """
+    stay_path, end_position = split_episode_reference(episode_path)
+    name = os.path.splitext(os.path.basename(stay_path))[0]
+    if end_position is None:
+        return name
+    return '{}_{}'.format(name, end_position)
+
+
+def is_episode_reference(episode_path):
+    return split_episode_reference(episode_path)[1] is not None
+
+
+def read_episode(episode_path):
+    """
+    Read the buckets of an episode
+    :param episode_path: the episode reference, or the path for a file that has only the episode
+    :return: a DataFrame with the buckets of the episode
+    """
+    stay_path, end_position = split_episode_reference(episode_path)
+    events = read_events_file(stay_path)
+    if end_position is None:
+        return events
+    return events.iloc[:end_position + 1]
+
+
+def iter_episode_chunks(episode_path, chunksize=1000):
+    """
+    Read the buckets of an episode in DataFrames of up to chunksize rows, without loading the whole stay file
+    :param episode_path: the episode reference, or the path for a file that has only the episode
+    :param chunksize: how many buckets each DataFrame has
+    :return: a generator of DataFrames, that together are what read_episode returns
+    """
+    stay_path, end_position = split_episode_reference(episode_path)
+    remaining_rows = None if end_position is None else end_position + 1
+    for chunk in iter_events_file_chunks(stay_path, chunksize=chunksize):
+        if remaining_rows is not None:
+            chunk = chunk.iloc[:remaining_rows]
+            remaining_rows -= len(chunk)
+        yield chunk
+        if remaining_rows == 0:
+            return
+
+
+def load_episode_matrix(episode_path, transform=None):
+    """
+    Load the pickled matrix of an episode. For episode references, the pickle has the matrix of the whole stay with
+    missing values forward filled, so the first rows are sliced and their remaining missing values, which are at
+    the start of the episode, are filled as the matrix of a single episode would be.
+    :param episode_path: the path for the pickle, followed by #<position of the last row> for episode references
+    :param transform: a callable that normalizes and fills the missing values of the matrix, for matrices written
+    without normalization values, as a NormalizationTransform
+    :return: the matrix of the episode
+    """
+    matrix_path, end_position = split_episode_reference(episode_path)
+    with open(matrix_path, 'rb') as matrix_file:
+        matrix = pickle.load(matrix_file)
+    if end_position is not None:
+        matrix = matrix[:end_position + 1]
+    if transform is not None:
+        return transform(np.array(matrix, dtype=np.float32))
+    if end_position is None:
+        return matrix
+    return impute_matrix(np.array(matrix, dtype=float))
+
+
+def get_episode_length(episode_path):
+    """
+    Get the number of rows of an episode matrix. For episode references the length is the position of the last row
+    plus one, so the matrix of the whole stay is not loaded for each of its episodes.
+    :param episode_path: the path for the pickle, followed by #<position of the last row> for episode references
+    :return: the number of rows of the episode
+    """
+    matrix_path, end_position = split_episode_reference(episode_path)
+    if end_position is not None:
+        return end_position + 1
+    with open(matrix_path, 'rb') as matrix_file:
+        return len(pickle.load(matrix_file))
+
+
+def get_hours_until(times, until_time):
+    """
+    Get the number of whole hours from each time until until_time
+    :param times: a pandas.Series of datetime
+    :param until_time: the final time, can be missing
+    :return: a numpy array with the hours, rounded down, which is nan when until_time is missing
+    """
+    if pd.isna(until_time):
+        return np.full(len(times), np.nan)
+    return ((until_time - times) // pd.Timedelta(hours=1)).to_numpy(dtype=float)
+
+
+def fill_missing_text_buckets(structured_buckets, textual_buckets):
+    """
+    Add a bucket with NO_TEXT_CONSTANT as text for each structured bucket that doesn't have notes
+    :param structured_buckets: the structured buckets, with starttime, endtime and bucket
+    :param textual_buckets: the notes buckets, or None if the stay has no notes
+    :return: the notes buckets for all structured buckets, sorted by bucket
+    """
+    missing_buckets = structured_buckets[['starttime', 'endtime', 'bucket']]
+    if textual_buckets is not None:
+        missing_buckets = missing_buckets[~missing_buckets['bucket'].isin(textual_buckets['bucket'])]
+    missing_buckets = missing_buckets.assign(text=constants.NO_TEXT_CONSTANT).reset_index(drop=True)
+    if textual_buckets is None:
+        return missing_buckets.sort_values(by='bucket')
+    if len(missing_buckets) != 0:
+        textual_buckets = pd.concat([missing_buckets, textual_buckets], ignore_index=True)
+    return textual_buckets.sort_values(by='bucket')
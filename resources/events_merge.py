@@ -0,0 +1,121 @@
+"""
+Merge the chartevents and labevents files of an icu stay into one file of events, with one row for each time
+"""
+import csv
+from datetime import datetime
+
+import pandas as pd
+
+
+class UnsortedEventsError(Exception):
+    """
+    Raised when the events of a file are not in increasing time order
+    """
+    pass
+
+
+def read_sorted_rows(storage, icustay_id, datetime_pattern):
+    """
+    Read the rows of an icu stay events file, checking that they are in increasing time order
+    :param storage: the storage of the events
+    :param icustay_id: the icu stay
+    :param datetime_pattern: the pattern used to store time
+    :return: a generator of (time, raw time, values), where time is the parsed raw time as read from the file,
+    and values doesn't have the time column
+    """
+    last_time = None
+    for row in storage.iter_rows(icustay_id):
+        time = row[0] if isinstance(row[0], datetime) else datetime.strptime(row[0], datetime_pattern)
+        if last_time is not None and time <= last_time:
+            raise UnsortedEventsError("Events from {} are not sorted by time".format(storage.file_path(icustay_id)))
+        last_time = time
+        yield time, row[0], row[1:]
+
+
+def merge_sorted_rows(chartevents_rows, labevents_rows, chartevents_width, labevents_width, missing_value=None):
+    """
+    Merge two streams of rows sorted by time, as an outer join by the time: rows with the same time become one row,
+    and the values of a stream that doesn't have a row at a time are missing.
+    :param chartevents_rows: the (time, raw time, values) for chartevents, from read_sorted_rows
+    :param labevents_rows: the (time, raw time, values) for labevents, from read_sorted_rows
+    :param chartevents_width: the number of chartevents values at each row
+    :param labevents_width: the number of labevents values at each row
+    :param missing_value: the value used when a stream doesn't have a row
+    :return: a generator of the merged rows, with the time as the first value
+    """
+    chartevents_missing = [missing_value] * chartevents_width
+    labevents_missing = [missing_value] * labevents_width
+    chartevent = next(chartevents_rows, None)
+    labevent = next(labevents_rows, None)
+    while chartevent is not None or labevent is not None:
+        if labevent is None or (chartevent is not None and chartevent[0] < labevent[0]):
+            yield [chartevent[1]] + chartevent[2] + labevents_missing
+            chartevent = next(chartevents_rows, None)
+        elif chartevent is None or labevent[0] < chartevent[0]:
+            yield [labevent[1]] + chartevents_missing + labevent[2]
+            labevent = next(labevents_rows, None)
+        else:
+            yield [chartevent[1]] + chartevent[2] + labevent[2]
+            chartevent = next(chartevents_rows, None)
+            labevent = next(labevents_rows, None)
+
+
+def stream_merge_events(icustay_id, chartevents_storage, labevents_storage, new_events_storage, datetime_pattern):
+    """
+    Merge the chartevents and labevents of an icu stay reading and writing one row at a time,
+    expecting both files to be sorted by time, as dataset_filter_events.py creates them
+    :param icustay_id: the icu stay
+    :param chartevents_storage: the storage for chartevents
+    :param labevents_storage: the storage for labevents
+    :param new_events_storage: the storage for the merged events
+    :param datetime_pattern: the pattern used to store time
+    """
+    columns_types = []
+    rows = dict()
+    time_type = None
+    for prefix, storage in [('chartevents_', chartevents_storage), ('labevents_', labevents_storage)]:
+        if storage.exists(icustay_id):
+            storage_columns_types = storage.columns_types(icustay_id)
+            if time_type is None:
+                time_type = storage_columns_types[0][1]
+            columns_types += [(prefix + column, column_type) for column, column_type in storage_columns_types[1:]]
+            rows[prefix] = (read_sorted_rows(storage, icustay_id, datetime_pattern), len(storage_columns_types) - 1)
+        else:
+            rows[prefix] = (iter([]), 0)
+    # Missing values are written as empty strings at the csv files, as pandas does
+    missing_value = '' if time_type is None else None
+    merged_rows = merge_sorted_rows(rows['chartevents_'][0], rows['labevents_'][0], rows['chartevents_'][1],
+                                    rows['labevents_'][1], missing_value=missing_value)
+    new_events_storage.write_rows(merged_rows, icustay_id, [('Unnamed: 0', time_type)] + columns_types)
+
+
+def merge_events_in_memory(icustay_id, chartevents_storage, labevents_storage, new_events_storage,
+                           datetime_pattern):
+    """
+    Merge the chartevents and labevents of an icu stay loading both files, for files that are not sorted by time
+    :param icustay_id: the icu stay
+    :param chartevents_storage: the storage for chartevents
+    :param labevents_storage: the storage for labevents
+    :param new_events_storage: the storage for the merged events
+    :param datetime_pattern: the pattern used to store time
+    """
+    if chartevents_storage.exists(icustay_id):
+        chartevents = chartevents_storage.read(icustay_id)
+        chartevents['Unnamed: 0'] = pd.to_datetime(chartevents['Unnamed: 0'], format=datetime_pattern)
+        chartevents = chartevents.set_index(["Unnamed: 0"])
+    else:
+        chartevents = pd.DataFrame([])
+    if labevents_storage.exists(icustay_id):
+        labevents = labevents_storage.read(icustay_id)
+        labevents['Unnamed: 0'] = pd.to_datetime(labevents['Unnamed: 0'], format=datetime_pattern)
+        labevents = labevents.set_index(["Unnamed: 0"])
+    else:
+        labevents = pd.DataFrame([])
+    chartevents = chartevents.add_prefix('chartevents_')
+    labevents = labevents.add_prefix('labevents_')
+    events = pd.merge(chartevents, labevents, how='outer', left_index=True, right_index=True)
+    if 'labevents_Unnamed: 0' in events.columns:
+        events = events.drop(columns=['labevents_Unnamed: 0'])
+    if 'chartevents_Unnamed: 0' in events.columns:
+        events = events.drop(columns=['chartevents_Unnamed: 0'])
+    new_events_storage.write(events, icustay_id, quoting=csv.QUOTE_NONNUMERIC)
@@ -0,0 +1,65 @@
+"""
+Route the events of the raw CHARTEVENTS, LABEVENTS and NOTEEVENTS tables to the icu stays, saving them in a parquet
+dataset partitioned by ICUSTAY_ID
+"""
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Columns that are read as numbers, all the others are kept as text, so every chunk has the same schema
+NUMERIC_COLUMNS = ['ROW_ID', 'SUBJECT_ID', 'CGID', 'VALUENUM', 'WARNING', 'ERROR', 'ISERROR']
+INTEGER_COLUMNS = ['HADM_ID', 'ITEMID']
+# File created when a table was completely read
+PARTITIONED_MARKER = '_SUCCESS'
+# Name of the files of each chunk, padded so the files names order is the chunks order
+CHUNK_FILE_NAME_TEMPLATE = 'chunk-{:010d}-{{i}}.parquet'
+# Default maximum number of partitions that pyarrow writes at once
+DEFAULT_MAX_PARTITIONS = 1024
+
+
+def get_chunk_schema(chunk):
+    """
+    Get the parquet schema for a chunk, forcing the text columns to be strings even when all their values are missing
+    :param chunk: the chunk of events
+    :return: the pyarrow.Schema for the chunk
+    """
+    schema = pa.Schema.from_pandas(chunk, preserve_index=False)
+    for column in chunk.columns:
+        if not pd.api.types.is_numeric_dtype(chunk[column]) \
+                and not pd.api.types.is_datetime64_any_dtype(chunk[column]):
+            schema = schema.set(schema.get_field_index(column), pa.field(column, pa.string()))
+    return schema
+
+
+def partition_events(chunk, stays, partitioned_events_path, chunk_index, datetime_pattern='%Y-%m-%d %H:%M:%S'):
+    """
+    Route the events of a chunk to the icu stays and append them to the partitioned dataset
+    :param chunk: the chunk of events, read with all columns as text
+    :param stays: the icu stays, with their HADM_ID, ICUSTAY_ID, INTIME and OUTTIME
+    :param partitioned_events_path: the path for the partitioned dataset of the table
+    :param chunk_index: the position of the chunk at the table, which names its files, so the files of a partition
+    are read in the order of the table, as the events at the per admission csv files are
+    :param datetime_pattern: the pattern used to store time
+    :return: the number of events saved
+    """
+    # Chartevents has its own ICUSTAY_ID, but the stays intervals are the ones that decide where an event goes
+    chunk = chunk.drop(columns=['ICUSTAY_ID'], errors='ignore')
+    chunk = chunk.dropna(subset=['HADM_ID', 'CHARTTIME'])
+    for column in NUMERIC_COLUMNS:
+        if column in chunk.columns:
+            chunk[column] = pd.to_numeric(chunk[column]).astype('float64')
+    for column in INTEGER_COLUMNS:
+        if column in chunk.columns:
+            chunk[column] = pd.to_numeric(chunk[column]).astype('int64')
+    chunk['CHARTTIME'] = pd.to_datetime(chunk['CHARTTIME'], format=datetime_pattern)
+    chunk = pd.merge(chunk, stays, on='HADM_ID')
+    chunk = chunk[(chunk['CHARTTIME'] >= chunk['INTIME']) & (chunk['CHARTTIME'] <= chunk['OUTTIME'])]
+    chunk = chunk.drop(columns=['INTIME', 'OUTTIME'])
+    if len(chunk) != 0:
+        table = pa.Table.from_pandas(chunk, schema=get_chunk_schema(chunk), preserve_index=False)
+        # A chunk of the raw tables has events from many more stays than the pyarrow default limit
+        max_partitions = max(DEFAULT_MAX_PARTITIONS, chunk['ICUSTAY_ID'].nunique())
+        pq.write_to_dataset(table, partitioned_events_path, partition_cols=['ICUSTAY_ID'],
+                            basename_template=CHUNK_FILE_NAME_TEMPLATE.format(chunk_index),
+                            max_partitions=max_partitions)
+    return len(chunk)
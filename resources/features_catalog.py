@@ -0,0 +1,118 @@
+"""
+The catalog of the features of the icu stays events, collected reading each stay only once: the columns created by
+hot encoding the nominal features, and in how many stays each feature appears. It is enough to encode, complete and
+remove the low frequency features of each stay in one rewrite.
+"""
+from math import floor
+
+import pandas as pd
+
+from resources.features_schema import align_events
+
+
+def create_features_catalog():
+    """
+    Create an empty catalog
+    :return: a dict with:
+    columns, a dict from each column after the hot encoding to the feature that created it;
+    features_frequency, a dict from each feature to the number of stays that have it;
+    nominal_values, a dict from each nominal feature to the set of its values
+    """
+    return {'columns': dict(), 'features_frequency': dict(), 'nominal_values': dict()}
+
+
+def add_stay_to_catalog(catalog, events, time_column='Unnamed: 0'):
+    """
+    Add the features of the events of an icu stay to a catalog. The nominal features are the text columns, as
+    encoded by pandas.get_dummies.
+    :param catalog: the catalog, changed in place
+    :param events: the events of the icu stay, as read from its file
+    :param time_column: the column that has the time of the events, which is not a feature
+    :return: the catalog
+    """
+    nominal_features = set(events.select_dtypes(include=['object', 'string', 'category']).columns)
+    for feature in events.columns:
+        if feature == time_column:
+            continue
+        catalog['features_frequency'][feature] = catalog['features_frequency'].get(feature, 0) + 1
+        if feature not in nominal_features:
+            catalog['columns'][feature] = feature
+            continue
+        values = set(events[feature].dropna().unique())
+        catalog['nominal_values'].setdefault(feature, set()).update(values)
+        for value in values:
+            catalog['columns']['{}_{}'.format(feature, value)] = feature
+    return catalog
+
+
+def merge_features_catalogs(catalogs):
+    """
+    Merge the catalogs of different icu stays
+    :param catalogs: the catalogs
+    :return: a catalog with the features of all of them
+    """
+    merged_catalog = create_features_catalog()
+    for catalog in catalogs:
+        merged_catalog['columns'].update(catalog['columns'])
+        for feature, frequency in catalog['features_frequency'].items():
+            merged_catalog['features_frequency'][feature] = \
+                merged_catalog['features_frequency'].get(feature, 0) + frequency
+        for feature, values in catalog['nominal_values'].items():
+            merged_catalog['nominal_values'].setdefault(feature, set()).update(values)
+    return merged_catalog
+
+
+def get_features_frequency_bins(catalog, total_stays, num_bins=10):
+    """
+    Get the frequency bin of each feature, the bin i having the features that are at i / num_bins
+    until (i + 1) / num_bins of the stays
+    :param catalog: the catalog
+    :param total_stays: the number of stays
+    :param num_bins: how many bins the frequencies are divided in
+    :return: a dict from feature to its bin
+    """
+    return {feature: floor((frequency / total_stays) * num_bins)
+            for feature, frequency in catalog['features_frequency'].items()}
+
+
+def get_catalog_columns(catalog, features_to_remove=None):
+    """
+    Get the columns that every stay has after the hot encoding
+    :param catalog: the catalog
+    :param features_to_remove: the features whose columns are left out
+    :return: the sorted list of columns
+    """
+    if features_to_remove is None:
+        features_to_remove = set()
+    return sorted(column for column, feature in catalog['columns'].items() if feature not in features_to_remove)
+
+
+def get_hot_encoded_columns(catalog):
+    """
+    Get the columns created by the hot encoding of the nominal features
+    :param catalog: the catalog
+    :return: the set of columns
+    """
+    return {column for column, feature in catalog['columns'].items() if column != feature}
+
+
+def encode_stay_events(events, schema, hot_encoded_columns=None, time_column='Unnamed: 0',
+                       datetime_pattern='%Y-%m-%d %H:%M:%S'):
+    """
+    Hot encode the nominal features of the events of an icu stay and align them to the schema: the hot encoded
+    columns that the stay doesn't have are 0, the other columns that it doesn't have are missing values, and the
+    ones that are not at the schema are removed
+    :param events: the events of the icu stay, as read from its file
+    :param schema: the schema, created from the columns returned by get_catalog_columns
+    :param hot_encoded_columns: the columns returned by get_hot_encoded_columns
+    :param time_column: the column that has the time of the events
+    :param datetime_pattern: the pattern used to store time
+    :return: the events indexed and sorted by time, with the columns of the schema
+    """
+    if time_column in events.columns:
+        events[time_column] = pd.to_datetime(events[time_column], format=datetime_pattern)
+        events = events.set_index([time_column]).sort_index()
+    events = pd.get_dummies(events, dummy_na=False, dtype=int)
+    if hot_encoded_columns is None:
+        hot_encoded_columns = set()
+    return align_events(events, schema, fill_values={column: 0 for column in hot_encoded_columns})
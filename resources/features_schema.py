@@ -0,0 +1,86 @@
+"""
+The schema of the per icu stay files of a stage: the ordered list of their columns and the type of each one. It is
+saved once next to the directory of the stage, as <directory>.schema.json, so the directory keeps only the stays
+files, and every stay is written already aligned to it, so the stages that read the files don't need to reconcile
+their columns.
+"""
+import json
+import os
+
+SCHEMA_FILE_SUFFIX = '.schema.json'
+# Name of the schema files saved inside the directory of the stage by earlier versions
+LEGACY_SCHEMA_FILE_NAME = 'schema.json'
+
+
+def create_features_schema(columns, key_columns=None, dtype='float64'):
+    """
+    Create the schema for files with the same features columns
+    :param columns: the features columns, in order
+    :param key_columns: the columns that identify the rows, as the time of the events, kept before the features
+    and without a type
+    :param dtype: the type of the features columns
+    :return: a dict with the key_columns, the columns and their dtypes
+    """
+    if key_columns is None:
+        key_columns = []
+    return {'key_columns': list(key_columns), 'columns': list(columns),
+            'dtypes': {column: dtype for column in columns}}
+
+
+def get_schema_path(directory):
+    """
+    Get the path for the schema file of a directory
+    :param directory: the directory of the files
+    :return: the path, next to the directory
+    """
+    return directory.rstrip('/') + SCHEMA_FILE_SUFFIX
+
+
+def save_features_schema(schema, directory):
+    """
+    Register the schema of the files of a directory
+    :param schema: the schema, as created by create_features_schema
+    :param directory: the directory of the files
+    """
+    schema_file_path = get_schema_path(directory)
+    temporary_file_path = schema_file_path + '.tmp'
+    with open(temporary_file_path, 'w') as schema_file:
+        json.dump(schema, schema_file, indent=4)
+    os.replace(temporary_file_path, schema_file_path)
+    legacy_schema_file_path = os.path.join(directory, LEGACY_SCHEMA_FILE_NAME)
+    if os.path.exists(legacy_schema_file_path):
+        os.remove(legacy_schema_file_path)
+
+
+def load_features_schema(directory):
+    """
+    Load the schema of the files of a directory
+    :param directory: the directory of the files
+    :return: the schema, or None when the directory doesn't have one
+    """
+    schema_file_path = get_schema_path(directory)
+    if not os.path.exists(schema_file_path):
+        schema_file_path = os.path.join(directory, LEGACY_SCHEMA_FILE_NAME)
+    if not os.path.exists(schema_file_path):
+        return None
+    with open(schema_file_path) as schema_file:
+        return json.load(schema_file)
+
+
+def align_events(events, schema, fill_values=None):
+    """
+    Give the events of an icu stay the columns of the schema, in its order and with its types, using a single
+    reindex. The columns that are not at the schema are removed.
+    :param events: the DataFrame with the events
+    :param schema: the schema
+    :param fill_values: a dict from column to the value used when the events don't have it, missing values are
+    used for the other columns
+    :return: the aligned DataFrame
+    """
+    key_columns = [column for column in schema['key_columns'] if column in events.columns]
+    missing_columns = set(schema['columns']) - set(events.columns)
+    events = events.reindex(columns=key_columns + schema['columns'])
+    if fill_values is not None:
+        events = events.fillna(value={column: value for column, value in fill_values.items()
+                                      if column in missing_columns})
+    return events.astype(schema['dtypes'])
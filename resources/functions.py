@@ -23,6 +23,7 @@ from nltk import WhitespaceTokenizer
 from adapter import Word2VecTrainer, Doc2VecTrainer
 from multiclassification.constants import NO_TEXT_CONSTANT
 from resources.data_generators import NoteeventsTextDataGenerator, TaggedNoteeventsDataGenerator
+from resources.episodes import get_episode_length, read_episode
 
 DATE_PATTERN = "%Y-%m-%d"
 DATETIME_PATTERN = "%Y-%m-%d %H:%M:%S"
@@ -202,6 +203,52 @@ def get_event_itemid_and_value(event_label, event):
     return itemid, event_value
 
 
+def events_error_mask(event_label, events, noteevent_category_to_delete=None):
+    """
+    Check which events from a table are errors, the same as event_is_error but for all events at once
+    :param event_label: the table from where the events are
+    :param events: a pandas.DataFrame with the table events
+    :param noteevent_category_to_delete: the noteevents categories that are treated as errors
+    :return: a boolean pandas.Series, True where the event is an error
+    """
+    if event_label == 'CHARTEVENTS':
+        return (events['ERROR'].notnull() & (events['ERROR'] != 0)) \
+               | (events['STOPPED'].notnull() & (events['STOPPED'] != 'NotStopd'))
+    elif event_label == 'LABEVENTS':
+        # Labevents has no error label
+        return pd.Series(False, index=events.index)
+    elif event_label == 'NOTEEVENTS':
+        is_error = events['ISERROR'] == 1
+        if noteevent_category_to_delete is not None:
+            categories = [x.lower() for x in noteevent_category_to_delete]
+            is_error = is_error | events['CATEGORY'].str.lower().isin(categories)
+        return is_error
+    else:
+        raise NotImplemented("Handling error for this table is not implemented yet, exiting.")
+
+
+def get_events_itemid_and_values(event_label, events):
+    """
+    Get the values and their ids for all events from a table, the same as get_event_itemid_and_value
+    but for all events at once
+    :param event_label: the table from where the events are
+    :param events: a pandas.DataFrame with the table events
+    :return: a pair of pandas.Series with the itemids and the values of the events
+    """
+    if event_label == 'NOTEEVENTS':
+        itemids = pd.Series("Note", index=events.index)
+        values = events['TEXT']
+    elif event_label == 'CHARTEVENTS' or event_label == 'LABEVENTS':
+        itemids = events['ITEMID']
+        # VALUENUM when it exists, else the VALUE as text
+        values = events['VALUENUM'].astype(object)
+        is_text = events['VALUENUM'].isnull()
+        values.loc[is_text] = events.loc[is_text, 'VALUE'].map(str)
+    else:
+        raise NotImplemented("Event label don't have a filter for its value and itemid!")
+    return itemids, values
+
+
 def divide_by_events_lenght(data_list, classes, sizes_filename=None, classes_filename=None):
     """
     Divide a dataset based on their number of timesteps
@@ -227,19 +274,18 @@ def divide_by_events_lenght(data_list, classes, sizes_filename=None, classes_fil
         for d, c in zip(data_list, classes):
             sys.stderr.write('\rdone {0:%}'.format(aux / len(data_list)))
             aux += 1
-            with open(d, 'rb') as file_handler:
-                try:
-                    values = pickle.load(file_handler)
-                except Exception as e:
-                    print(d)
-                    print("test")
-                    print(e)
-                    raise ValueError()
-                if len(values) not in sizes.keys():
-                    sizes[len(values)] = []
-                    labels[len(values)] = []
-                sizes[len(values)].append(d)
-                labels[len(values)].append(c)
+            try:
+                length = get_episode_length(d)
+            except Exception as e:
+                print(d)
+                print("test")
+                print(e)
+                raise ValueError()
+            if length not in sizes.keys():
+                sizes[length] = []
+                labels[length] = []
+            sizes[length].append(d)
+            labels[length].append(c)
         if sizes_filename is not None and classes_filename is not None:
             with open(sizes_filename, 'wb') as sizes_handler:
                 pickle.dump(sizes, sizes_handler)
@@ -267,17 +313,16 @@ def mixed_divide_by_events_lenght(data_df:pd.DataFrame, path_column, sizes_filen
         aux = 0
         for index, row in data_df.iterrows():
             sys.stderr.write('\rdone {0:%}'.format(aux / len(data_df)))
-            with open(row[path_column], 'rb') as file_handler:
-                try:
-                    values = pickle.load(file_handler)
-                except Exception as e:
-                    print(row[path_column])
-                    print("test")
-                    print(e)
-                    raise ValueError()
-                if len(values) not in sizes.keys():
-                    sizes[len(values)] = []
-                sizes[len(values)].append(row['episode'])
+            try:
+                length = get_episode_length(row[path_column])
+            except Exception as e:
+                print(row[path_column])
+                print("test")
+                print(e)
+                raise ValueError()
+            if length not in sizes.keys():
+                sizes[length] = []
+            sizes[length].append(row['episode'])
             aux += 1
         if sizes_filename is not None:
             with open(sizes_filename, 'wb') as sizes_handler:
@@ -287,7 +332,7 @@ def mixed_divide_by_events_lenght(data_df:pd.DataFrame, path_column, sizes_filen
 def remove_empty_textual_data_episodes(data:pd.DataFrame, textual_path_column:str) -> pd.DataFrame:
     episodes_to_remove = []
     for index, row in data.iterrows():
-        textual_data = pd.read_csv(row[textual_path_column])
+        textual_data = read_episode(row[textual_path_column])
         textual_data = textual_data[ ~(textual_data['text'] == NO_TEXT_CONSTANT)]
         if textual_data.empty:
             episodes_to_remove.append(row['episode'])
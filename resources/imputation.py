@@ -0,0 +1,90 @@
+"""
+Fill the missing values of the matrix of an icu stay, with one row for each time and one column for each feature, in
+a single numpy pass: each value is the last one observed for its feature, the first one observed for the rows before
+it, or fill_value when the feature is never observed. This is the same as filling with ffill, then backfill, then
+fill_value, and the observations found on the way give the observed mask and the time since the last observation.
+"""
+import numpy as np
+
+
+def get_last_observed_rows(observed):
+    """
+    Get, for each position of the matrix, the row of the last value observed until it at the same column
+    :param observed: a boolean matrix, True where there is a value
+    :return: an int matrix with the rows, -1 before the first value of each column
+    """
+    # The rows are counted from 1 so the positions without observations are 0 before the accumulation
+    last_observed_rows = observed * np.arange(1, observed.shape[0] + 1).reshape(-1, 1)
+    np.maximum.accumulate(last_observed_rows, axis=0, out=last_observed_rows)
+    last_observed_rows -= 1
+    return last_observed_rows
+
+
+def impute_matrix(matrix, fill_value=0, times=None, return_observed_mask=False, return_time_since_observed=False):
+    """
+    Fill the missing values of a matrix in place
+    :param matrix: a writable float numpy matrix, with nan for the missing values
+    :param fill_value: the value for the features that are never observed
+    :param times: the time of each row, as numbers, used for the time since the last observation. When None, the
+    number of rows is used
+    :param return_observed_mask: if the mask of the values that were observed is returned
+    :param return_time_since_observed: if the time since the last observation is returned
+    :return: the filled matrix, followed by the observed mask and the time since the last observation if they are
+    asked. Before the first observation of a feature, the time since the last observation is the time since the
+    first row
+    """
+    observed = ~np.isnan(matrix)
+    last_observed_rows = get_last_observed_rows(observed)
+    if matrix.shape[0] != 0:
+        # The rows before the first observation take it, as backfill would do
+        first_observed_rows = observed.argmax(axis=0)
+        source_positions = np.where(last_observed_rows == -1, first_observed_rows, last_observed_rows)
+        source_positions *= matrix.shape[1]
+        source_positions += np.arange(matrix.shape[1])
+        matrix[...] = np.take(matrix, source_positions)
+        matrix[np.isnan(matrix)] = fill_value
+    results = [matrix]
+    if return_observed_mask:
+        results.append(observed)
+    if return_time_since_observed:
+        if times is None:
+            times = np.arange(matrix.shape[0])
+        times = np.asarray(times, dtype=float).reshape(-1, 1)
+        since_rows = np.maximum(last_observed_rows, 0)
+        results.append((times - times[since_rows, 0]).astype(np.float32))
+    if len(results) == 1:
+        return matrix
+    return tuple(results)
+
+
+def forward_fill_matrix(matrix):
+    """
+    Fill the missing values of a matrix in place with the last value observed at the same column, as ffill does
+    :param matrix: a writable float numpy matrix, with nan for the missing values
+    :return: the matrix, with nan before the first value of each column
+    """
+    last_observed_rows = get_last_observed_rows(~np.isnan(matrix))
+    if matrix.shape[0] != 0:
+        source_positions = np.maximum(last_observed_rows, 0) * matrix.shape[1] + np.arange(matrix.shape[1])
+        # Before the first value of a column the source is the first row, which is missing too
+        matrix[...] = np.take(matrix, source_positions)
+    return matrix
+
+
+def pack_observed_mask(observed):
+    """
+    Pack the observed mask with one bit for each value
+    :param observed: the boolean matrix returned by impute_matrix
+    :return: a uint8 matrix with the bits of each row
+    """
+    return np.packbits(observed, axis=1)
+
+
+def unpack_observed_mask(packed_observed, num_columns):
+    """
+    Unpack an observed mask packed by pack_observed_mask
+    :param packed_observed: the packed mask
+    :param num_columns: the number of columns of the matrix
+    :return: the boolean matrix
+    """
+    return np.unpackbits(packed_observed, axis=1, count=num_columns).astype(bool)
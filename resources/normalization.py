@@ -2,68 +2,62 @@ import csv
 import os
 import pickle
 from functools import partial
-from itertools import islice
-
-import math
 
 import pandas as pd
 import numpy as np
-import multiprocessing as mp
 
-import sys
+from resources.episodes import get_episode_name, iter_episode_chunks, read_episode, split_episode_reference, \
+    create_episode_reference
+from resources.functions import remove_columns_for_classification
+from resources.imputation import forward_fill_matrix, impute_matrix
+from resources.normalization_statistics import fill_empty_statistics, get_folds_training_statistics, \
+    get_matrix_statistics, get_normalization_values, reduce_statistics
+from resources.progress import ProgressPool, report_progress
 
-from math import ceil
 
-from resources.functions import remove_columns_for_classification
+NOT_FEATURES_COLUMNS = ['Unnamed: 0', 'chartevents_Unnamed: 0', 'labevents_Unnamed: 0', 'starttime', 'endtime']
 
 
-def get_file_value_counts(file, pickle_object_path):
+def is_hot_encoded_column(column):
+    return "categorical" in column \
+        or ('categorical' not in column and 'numerical' not in column and len(column.split('_')) > 2)
+
+
+def get_file_statistics(file, pickle_object_path, quantiles_size=None, chunksize=10000):
     """
-    Get the values count for a csv file, and save the result into a pickle file, based the path parameter
-    :param file: the file to get the counts
-    :param pickle_object_path: the path to store the value counts
+    Get the sufficient statistics of each column of a csv file, and save the result into a pickle file, based the path
+    parameter. The file is read in chunks of rows, so only one chunk is in memory at a time.
+    :param file: the file to get the statistics
+    :param pickle_object_path: the path to store the statistics
+    :param quantiles_size: the number of quantiles kept for each column, None to not keep them
+    :param chunksize: the number of rows of each chunk
     :return:
     """
-    pickle_fname = file.split('/')[-1]
-    pickle_fname = pickle_object_path + pickle_fname.split('.')[0] + '.pkl'
+    report_progress()
+    if file == None or (file != None and len(file) == 0):
+        return None
+    pickle_fname = pickle_object_path + get_episode_name(file) + '_statistics.pkl'
     if os.path.exists(pickle_fname):
         # File already exists, do not create it
         return file, pickle_fname
-    if file == None or (file != None and len(file) == 0):
-        return None
-    df = pd.read_csv(file)
-    if 'Unnamed: 0' in df.columns:
-        df = df.drop(columns=['Unnamed: 0'])
-    if 'chartevents_Unnamed: 0' in df.columns:
-        df = df.drop(columns=['chartevents_Unnamed: 0'])
-    if 'labevents_Unnamed: 0' in df.columns:
-        df = df.drop(columns=['labevents_Unnamed: 0'])
-    if 'starttime' in df.columns:
-        df = df.drop(columns=['starttime'])
-    if 'endtime' in df.columns:
-        df = df.drop(columns=['endtime'])
-    counts = dict()
-    save_at_the_end = False
-    columns_altered = []
-    for column in df.columns:
-        # This is a temporary code, had a problem when inserting missing features to files that did not took into account
-        # The already hot encoded features. First see if is a categorical column
-        if "categorical" in column \
-            or ('categorical' not in column and 'numerical' not in column and len(column.split('_')) > 2):
-            if len(df[column].dropna()) == 0:
-                df[column].fillna(0, inplace=True)
-                save_at_the_end = True
-                columns_altered.append(column)
-        # End of temporary code
-        counts[column] = df[column].value_counts().to_dict()
-        # counts[column].index = counts[column].index.map(float)
-    # Temporary code begin
-    if save_at_the_end:
-        df.to_csv(file, index=False)
-    # End temporary code
+    num_rows = 0
+
+    def get_chunks_statistics():
+        nonlocal num_rows
+        for chunk in iter_episode_chunks(file, chunksize=chunksize):
+            chunk = chunk.drop(columns=[column for column in NOT_FEATURES_COLUMNS if column in chunk.columns])
+            num_rows += len(chunk)
+            yield get_matrix_statistics(chunk.to_numpy(dtype=float, copy=True), list(chunk.columns),
+                                        quantiles_size=quantiles_size)
+
+    statistics = reduce_statistics(get_chunks_statistics())
+    # Hot encoded columns without any value, from files written before the stays were aligned to the features
+    # schema, are counted as 0, as they are after the missing values are filled. The file itself is not changed.
+    fill_empty_statistics(statistics, [column for column in statistics['columns'] if is_hot_encoded_column(column)],
+                          num_rows)
     try:
         with open(pickle_fname, 'wb') as result_file:
-            pickle.dump(counts, result_file)
+            pickle.dump(statistics, result_file)
         return file, pickle_fname
     except Exception as e:
         print("Some error happen on {}. Exception {}".format(file, e))
@@ -74,31 +68,89 @@ def get_saved_value_count(file):
         values = pickle.load(normalization_values_file)
         return values
 
-def chunk_lst(data, SIZE=10000):
-    it = iter(data)
-    for i in range(0, len(data), SIZE):
-        yield [k for k in islice(it, SIZE)]
+NORMALIZATION_TYPES = ['z_score', 'min_max']
+
+
+def get_normalization_vectors(normalization_values, columns, normalization_type='z_score'):
+    """
+    Get the vectors that normalize a matrix as (matrix - shift) / scale, aligned to the order of its columns
+    :param normalization_values: the dict returned by NormalizationValues.get_normalization_values
+    :param columns: the columns of the matrix
+    :param normalization_type: z_score to use the mean and std, min_max to use the min and max
+    :return: the shift and scale vectors. Columns with only one value, or without any value, are not changed
+    """
+    if normalization_type not in NORMALIZATION_TYPES:
+        raise ValueError("Normalization type {} is not one of {}".format(normalization_type, NORMALIZATION_TYPES))
+    shift = np.zeros(len(columns))
+    scale = np.ones(len(columns))
+    for position, column in enumerate(columns):
+        values = normalization_values[column]
+        if normalization_type == 'z_score':
+            column_shift, column_scale = values.get('mean', 0), values.get('std', 0)
+        else:
+            column_shift, column_scale = values.get('min', 0), values.get('max', 0) - values.get('min', 0)
+        # If the scale is equal to 0, all values of the column are the same
+        if column_scale != 0:
+            shift[position] = column_shift
+            scale[position] = column_scale
+    return shift, scale
+
+
+def normalize_matrix(matrix, shift, scale):
+    """
+    Normalize a matrix in place, broadcasting the vectors of get_normalization_vectors over its rows
+    :param matrix: a writable float numpy matrix, with nan for the missing values, which stay nan
+    :return: the matrix
+    """
+    matrix -= shift.astype(matrix.dtype)
+    matrix /= scale.astype(matrix.dtype)
+    return matrix
+
+
+class NormalizationTransform(object):
+    """
+    Normalize and fill the missing values of a matrix written by a Normalization without normalization values, as a
+    Normalization with normalization_values would have done, when it is loaded by a data generator. This way one copy
+    of the matrices is used by all folds, each with its own transform.
+    """
+
+    def __init__(self, normalization_values, columns, normalization_type='z_score'):
+        """
+        :param columns: the columns of the matrices, which the Normalization that wrote them was given
+        """
+        self.shift, self.scale = get_normalization_vectors(normalization_values, columns,
+                                                           normalization_type=normalization_type)
+
+    def __call__(self, matrix):
+        """
+        :param matrix: a writable float numpy matrix, with nan for the missing values
+        :return: the matrix normalized and filled in place
+        """
+        if matrix.shape[1] != len(self.shift):
+            raise ValueError("The matrix has {} columns, but the transform has {}".format(matrix.shape[1],
+                                                                                        len(self.shift)))
+        return impute_matrix(normalize_matrix(matrix, self.shift, self.scale))
 
 
 class NormalizationValues(object):
-    def __init__(self, files_list, pickle_object_path="value_counts/"):
+    def __init__(self, files_list, pickle_object_path="value_counts/", quantiles_size=None, chunksize=10000):
         self.files_list = files_list
         if pickle_object_path[-1] != '/':
             pickle_object_path += '/'
         if not os.path.exists(pickle_object_path):
             os.mkdir(pickle_object_path)
-        self.get_file_value_counts = partial(get_file_value_counts, pickle_object_path=pickle_object_path)
+        self.get_file_statistics = partial(get_file_statistics, pickle_object_path=pickle_object_path,
+                                           quantiles_size=quantiles_size, chunksize=chunksize)
         self.counts = None
 
     def prepare(self):
         """
-        Prepare the data getting their value counts for each column, and saving the count object into a pickle file
+        Prepare the data getting their statistics for each column, and saving the statistics into a pickle file
         :return:
         """
         self.counts = dict()
-        with mp.Pool(processes=6) as pool:
-            for i, result in enumerate(pool.imap(self.get_file_value_counts, self.files_list), 1):
-                sys.stderr.write('\rdone {0:%}'.format(i / len(self.files_list)))
+        with ProgressPool() as pool:
+            for result in pool.imap(self.get_file_statistics, self.files_list, len(self.files_list)):
                 if result is not None:
                     self.counts[result[0]] = result[1]
             print()
@@ -113,67 +165,50 @@ class NormalizationValues(object):
         fnames = []
         for file in training_files:
             fnames.append(self.counts[file])
-        values = self.sum_counts(fnames)
-        # print(values)
-        # for key in values.keys():
-        #     if len(values[key]) == 0:
-        #         print(key, values[key])
-        # exit()
-        new_values = dict()
-        for key in values.keys():
-            new_values[key] = dict()
-            unique_values = list(values[key].keys())
-            count_values = [values[key][k] for k in unique_values]
-            if len(unique_values) != 0:
-                new_values[key]['max'] = max(unique_values)
-                new_values[key]['min'] = min(unique_values)
-                mean_std = self.__weighted_avg_and_std(unique_values, count_values)
-                new_values[key]['mean'] = mean_std[0]
-                new_values[key]['std'] = mean_std[1]
+        new_values = get_normalization_values(self.sum_statistics(fnames))
         if saved_file_name is not None:
             self.__save_value_count(new_values, saved_file_name)
         return new_values
 
-    def sum_counts(self, lst):
-        total_files = len(lst)
-        chunks_size = ceil(len(lst) / 10)
-        lst = [x for x in chunk_lst(lst, SIZE=chunks_size)]
-        with mp.Pool(processes=4) as pool:
-            m = mp.Manager()
-            queue = m.Queue()
-            partial_seq_cal_sum = partial(self.cal_sum, queue=queue)
-            map_obj = pool.map_async(partial_seq_cal_sum, lst)
-            consumed = 0
-            while not map_obj.ready():
-                for _ in range(queue.qsize()):
-                    queue.get()
-                    consumed += 1
-                sys.stderr.write('\rdone {0:%}'.format(consumed / total_files))
-            result = map_obj.get()
+    def get_folds_normalization_values(self, folds_files, saved_file_names=None):
+        """
+        Get the normalization values of the training set of each fold of a k-fold, as get_normalization_values does.
+        The statistics of each test set are merged only once, and the training values of a fold come from the total
+        minus its test set.
+        :param folds_files: a list with the test files of each fold, the training files of a fold being the test files
+        of all other folds
+        :param saved_file_names: a list with the file name where the values of each fold are saved, or None
+        :return: a list with the dict of values of each fold
+        """
+        if saved_file_names is None:
+            saved_file_names = [None] * len(folds_files)
+        if all(saved_file_name is not None and os.path.exists(saved_file_name)
+               for saved_file_name in saved_file_names):
+            return [self.__load_saved_value_count(saved_file_name) for saved_file_name in saved_file_names]
+        folds_statistics = []
+        for files in folds_files:
+            folds_statistics.append(self.sum_statistics([self.counts[file] for file in files]))
+        folds_values = []
+        for statistics, saved_file_name in zip(get_folds_training_statistics(folds_statistics), saved_file_names):
+            if saved_file_name is not None and os.path.exists(saved_file_name):
+                folds_values.append(self.__load_saved_value_count(saved_file_name))
+                continue
+            values = get_normalization_values(statistics)
+            if saved_file_name is not None:
+                self.__save_value_count(values, saved_file_name)
+            folds_values.append(values)
+        return folds_values
+
+    def sum_statistics(self, lst):
+        with ProgressPool() as pool:
+            # The statistics are merged as each file is loaded, without keeping all of them
+            statistics = reduce_statistics(pool.imap(self.load_file_statistics, lst, len(lst)))
             print()
-        result = self.cal_sum(result, list_dicts=True)
-        return result
-
-    def cal_sum(self, lst, list_dicts=False, queue=None):
-        final_dict = dict()
-        for l in lst:
-            if list_dicts:
-                counts = l
-            else:
-                counts = self.__load_saved_value_count(l)
-            self.merge_sum_dicts(counts, final_dict)
-            if queue is not None:
-                queue.put(l)
-        return final_dict
-
-    def merge_sum_dicts(self, iter_dict, final_dict):
-        new_dict = {}
-        new_dict.update(final_dict)
-        for key in iter_dict.keys():
-            new_dict.setdefault(key, dict())
-            for k, v in iter_dict[key].items():
-                new_dict[key][k] = new_dict[key].get(k, 0) + v
-        final_dict.update(new_dict)
+        return statistics
+
+    def load_file_statistics(self, file):
+        report_progress()
+        return self.__load_saved_value_count(file)
 
     def __save_value_count(self, values, filename):
         with open(filename, 'wb') as normalization_values_file:
@@ -184,27 +219,21 @@ class NormalizationValues(object):
             values = pickle.load(normalization_values_file)
             return values
 
-    def __weighted_avg_and_std(self, values, weights):
-        """
-        Return the weighted average and standard deviation.
-
-        values, weights -- Numpy ndarrays with the same shape.
-        """
-        try:
-            average = np.average(values, weights=weights)
-        except Exception as e:
-            print(values)
-            print(e)
-            exit()
-        # Fast and numerically precise:
-        variance = np.average((values - average) ** 2, weights=weights)
-        return (average, math.sqrt(variance))
-
 
 class Normalization(object):
 
-    def __init__(self, normalization_values, temporary_path='./data_tmp/'):
+    def __init__(self, normalization_values, temporary_path='./data_tmp/', normalization_type='z_score',
+                 columns=None):
+        """
+        :param normalization_values: the normalization values, or None to write the matrices without normalizing
+        them or filling their missing values, to be done when they are loaded with a NormalizationTransform
+        :param columns: the columns that every file must have, in the same order, when normalization_values is None,
+        as the NormalizationTransform of the matrices uses them for all files
+        """
         self.normalization_values = normalization_values
+        self.normalization_type = normalization_type
+        self.columns = columns
+        self.normalization_vectors = dict()
         self.temporary_path = temporary_path
         if not os.path.exists(temporary_path):
             os.mkdir(temporary_path)
@@ -218,34 +247,13 @@ class Normalization(object):
         :param filesList: the list of files path
         :return: a new list for the paths of the normalized data
         """
-        total_files = len(filesList)
-        chunks_size = ceil(len(filesList)/10)
-        filesList = [x for x in chunk_lst(filesList, SIZE=chunks_size)]
-        self.new_paths = dict()
-        with mp.Pool(processes=2) as pool:
-            m = mp.Manager()
-            queue = m.Queue()
-            partial_normalize_files = partial(self.do_normalization, queue=queue)
-            map_obj = pool.map_async(partial_normalize_files, filesList)
-            consumed = 0
-            while not map_obj.ready() or queue.qsize() != 0:
-                for _ in range(queue.qsize()):
-                    queue.get()
-                    consumed += 1
-                sys.stderr.write('\rdone {0:%}'.format(consumed / total_files))
-            result = map_obj.get()
+        with ProgressPool() as pool:
+            self.new_paths = dict(pool.map(self.do_normalization, filesList, len(filesList)))
             print()
-            for r in result:
-                self.new_paths.update(r)
 
-    def do_normalization(self, files_list, queue=None):
-        new_paths = dict()
-        for l in files_list:
-            pair = self.__normalize_file(l)
-            new_paths[pair[0]] = pair[1]
-            if queue is not None:
-                queue.put(l)
-        return new_paths
+    def do_normalization(self, file):
+        report_progress()
+        return self.__normalize_file(file)
 
 
     def get_new_paths(self, files_list):
@@ -258,49 +266,61 @@ class Normalization(object):
             raise Exception("Data not normalized!")
 
     def __normalize_file(self, file):
+        stay_file, end_position = split_episode_reference(file)
+        if end_position is not None:
+            return self.__normalize_stay_file(file, stay_file, end_position)
         fileName = self.__generate_file_name(file.split('/')[-1])
         if os.path.exists(self.temporary_path + fileName):
             return file, self.temporary_path + fileName
         data = pd.read_csv(file)
         data = remove_columns_for_classification(data)
         try:
-            data = self.__normalize_dataframe(data, self.normalization_values)
+            data = self.__normalize_dataframe(data)
         except Exception as e:
             print(file)
             print(e)
             raise Exception()
         # Fill na
-        data = data.fillna(method='ffill')
-        data = data.fillna(method='backfill')
-        data = data.fillna(0)
-        data = np.array(data.values)
+        if self.normalization_values is not None:
+            data = impute_matrix(data)
         self.__save_normalized_data(data, self.temporary_path, fileName)
         return file, self.temporary_path + fileName
 
-    def __normalize_dataframe(self, data, normalization_values):
+    def __normalize_stay_file(self, file, stay_file, end_position):
+        """
+        Normalize the whole stay of an episode reference, once for all its episodes. Only the forward fill is done
+        here, the other missing values depend on where the episode ends and are filled by load_episode_matrix.
+        :return: the episode reference and the reference for the episode rows at the normalized stay
+        """
+        fileName = self.__generate_file_name(stay_file.split('/')[-1])
+        new_file = create_episode_reference(self.temporary_path + fileName, end_position)
+        if os.path.exists(self.temporary_path + fileName):
+            return file, new_file
+        data = read_episode(stay_file)
+        data = remove_columns_for_classification(data)
+        data = forward_fill_matrix(self.__normalize_dataframe(data))
+        # Other workers may be normalizing the same stay, so the file is only seen when it is complete
+        temporary_file_name = '{}.{}.tmp'.format(fileName, os.getpid())
+        self.__save_normalized_data(data, self.temporary_path, temporary_file_name)
+        os.replace(self.temporary_path + temporary_file_name, self.temporary_path + fileName)
+        return file, new_file
+
+    def __normalize_dataframe(self, data):
         """
-        Normalize data using the normalization_values (max and min for the column)
+        Normalize data using the normalization_values, with the vectors of its columns order computed only once
         :param data: the data to be normalized
-        :return: the data normalized
+        :return: a float32 matrix with the data normalized
         """
-        for column in data.columns:
-            if column not in data.columns:
-                raise Exception("coluna não existe")
-            data.loc[:, column] = self.__z_score_normalization(column, data[column], normalization_values)
-        return data
-
-    def __min_max_normalization(self, column, series, normalization_values):
-        max = normalization_values[column]['max']
-        min = normalization_values[column]['min']
-        return series.apply(lambda x: (x - min) / (max - min))
-
-    def __z_score_normalization(self, column, series, normalization_values):
-        # If std is equal to 0, all columns have the same value
-        if normalization_values[column]['std'] != 0:
-            mean = normalization_values[column]['mean']
-            std = normalization_values[column]['std']
-            return series.apply(lambda x: (x - mean) / std)
-        return series
+        if self.normalization_values is None:
+            if self.columns is not None and list(data.columns) != list(self.columns):
+                raise ValueError("The columns of the data are not the columns of the matrices")
+            return data.to_numpy(dtype=np.float32, copy=True)
+        columns = tuple(data.columns)
+        if columns not in self.normalization_vectors.keys():
+            self.normalization_vectors[columns] = get_normalization_vectors(
+                self.normalization_values, columns, normalization_type=self.normalization_type)
+        shift, scale = self.normalization_vectors[columns]
+        return normalize_matrix(data.to_numpy(dtype=np.float32, copy=True), shift, scale)
 
     def __generate_file_name(self, file_name):
         new_file_name = os.path.splitext(file_name)[0] + '.pkl'
@@ -0,0 +1,228 @@
+"""
+Sufficient statistics for the normalization values: for each column of a file, the count, sum, sum of squares, min
+and max of its values. The statistics of any set of files are merged by summing them, so the normalization values of
+a training set don't need the values of its files, only their statistics.
+Optionally, a fixed size quantile sketch of each column is kept, merged approximately.
+"""
+import numpy as np
+
+SUM_STATISTICS = ['count', 'sum', 'sum_squares']
+
+
+def create_statistics(columns, quantiles_size=None):
+    """
+    Create the statistics of columns without any value
+    :param columns: the columns
+    :param quantiles_size: the number of quantiles kept for each column, None to not keep them
+    :return: a dict with the columns and an array for each statistic, aligned to the columns
+    """
+    num_columns = len(columns)
+    statistics = {'columns': list(columns), 'count': np.zeros(num_columns), 'sum': np.zeros(num_columns),
+                  'sum_squares': np.zeros(num_columns), 'min': np.full(num_columns, np.nan),
+                  'max': np.full(num_columns, np.nan)}
+    if quantiles_size is not None:
+        statistics['quantiles'] = np.full((num_columns, quantiles_size), np.nan)
+    return statistics
+
+
+def get_matrix_statistics(matrix, columns, quantiles_size=None):
+    """
+    Get the statistics of the columns of a matrix
+    :param matrix: a float numpy matrix, with nan for the missing values
+    :param columns: the name of each column of the matrix
+    :param quantiles_size: the number of quantiles kept for each column, None to not keep them
+    :return: the statistics
+    """
+    statistics = create_statistics(columns, quantiles_size=quantiles_size)
+    if matrix.shape[0] == 0:
+        return statistics
+    observed = ~np.isnan(matrix)
+    values = np.where(observed, matrix, 0)
+    statistics['count'] = observed.sum(axis=0).astype(float)
+    statistics['sum'] = values.sum(axis=0)
+    statistics['sum_squares'] = (values * values).sum(axis=0)
+    has_values = statistics['count'] != 0
+    statistics['min'][has_values] = np.nanmin(matrix[:, has_values], axis=0)
+    statistics['max'][has_values] = np.nanmax(matrix[:, has_values], axis=0)
+    if quantiles_size is not None:
+        probabilities = np.linspace(0, 1, quantiles_size)
+        for position in np.flatnonzero(has_values):
+            statistics['quantiles'][position] = np.quantile(matrix[observed[:, position], position], probabilities)
+    return statistics
+
+
+def align_statistics(statistics, columns):
+    """
+    Give the statistics the columns of another set of statistics, as they would be for columns without values
+    :param statistics: the statistics
+    :param columns: the columns
+    :return: the statistics aligned to columns
+    """
+    if statistics['columns'] == list(columns):
+        return statistics
+    quantiles_size = statistics['quantiles'].shape[1] if 'quantiles' in statistics.keys() else None
+    aligned_statistics = create_statistics(columns, quantiles_size=quantiles_size)
+    positions = {column: position for position, column in enumerate(statistics['columns'])}
+    for new_position, column in enumerate(columns):
+        if column in positions.keys():
+            for statistic in aligned_statistics.keys():
+                if statistic != 'columns':
+                    aligned_statistics[statistic][new_position] = statistics[statistic][positions[column]]
+    return aligned_statistics
+
+
+def merge_statistics(statistics_list):
+    """
+    Merge the statistics of different files. When the files have the same columns, as the ones aligned to a
+    features schema, this is a sum of their arrays.
+    :param statistics_list: a list with the statistics of each file
+    :return: the statistics of all files
+    """
+    columns = []
+    seen_columns = set()
+    for statistics in statistics_list:
+        for column in statistics['columns']:
+            if column not in seen_columns:
+                seen_columns.add(column)
+                columns.append(column)
+    statistics_list = [align_statistics(statistics, columns) for statistics in statistics_list]
+    has_quantiles = len(statistics_list) != 0 and all('quantiles' in statistics.keys()
+                                                      for statistics in statistics_list)
+    merged_statistics = create_statistics(
+        columns, quantiles_size=statistics_list[0]['quantiles'].shape[1] if has_quantiles else None)
+    if len(statistics_list) == 0:
+        return merged_statistics
+    for statistic in SUM_STATISTICS:
+        merged_statistics[statistic] = np.sum([statistics[statistic] for statistics in statistics_list], axis=0)
+    merged_statistics['min'] = np.fmin.reduce([statistics['min'] for statistics in statistics_list])
+    merged_statistics['max'] = np.fmax.reduce([statistics['max'] for statistics in statistics_list])
+    if has_quantiles:
+        merged_statistics['quantiles'] = _merge_quantiles(statistics_list)
+    return merged_statistics
+
+
+def reduce_statistics(statistics_iterable):
+    """
+    Merge a stream of statistics as a binary tree, where only statistics of the same tree level are merged, so only
+    one statistics for each level, about log2 of the stream size, is kept in memory
+    :param statistics_iterable: an iterable of statistics, as a generator
+    :return: the statistics of all the stream
+    """
+    levels = []
+    for statistics in statistics_iterable:
+        level = 0
+        while len(levels) != 0 and levels[-1][0] == level:
+            statistics = merge_statistics([levels.pop()[1], statistics])
+            level += 1
+        levels.append((level, statistics))
+    if len(levels) == 0:
+        return merge_statistics([])
+    merged_statistics = levels.pop()[1]
+    while len(levels) != 0:
+        merged_statistics = merge_statistics([levels.pop()[1], merged_statistics])
+    return merged_statistics
+
+
+def fill_empty_statistics(statistics, columns, num_rows, value=0):
+    """
+    Give the columns without any value the statistics they would have with value at all rows, in place
+    :param statistics: the statistics
+    :param columns: the columns to fill, when they don't have values
+    :param num_rows: the number of rows of the matrix of the statistics
+    :param value: the value
+    :return: the statistics
+    """
+    if num_rows == 0:
+        return statistics
+    positions = {column: position for position, column in enumerate(statistics['columns'])}
+    for column in columns:
+        position = positions[column]
+        if statistics['count'][position] != 0:
+            continue
+        statistics['count'][position] = num_rows
+        statistics['sum'][position] = value * num_rows
+        statistics['sum_squares'][position] = value * value * num_rows
+        statistics['min'][position] = value
+        statistics['max'][position] = value
+        if 'quantiles' in statistics.keys():
+            statistics['quantiles'][position] = value
+    return statistics
+
+
+def get_folds_training_statistics(folds_statistics):
+    """
+    Get the statistics of the training set of each fold of a k-fold, from the statistics of the test set of each fold.
+    The test sets are disjoint and the training set of a fold has all other test sets, so its sums are the total minus
+    its test set, and its min, max and quantiles come from the other test sets.
+    :param folds_statistics: a list with the statistics of the test set of each fold
+    :return: a list with the statistics of the training set of each fold
+    """
+    total_statistics = merge_statistics(folds_statistics)
+    folds_statistics = [align_statistics(statistics, total_statistics['columns']) for statistics in folds_statistics]
+    training_statistics = []
+    for fold, statistics in enumerate(folds_statistics):
+        others_statistics = folds_statistics[:fold] + folds_statistics[fold + 1:]
+        quantiles_size = total_statistics['quantiles'].shape[1] if 'quantiles' in total_statistics.keys() else None
+        fold_training_statistics = create_statistics(total_statistics['columns'], quantiles_size=quantiles_size)
+        for statistic in SUM_STATISTICS:
+            fold_training_statistics[statistic] = total_statistics[statistic] - statistics[statistic]
+        # Only the columns with values at the other folds keep their sums, avoiding the rounding of the subtraction
+        without_values = fold_training_statistics['count'] <= 0
+        for statistic in SUM_STATISTICS:
+            fold_training_statistics[statistic][without_values] = 0
+        if len(others_statistics) != 0:
+            fold_training_statistics['min'] = np.fmin.reduce([other['min'] for other in others_statistics])
+            fold_training_statistics['max'] = np.fmax.reduce([other['max'] for other in others_statistics])
+            if quantiles_size is not None:
+                fold_training_statistics['quantiles'] = _merge_quantiles(others_statistics)
+        training_statistics.append(fold_training_statistics)
+    return training_statistics
+
+
+def get_normalization_values(statistics):
+    """
+    Get the max, min, mean and std of each column from its statistics
+    :param statistics: the statistics
+    :return: a dict from column to a dict with its max, min, mean and std, and the quantiles when they are kept.
+    Columns without any value have an empty dict
+    """
+    counts = statistics['count']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = statistics['sum'] / counts
+        variances = np.maximum(statistics['sum_squares'] / counts - means * means, 0)
+    values = dict()
+    for position, column in enumerate(statistics['columns']):
+        values[column] = dict()
+        if counts[position] == 0:
+            continue
+        values[column]['max'] = statistics['max'][position]
+        values[column]['min'] = statistics['min'][position]
+        values[column]['mean'] = means[position]
+        values[column]['std'] = np.sqrt(variances[position])
+        if 'quantiles' in statistics.keys():
+            values[column]['quantiles'] = statistics['quantiles'][position]
+    return values
+
+
+def _merge_quantiles(statistics_list):
+    """
+    Merge the quantile sketches taking each quantile of a file as a point weighted by the count of the file
+    """
+    quantiles = np.stack([statistics['quantiles'] for statistics in statistics_list], axis=1)
+    counts = np.stack([statistics['count'] for statistics in statistics_list], axis=1)
+    num_columns, num_files, quantiles_size = quantiles.shape
+    probabilities = np.linspace(0, 1, quantiles_size)
+    merged_quantiles = np.full((num_columns, quantiles_size), np.nan)
+    for position in range(num_columns):
+        points = quantiles[position].ravel()
+        weights = np.repeat(counts[position] / quantiles_size, quantiles_size)
+        has_points = ~np.isnan(points) & (weights != 0)
+        if not has_points.any():
+            continue
+        order = np.argsort(points[has_points], kind='stable')
+        points = points[has_points][order]
+        cumulative_weights = np.cumsum(weights[has_points][order])
+        cumulative_weights = (cumulative_weights - cumulative_weights[0]) \
+            / max(cumulative_weights[-1] - cumulative_weights[0], np.finfo(float).tiny)
+        merged_quantiles[position] = np.interp(probabilities, cumulative_weights, points)
+    return merged_quantiles
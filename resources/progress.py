@@ -0,0 +1,114 @@
+"""
+Progress reporting for the multiprocessing pools: the workers increase a counter at shared memory,
+and the driver only reads it from time to time while it waits for the results
+"""
+import multiprocessing as mp
+import sys
+
+from resources.scheduler import get_pool_size
+
+# The counter of the pool that created this worker process, set by the pool initializer
+_progress_counter = None
+
+
+def _set_progress_counter(counter):
+    global _progress_counter
+    _progress_counter = counter
+
+
+def report_progress(count=1):
+    """
+    Add to the progress of the pool running this process. Does nothing when not running inside a ProgressPool.
+    :param count: how many items were done
+    """
+    if _progress_counter is not None:
+        with _progress_counter.get_lock():
+            _progress_counter.value += count
+
+
+class ProgressPool(object):
+    """
+    A multiprocessing.Pool that shows the progress reported by its workers with report_progress
+    """
+
+    def __init__(self, processes=None, refresh_interval=0.5, message='\rdone {0:%}'):
+        """
+        :param processes: the number of worker processes, the number of available cpus when None
+        :param refresh_interval: how many seconds the driver sleeps between each progress update
+        :param message: the progress message, formatted with the fraction of items done
+        """
+        self.counter = mp.Value('l', 0)
+        self.refresh_interval = refresh_interval
+        self.message = message
+        if processes is None:
+            processes = get_pool_size()
+        self.pool = mp.Pool(processes=processes, initializer=_set_progress_counter, initargs=(self.counter,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.pool.terminate()
+
+    def map(self, func, iterable, total, chunksize=1):
+        """
+        Apply func to each item of iterable at the workers, showing the progress until all are done
+        :param func: the function, that calls report_progress for each item it processes
+        :param iterable: the arguments for each call of func
+        :param total: the number of items expected to be reported
+        :param chunksize: how many items are given to a worker at once. With 1, each worker takes the next item
+        when it finishes the last one, in the iterable order
+        :return: the list of results, in the iterable order
+        """
+        self.reset_progress()
+        return self.wait(self.pool.map_async(func, iterable, chunksize=chunksize), total)
+
+    def starmap(self, func, iterable, total, chunksize=1):
+        """
+        Same as map, but each item of iterable is unpacked as the arguments of func
+        """
+        self.reset_progress()
+        return self.wait(self.pool.starmap_async(func, iterable, chunksize=chunksize), total)
+
+    def imap(self, func, iterable, total, chunksize=1):
+        """
+        Same as map, but the results are given as soon as they are ready, in the iterable order, so the driver can
+        write them without keeping all of them
+        """
+        self.reset_progress()
+        results = self.pool.imap(func, iterable, chunksize=chunksize)
+        while True:
+            try:
+                result = results.next(self.refresh_interval)
+            except mp.TimeoutError:
+                self.write_progress(total)
+                continue
+            except StopIteration:
+                self.write_progress(total)
+                return
+            yield result
+
+    def reset_progress(self):
+        with self.counter.get_lock():
+            self.counter.value = 0
+
+    def wait(self, map_obj, total):
+        """
+        Wait for the results of an asynchronous call to the pool, showing the progress reported by the workers
+        :param map_obj: the multiprocessing.pool.AsyncResult
+        :param total: the number of items expected to be reported
+        :return: the results
+        """
+        while not map_obj.ready():
+            # Sleeps until the results are ready or the interval is over, without consuming the cpu
+            map_obj.wait(self.refresh_interval)
+            self.write_progress(total)
+        return map_obj.get()
+
+    def write_progress(self, total):
+        """
+        Show the fraction of the total items that the workers reported as done
+        :param total: the number of items expected to be reported
+        """
+        if total != 0:
+            sys.stderr.write(self.message.format(self.counter.value / total))
@@ -0,0 +1,67 @@
+"""
+Create the tasks for the multiprocessing pools of the dataset scripts: one task for each icu stay, with the biggest
+stays first, so a worker that gets a long stay doesn't leave the others waiting at the end
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+
+def get_pool_size():
+    """
+    Get how many worker processes to use, from the cpus that this process can run on
+    :return: the number of processes
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return max(1, len(os.sched_getaffinity(0)))
+    return max(1, os.cpu_count() or 1)
+
+
+def get_files_sizes(files_paths):
+    """
+    Get the size of each file, using 0 for the files that don't exist
+    :param files_paths: the paths for the files
+    :return: a numpy array with the size in bytes of each file
+    """
+    return np.array([os.path.getsize(path) if os.path.exists(path) else 0 for path in files_paths], dtype=np.int64)
+
+
+def get_stays_files_sizes(icustay_ids, storages):
+    """
+    Get the size of the files of each icu stay, summed over the storages
+    :param icustay_ids: the icu stays
+    :param storages: the StayStorage where the files of the icu stays are
+    :return: a numpy array with the size in bytes of the files of each icu stay
+    """
+    sizes = np.zeros(len(icustay_ids), dtype=np.int64)
+    for storage in storages:
+        sizes += get_files_sizes([storage.file_path(icustay_id) for icustay_id in icustay_ids])
+    return sizes
+
+
+def get_stays_los(dataset, intime_column='INTIME', outtime_column='OUTTIME'):
+    """
+    Get the length of stay of each icu stay, used as its size when the files are not created yet
+    :param dataset: the icu stays, with their INTIME and OUTTIME as datetime
+    :param intime_column: the column with the intime
+    :param outtime_column: the column with the outtime
+    :return: a numpy array with the length of stay in seconds, 0 when it is missing
+    """
+    los = (pd.to_datetime(dataset[outtime_column]) - pd.to_datetime(dataset[intime_column])).dt.total_seconds()
+    return los.fillna(0).to_numpy()
+
+
+def create_stays_tasks(stays, sizes):
+    """
+    Create one task for each icu stay, ordered from the biggest to the smallest, to be given to the pool
+    with chunksize 1, so the stays are given to the workers as they become free
+    :param stays: a DataFrame with one icu stay at each row, or a list of icu stays
+    :param sizes: the size of each icu stay
+    :return: a list of single row DataFrames, or of lists with only one icu stay
+    """
+    order = np.argsort(-np.asarray(sizes), kind='stable')
+    if isinstance(stays, pd.DataFrame):
+        return [stays.iloc[[position]] for position in order]
+    stays = list(stays)
+    return [[stays[position]] for position in order]
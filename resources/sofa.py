@@ -0,0 +1,134 @@
+"""
+SOFA scores for whole pivoted tables at once: each component is scored from arrays of its variables, and missing
+values don't add to the score
+"""
+import numpy as np
+import pandas as pd
+
+SOFA_COMPONENTS = ['cardiovascular', 'coagulation', 'respiratory', 'renal', 'neurological', 'liver']
+
+
+def _as_array(values):
+    return np.asarray(values, dtype=float)
+
+
+def get_coagulation_scores(platelet):
+    """
+    Get sofa score for coagulation function
+    :param platelet: the quantity of platelet
+    :return: an array with a number between 0-4 depending on the value of platelet
+    """
+    platelet = _as_array(platelet)
+    return np.select([platelet < 20, platelet < 50, platelet < 100, platelet < 150], [4, 3, 2, 1], default=0)
+
+
+def get_respiration_scores(pao2fio2_vent, pao2fio2_novent):
+    """
+    Get sofa score for respiration function
+    :param pao2fio2_vent: the value of PaO2FiO2 when the patient is on ventilation
+    :param pao2fio2_novent: the value of PaO2FiO2 when the patient is not on ventilation
+    :return: an array with a number between 0-4 depending on the value of PaO2FiO2
+    """
+    pao2fio2_vent = _as_array(pao2fio2_vent)
+    pao2fio2_novent = _as_array(pao2fio2_novent)
+    return np.select([pao2fio2_vent < 100, pao2fio2_vent < 200, pao2fio2_novent < 300, pao2fio2_novent < 400],
+                     [4, 3, 2, 1], default=0)
+
+
+def get_liver_scores(bilirubin):
+    """
+    Get the sofa score for liver function
+    :param bilirubin: the quantity of bilirubin on blood
+    :return: an array with a number between 0-4 depending on the value of bilirubin
+    """
+    bilirubin = _as_array(bilirubin)
+    return np.select([bilirubin >= 12, bilirubin >= 6, bilirubin >= 2, bilirubin >= 1.2], [4, 3, 2, 1], default=0)
+
+
+def get_cardiovascular_scores(rate_dopamine, rate_epinephrine, rate_norepinephrine, rate_dobutamine, mean_bp):
+    """
+    Get the sofa score for cardiovascular function
+    :param rate_dopamine: the rate of dopamine input
+    :param rate_epinephrine: the rate of epinephrine input
+    :param rate_norepinephrine: the rate of norepinephrine input
+    :param rate_dobutamine: the rate of dobutamine input
+    :param mean_bp: the mean bp
+    :return: an array with a number between 0-4 depending on the value of the parameters
+    """
+    rate_dopamine = _as_array(rate_dopamine)
+    rate_epinephrine = _as_array(rate_epinephrine)
+    rate_norepinephrine = _as_array(rate_norepinephrine)
+    rate_dobutamine = _as_array(rate_dobutamine)
+    mean_bp = _as_array(mean_bp)
+    return np.select([(rate_dopamine > 15) | (rate_epinephrine > 0.1) | (rate_norepinephrine > 0.1),
+                      (rate_dopamine > 5) | (rate_epinephrine <= 0.1) | (rate_norepinephrine <= 0.1),
+                      (rate_dopamine > 0) | (rate_dobutamine > 0),
+                      mean_bp < 70],
+                     [4, 3, 2, 1], default=0)
+
+
+def get_neurological_scores(gcs):
+    """
+    Get neurological sofa score
+    :param gcs: the glasgow coma score value
+    :return: an array with a number between 0-4 based on gcs score
+    """
+    gcs = _as_array(gcs)
+    return np.select([(gcs >= 13) & (gcs <= 14), (gcs >= 10) & (gcs <= 12), (gcs >= 6) & (gcs <= 9), gcs < 6],
+                     [1, 2, 3, 4], default=0)
+
+
+def get_renal_scores(urine_output, creatinine):
+    """
+    Get renal sofa score
+    :param urine_output: the urine output value
+    :param creatinine: the creatine value
+    :return: an array with a number between 0-4 based on the creatine and urine output
+    """
+    urine_output = _as_array(urine_output)
+    creatinine = _as_array(creatinine)
+    return np.select([(creatinine >= 5) | (urine_output < 200),
+                      ((creatinine >= 3.5) & (creatinine < 5)) | (urine_output < 500),
+                      (creatinine >= 2) & (creatinine < 3.5),
+                      (creatinine >= 1.2) & (creatinine < 2)],
+                     [4, 3, 2, 1], default=0)
+
+
+def get_sofa_scores(pivoted_sofa):
+    """
+    Get the score of each sofa component for all rows of a pivoted sofa table
+    :param pivoted_sofa: the table, with the columns of the mimic pivoted_sofa query
+    :return: a DataFrame with the SOFA_COMPONENTS columns, with the same index as the table
+    """
+    scores = {
+        'cardiovascular': get_cardiovascular_scores(pivoted_sofa['rate_dopamine'], pivoted_sofa['rate_epinephrine'],
+                                                    pivoted_sofa['rate_norepinephrine'],
+                                                    pivoted_sofa['rate_dobutamine'], pivoted_sofa['meanbp_min']),
+        'coagulation': get_coagulation_scores(pivoted_sofa['platelet_min']),
+        'respiratory': get_respiration_scores(pivoted_sofa['pao2fio2ratio_vent'],
+                                              pivoted_sofa['pao2fio2ratio_novent']),
+        'renal': get_renal_scores(pivoted_sofa['urineoutput'], pivoted_sofa['creatinine_max']),
+        'neurological': get_neurological_scores(pivoted_sofa['gcs_min']),
+        'liver': get_liver_scores(pivoted_sofa['bilirubin_max'])
+    }
+    return pd.DataFrame(scores, index=pivoted_sofa.index, columns=SOFA_COMPONENTS)
+
+
+def get_rolling_max_scores(scores, stays, hours, window_hours=24):
+    """
+    Get the maximum of each score over the last window_hours hours of the same icu stay, for each row
+    :param scores: a DataFrame with the scores
+    :param stays: the icu stay of each row
+    :param hours: the hour of each row since the start of its stay, with only one row for each hour of a stay
+    :param window_hours: the size of the window, which has the rows with hour in (hour - window_hours, hour]
+    :return: a DataFrame with the maximum scores, with the same index and columns as scores
+    """
+    order = np.lexsort((_as_array(hours), np.asarray(stays)))
+    sorted_scores = scores.iloc[order]
+    sorted_scores.index = pd.to_timedelta(_as_array(hours)[order], unit='h')
+    rolling_max = sorted_scores.groupby(np.asarray(stays)[order], sort=False) \
+        .rolling('{}h'.format(window_hours)).max()
+    # Going back to the rows order of scores
+    values = np.empty(rolling_max.shape)
+    values[order] = rolling_max.to_numpy()
+    return pd.DataFrame(values, index=scores.index, columns=scores.columns).astype(scores.dtypes.to_dict())
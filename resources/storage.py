@@ -0,0 +1,361 @@
+"""
+Storage formats for the per icu stay files written and read by the dataset pipeline stages
+"""
+import csv
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+CSV_FORMAT = 'csv'
+PARQUET_FORMAT = 'parquet'
+FEATHER_FORMAT = 'feather'
+
+
+def to_columnar_compatible(events, index=True):
+    """
+    Prepare a DataFrame to be saved in a columnar format, in the same way that it would be read back from a csv:
+    the index becomes a column (named 'Unnamed: 0' when it has no name), the column names become strings and each
+    column has only one type, numeric if all its values are numbers, or text otherwise.
+    :param events: the DataFrame to be saved
+    :param index: if the index is saved as a column
+    :return: the DataFrame ready to be saved
+    """
+    if index:
+        index_name = events.index.name if events.index.name is not None else 'Unnamed: 0'
+        events = events.rename_axis(index_name).reset_index()
+    else:
+        events = events.reset_index(drop=True)
+    events.columns = [str(column) for column in events.columns]
+    for column in events.columns:
+        if events[column].dtype != object:
+            continue
+        numeric_values = pd.to_numeric(events[column], errors='coerce')
+        if numeric_values.isna().sum() == events[column].isna().sum():
+            events[column] = numeric_values
+        else:
+            events[column] = events[column].where(events[column].isna(), events[column].astype(str))
+    return events
+
+
+class StayStorage(object):
+    """
+    Store the events of each icu stay in a file, named by the ICUSTAY_ID, inside a directory
+    """
+    extension = None
+
+    def __init__(self, path):
+        self.path = path
+
+    def file_path(self, icustay_id):
+        return self.path + '{}{}'.format(icustay_id, self.extension)
+
+    def exists(self, icustay_id):
+        return os.path.exists(self.file_path(icustay_id))
+
+    def icustay_ids(self):
+        """
+        Get the icu stays that have a file in this storage
+        :return: the list of ICUSTAY_ID
+        """
+        return [int(os.path.splitext(x)[0]) for x in os.listdir(self.path) if x.endswith(self.extension)]
+
+    def read(self, icustay_id):
+        return read_events_file(self.file_path(icustay_id))
+
+    def write(self, events, icustay_id, index=True, **kwargs):
+        raise NotImplementedError()
+
+    def columns_types(self, icustay_id):
+        """
+        Get the columns of the events file of an icu stay, without reading its rows
+        :param icustay_id: the icu stay
+        :return: a list of (column, type) pairs, where the type is a pyarrow.DataType or None when the format
+        has no types
+        """
+        raise NotImplementedError()
+
+    def iter_rows(self, icustay_id, batch_size=10000):
+        """
+        Read the rows of the events file of an icu stay one by one, without loading the whole file
+        :param icustay_id: the icu stay
+        :param batch_size: how many rows are read from the file at once
+        :return: a generator of lists, with one value for each column
+        """
+        raise NotImplementedError()
+
+    def write_rows(self, rows, icustay_id, columns_types, batch_size=10000):
+        """
+        Save the events of an icu stay from a stream of rows, keeping only batch_size rows in memory.
+        The file is created at a temporary path and only moved to its place at the end, so a stay that was not
+        completely written doesn't look as done.
+        :param rows: an iterable of lists, with one value for each column
+        :param icustay_id: the icu stay
+        :param columns_types: the (column, type) pairs, as returned by columns_types
+        :param batch_size: how many rows are kept before writing them to the file
+        """
+        temporary_file_path = self.file_path(icustay_id) + '.tmp'
+        try:
+            self._write_rows(rows, temporary_file_path, columns_types, batch_size)
+        except BaseException:
+            if os.path.exists(temporary_file_path):
+                os.remove(temporary_file_path)
+            raise
+        os.replace(temporary_file_path, self.file_path(icustay_id))
+
+    def _write_rows(self, rows, file_path, columns_types, batch_size):
+        raise NotImplementedError()
+
+    def iter_chunks(self, icustay_id, chunksize=1000):
+        """
+        Read the events file of an icu stay in DataFrames of up to chunksize rows, without loading the whole file.
+        A file without rows gives one empty DataFrame with its columns.
+        :param icustay_id: the icu stay
+        :param chunksize: how many rows each DataFrame has
+        :return: a generator of DataFrames, as read would return them
+        """
+        raise NotImplementedError()
+
+    def write_chunks(self, chunks, icustay_id, index=True):
+        """
+        Save the events of an icu stay from a stream of DataFrames with the same columns, keeping only one of them
+        in memory. As in write_rows, the file is only moved to its place when it was completely written.
+        :param chunks: an iterable of DataFrames
+        :param icustay_id: the icu stay
+        :param index: if the DataFrames index is saved
+        """
+        temporary_file_path = self.file_path(icustay_id) + '.tmp'
+        try:
+            self._write_chunks(chunks, temporary_file_path, index)
+        except BaseException:
+            if os.path.exists(temporary_file_path):
+                os.remove(temporary_file_path)
+            raise
+        os.replace(temporary_file_path, self.file_path(icustay_id))
+
+    def _write_chunks(self, chunks, file_path, index):
+        raise NotImplementedError()
+
+    def remove(self, icustay_id):
+        os.remove(self.file_path(icustay_id))
+
+
+class CsvStayStorage(StayStorage):
+    extension = '.csv'
+
+    def write(self, events, icustay_id, index=True, **kwargs):
+        """
+        Save the events of an icu stay
+        :param events: the DataFrame with the events
+        :param icustay_id: the icu stay
+        :param index: if the DataFrame index is saved
+        :param kwargs: other parameters for DataFrame.to_csv, as the quoting
+        """
+        events.to_csv(self.file_path(icustay_id), index=index, **kwargs)
+
+    # The files are written by pandas quoting all non numeric values, so reading them with the same quoting
+    # gives floats for the numbers and strings for the text, with missing values as empty strings. The header is
+    # not read with that quoting, as pandas doesn't quote numeric column names and they have to stay as the strings
+    # that pandas.read_csv gives
+    def columns_types(self, icustay_id):
+        with open(self.file_path(icustay_id)) as events_file:
+            columns = next(csv.reader(events_file))
+        return [(column, None) for column in columns]
+
+    def iter_rows(self, icustay_id, batch_size=10000):
+        with open(self.file_path(icustay_id)) as events_file:
+            reader = csv.reader(events_file, quoting=csv.QUOTE_NONNUMERIC)
+            next(reader)
+            for row in reader:
+                yield row
+
+    def _write_rows(self, rows, file_path, columns_types, batch_size):
+        with open(file_path, 'w') as events_file:
+            writer = csv.writer(events_file, quoting=csv.QUOTE_NONNUMERIC)
+            writer.writerow([column for column, _ in columns_types])
+            for row in rows:
+                writer.writerow(['' if value is None else value for value in row])
+
+    def iter_chunks(self, icustay_id, chunksize=1000):
+        for chunk in pd.read_csv(self.file_path(icustay_id), chunksize=chunksize):
+            yield chunk
+
+    def _write_chunks(self, chunks, file_path, index):
+        with open(file_path, 'w') as events_file:
+            for i, chunk in enumerate(chunks):
+                chunk.to_csv(events_file, index=index, header=i == 0)
+
+
+class ParquetStayStorage(StayStorage):
+    extension = '.parquet'
+
+    def write(self, events, icustay_id, index=True, **kwargs):
+        to_columnar_compatible(events, index=index).to_parquet(self.file_path(icustay_id), index=False)
+
+    def columns_types(self, icustay_id):
+        schema = pq.read_schema(self.file_path(icustay_id))
+        return [(field.name, field.type) for field in schema]
+
+    def iter_rows(self, icustay_id, batch_size=10000):
+        for batch in pq.ParquetFile(self.file_path(icustay_id)).iter_batches(batch_size=batch_size):
+            for row in zip(*[column.to_pylist() for column in batch.columns]):
+                yield list(row)
+
+    def _write_rows(self, rows, file_path, columns_types, batch_size):
+        schema = pa.schema(columns_types)
+        with pq.ParquetWriter(file_path, schema) as writer:
+            for batch in _rows_to_batches(rows, schema, batch_size):
+                writer.write_batch(batch)
+
+    def iter_chunks(self, icustay_id, chunksize=1000):
+        parquet_file = pq.ParquetFile(self.file_path(icustay_id))
+        if parquet_file.metadata.num_rows == 0:
+            yield parquet_file.schema_arrow.empty_table().to_pandas()
+            return
+        for batch in parquet_file.iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+
+    def _write_chunks(self, chunks, file_path, index):
+        writer = None
+        try:
+            for table in _chunks_to_tables(chunks, index):
+                if writer is None:
+                    writer = pq.ParquetWriter(file_path, table.schema)
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+
+
+class FeatherStayStorage(StayStorage):
+    extension = '.feather'
+
+    def write(self, events, icustay_id, index=True, **kwargs):
+        to_columnar_compatible(events, index=index).to_feather(self.file_path(icustay_id))
+
+    def columns_types(self, icustay_id):
+        with pa.memory_map(self.file_path(icustay_id)) as source:
+            schema = pa.ipc.open_file(source).schema
+        return [(field.name, field.type) for field in schema]
+
+    def iter_rows(self, icustay_id, batch_size=10000):
+        with pa.memory_map(self.file_path(icustay_id)) as source:
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i)
+                for row in zip(*[column.to_pylist() for column in batch.columns]):
+                    yield list(row)
+
+    def _write_rows(self, rows, file_path, columns_types, batch_size):
+        schema = pa.schema(columns_types)
+        with pa.OSFile(file_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, schema) as writer:
+                for batch in _rows_to_batches(rows, schema, batch_size):
+                    writer.write_batch(batch)
+
+    def iter_chunks(self, icustay_id, chunksize=1000):
+        with pa.memory_map(self.file_path(icustay_id)) as source:
+            reader = pa.ipc.open_file(source)
+            if sum(reader.get_batch(i).num_rows for i in range(reader.num_record_batches)) == 0:
+                yield reader.schema.empty_table().to_pandas()
+                return
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i)
+                for offset in range(0, batch.num_rows, chunksize):
+                    yield batch.slice(offset, chunksize).to_pandas()
+
+    def _write_chunks(self, chunks, file_path, index):
+        with pa.OSFile(file_path, 'wb') as sink:
+            writer = None
+            try:
+                for table in _chunks_to_tables(chunks, index):
+                    if writer is None:
+                        writer = pa.ipc.new_file(sink, table.schema)
+                    writer.write_table(table)
+            finally:
+                if writer is not None:
+                    writer.close()
+
+
+STORAGES = {
+    CSV_FORMAT: CsvStayStorage,
+    PARQUET_FORMAT: ParquetStayStorage,
+    FEATHER_FORMAT: FeatherStayStorage
+}
+
+
+def get_stay_storage(path, storage_format=CSV_FORMAT):
+    """
+    Get the storage for the icu stays files at a directory
+    :param path: the directory of the files
+    :param storage_format: one of 'csv', 'parquet' or 'feather'
+    :return: the StayStorage for the directory
+    """
+    if storage_format not in STORAGES.keys():
+        raise ValueError("Storage format {} is not implemented, use one of {}".format(storage_format,
+                                                                                      list(STORAGES.keys())))
+    if not path.endswith('/'):
+        path += '/'
+    return STORAGES[storage_format](path)
+
+
+def read_events_file(file_path):
+    """
+    Read a file of events, using the reader for the format given by its extension
+    :param file_path: the path for the file
+    :return: a DataFrame with the events
+    """
+    extension = os.path.splitext(file_path)[1]
+    if extension == ParquetStayStorage.extension:
+        return pd.read_parquet(file_path)
+    elif extension == FeatherStayStorage.extension:
+        return pd.read_feather(file_path)
+    return pd.read_csv(file_path)
+
+
+def iter_events_file_chunks(file_path, chunksize=1000):
+    """
+    Read a file of events in DataFrames of up to chunksize rows, using the iter_chunks of the storage given by its
+    extension, without loading the whole file
+    :param file_path: the path for the file
+    :param chunksize: how many rows each DataFrame has
+    :return: a generator of DataFrames, that together are what read_events_file returns
+    """
+    directory, file_name = os.path.split(file_path)
+    icustay_id, extension = os.path.splitext(file_name)
+    for storage_class in STORAGES.values():
+        if extension == storage_class.extension:
+            yield from storage_class(os.path.join(directory, '')).iter_chunks(icustay_id, chunksize=chunksize)
+            return
+    for chunk in pd.read_csv(file_path, chunksize=chunksize):
+        yield chunk
+
+
+def _rows_to_batches(rows, schema, batch_size):
+    """
+    Group a stream of rows into pyarrow.RecordBatch with the given schema
+    """
+    batch_rows = []
+    for row in rows:
+        batch_rows.append(row)
+        if len(batch_rows) == batch_size:
+            yield pa.RecordBatch.from_arrays([pa.array(list(column), type=field.type)
+                                              for column, field in zip(zip(*batch_rows), schema)], schema=schema)
+            batch_rows = []
+    if len(batch_rows) != 0:
+        yield pa.RecordBatch.from_arrays([pa.array(list(column), type=field.type)
+                                          for column, field in zip(zip(*batch_rows), schema)], schema=schema)
+
+
+def _chunks_to_tables(chunks, index):
+    """
+    Convert a stream of DataFrames into pyarrow.Table with the columns that write would save, all of them with the
+    types of the first DataFrame
+    """
+    schema = None
+    for chunk in chunks:
+        table = pa.Table.from_pandas(to_columnar_compatible(chunk, index=index), preserve_index=False)
+        if schema is None:
+            schema = table.schema
+        yield table.cast(schema)
@@ -0,0 +1,153 @@
+"""
+Build the episodes and labels of several prediction tasks from the buckets of the icu stays, reading the buckets of
+each stay only once for all tasks. Each task is declared by a TaskSpec, and its episodes are references to the
+stay buckets, created by create_episode_reference.
+"""
+import numpy as np
+import pandas as pd
+
+from resources.episodes import create_episode_reference, get_hours_until
+
+# One episode for each bucket, with all buckets of the stay until it
+BUCKET_EPISODES = 'bucket'
+# One episode for each stay, with the buckets of the observation window
+STAY_EPISODES = 'stay'
+
+# 1 if the patient dies inside the prediction horizon, counted from the start of the last bucket of the episode
+DEATH_IN_HORIZON_LABEL = 'death_in_horizon'
+# 1 if the patient dies during the stay
+DEATH_LABEL = 'death'
+# The hours from the start of the last bucket of the episode until the icu outtime
+REMAINING_LOS_LABEL = 'remaining_los'
+# The value of a column of the stays, as phenotypes
+STAY_COLUMN_LABEL = 'stay_column'
+
+TASK_COLUMNS = ['episode', 'icustay_id', 'structured_path', 'textual_path', 'end_bucket', 'label']
+
+
+class TaskSpec(object):
+    """
+    The definition of a prediction task: which episodes are created from each icu stay and how they are labeled
+    """
+
+    def __init__(self, name, episodes=BUCKET_EPISODES, label=DEATH_IN_HORIZON_LABEL, observation_hours=None,
+                 horizon_hours=None, first_bucket=0, min_buckets=1, is_label_inclusive=False, label_column=None):
+        """
+        :param name: the name of the task, used for its episodes file
+        :param episodes: BUCKET_EPISODES or STAY_EPISODES
+        :param label: DEATH_IN_HORIZON_LABEL, DEATH_LABEL, REMAINING_LOS_LABEL or STAY_COLUMN_LABEL
+        :param observation_hours: for STAY_EPISODES, the episode has the buckets that end until this many hours
+        after the intime, and stays shorter than that are left out
+        :param horizon_hours: for DEATH_IN_HORIZON_LABEL, the prediction horizon
+        :param first_bucket: for BUCKET_EPISODES, the first bucket that creates an episode
+        :param min_buckets: stays with less buckets than this don't create episodes
+        :param is_label_inclusive: for DEATH_IN_HORIZON_LABEL, if a death at exactly horizon_hours is labeled 1
+        :param label_column: for STAY_COLUMN_LABEL, the column of the stays with the label
+        """
+        if episodes not in [BUCKET_EPISODES, STAY_EPISODES]:
+            raise ValueError("Task {} has unknown episodes {}".format(name, episodes))
+        if label not in [DEATH_IN_HORIZON_LABEL, DEATH_LABEL, REMAINING_LOS_LABEL, STAY_COLUMN_LABEL]:
+            raise ValueError("Task {} has unknown label {}".format(name, label))
+        if episodes == STAY_EPISODES and observation_hours is None:
+            raise ValueError("Task {} needs observation_hours for stay episodes".format(name))
+        if label == DEATH_IN_HORIZON_LABEL and horizon_hours is None:
+            raise ValueError("Task {} needs horizon_hours for its label".format(name))
+        if label == STAY_COLUMN_LABEL and label_column is None:
+            raise ValueError("Task {} needs label_column for its label".format(name))
+        self.name = name
+        self.episodes = episodes
+        self.label = label
+        self.observation_hours = observation_hours
+        self.horizon_hours = horizon_hours
+        self.first_bucket = first_bucket
+        self.min_buckets = min_buckets
+        self.is_label_inclusive = is_label_inclusive
+        self.label_column = label_column
+
+
+def create_tasks_specs(tasks):
+    """
+    Create the TaskSpec of the tasks declared at the parameters
+    :param tasks: a dict from the task name to the dict with the TaskSpec arguments
+    :return: the list of TaskSpec
+    """
+    return [TaskSpec(name, **spec) for name, spec in tasks.items()]
+
+
+def get_episodes_positions(task, stay, buckets, starttimes, endtimes):
+    """
+    Get the position of the last bucket of each episode of a stay
+    :param task: the TaskSpec
+    :param stay: the icu stay, with INTIME, OUTTIME and DEATHTIME
+    :param buckets: a numpy array with the bucket numbers
+    :param starttimes: a pandas.Series with the start of the buckets
+    :param endtimes: a pandas.Series with the end of the buckets
+    :return: a numpy array with the positions
+    """
+    if len(buckets) < task.min_buckets:
+        return np.array([], dtype=int)
+    if task.episodes == BUCKET_EPISODES:
+        return np.flatnonzero((buckets >= task.first_bucket) & ~(starttimes > stay['DEATHTIME']).to_numpy())
+    stay_end = stay['OUTTIME'] if pd.isna(stay['DEATHTIME']) else stay['DEATHTIME']
+    if (stay_end - stay['INTIME']) // pd.Timedelta(hours=1) < task.observation_hours:
+        return np.array([], dtype=int)
+    positions = np.flatnonzero((endtimes <= stay['INTIME'] + pd.Timedelta(hours=task.observation_hours)).to_numpy())
+    return positions[-1:]
+
+
+def get_episodes_labels(task, stay, starttimes):
+    """
+    Get the label of each episode of a stay
+    :param task: the TaskSpec
+    :param stay: the icu stay, with INTIME, OUTTIME and DEATHTIME
+    :param starttimes: a pandas.Series with the start of the last bucket of each episode
+    :return: a numpy array with the labels
+    """
+    if task.label == DEATH_IN_HORIZON_LABEL:
+        hours = get_hours_until(starttimes, stay['DEATHTIME'])
+        labels = hours <= task.horizon_hours if task.is_label_inclusive else hours < task.horizon_hours
+        return labels.astype(int)
+    if task.label == DEATH_LABEL:
+        return np.full(len(starttimes), int(not pd.isna(stay['DEATHTIME'])))
+    if task.label == REMAINING_LOS_LABEL:
+        return get_hours_until(starttimes, stay['OUTTIME'])
+    return np.full(len(starttimes), stay[task.label_column])
+
+
+def create_stay_episodes(tasks, stay, structured_events, structured_path, textual_events=None, textual_path=None,
+                         datetime_pattern='%Y-%m-%d %H:%M:%S'):
+    """
+    Create the episodes of all tasks for an icu stay. The textual episode of each episode has the notes buckets until
+    its last bucket, and is missing when there aren't any.
+    :param tasks: the list of TaskSpec
+    :param stay: the icu stay, with ICUSTAY_ID, INTIME, OUTTIME and DEATHTIME
+    :param structured_events: the structured buckets of the stay
+    :param structured_path: the path for the structured buckets file
+    :param textual_events: the notes buckets of the stay, None if it doesn't have notes
+    :param textual_path: the path for the notes buckets file
+    :param datetime_pattern: the pattern used to store time
+    :return: a dict from the task name to a DataFrame with the TASK_COLUMNS for its episodes, indexed by episode
+    """
+    buckets = structured_events['bucket'].to_numpy()
+    starttimes = pd.to_datetime(structured_events['starttime'], format=datetime_pattern)
+    endtimes = pd.to_datetime(structured_events['endtime'], format=datetime_pattern)
+    # The notes buckets are sorted by bucket, so the notes until a bucket are the first rows of their file
+    textual_buckets = textual_events['bucket'].to_numpy() if textual_events is not None else np.array([])
+    stay_episodes = dict()
+    for task in tasks:
+        positions = get_episodes_positions(task, stay, buckets, starttimes, endtimes)
+        end_buckets = buckets[positions]
+        textual_positions = np.searchsorted(textual_buckets, end_buckets, side='right') - 1
+        if task.episodes == BUCKET_EPISODES:
+            episodes = ["{}_{}".format(bucket, stay['ICUSTAY_ID']) for bucket in end_buckets]
+        else:
+            episodes = [stay['ICUSTAY_ID']] * len(positions)
+        stay_episodes[task.name] = pd.DataFrame(
+            {'episode': episodes, 'icustay_id': stay['ICUSTAY_ID'],
+             'structured_path': [create_episode_reference(structured_path, position) for position in positions],
+             'textual_path': [create_episode_reference(textual_path, position) if position >= 0 else np.nan
+                              for position in textual_positions],
+             'end_bucket': end_buckets,
+             'label': get_episodes_labels(task, stay, starttimes.iloc[positions])},
+            index=episodes, columns=TASK_COLUMNS)
+    return stay_episodes
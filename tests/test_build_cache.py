@@ -0,0 +1,28 @@
+import os
+
+from resources import build_cache
+
+
+def test_raw_input_content_is_hashed_only_when_it_changes(tmp_path, monkeypatch):
+    raw_events = tmp_path / 'CHARTEVENTS_1.csv'
+    raw_events.write_text('ROW_ID,VALUE\n1,80\n')
+    partitions = tmp_path / 'partitions' / 'ICUSTAY_ID=1'
+    partitions.mkdir(parents=True)
+    (partitions / 'part-0.parquet').write_bytes(b'events')
+    hashed_files = []
+    get_file_hash = build_cache.get_file_hash
+    monkeypatch.setattr(build_cache, 'get_file_hash', lambda path: hashed_files.append(path) or get_file_hash(path))
+
+    raw_events_key = build_cache.get_input_key(str(raw_events))
+    partitions_key = build_cache.get_input_key(str(partitions))
+    assert raw_events_key == get_file_hash(str(raw_events))
+    assert len(hashed_files) == 2
+
+    assert build_cache.get_input_key(str(raw_events)) == raw_events_key
+    assert build_cache.get_input_key(str(partitions)) == partitions_key
+    assert len(hashed_files) == 2
+
+    raw_events.write_text('ROW_ID,VALUE\n1,81\n')
+    os.utime(raw_events, ns=(1, 1))
+    assert build_cache.get_input_key(str(raw_events)) != raw_events_key
+    assert len(hashed_files) == 3
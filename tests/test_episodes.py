@@ -0,0 +1,17 @@
+import pickle
+
+import numpy as np
+
+from resources.episodes import create_episode_reference, get_episode_length, load_episode_matrix
+
+
+def test_episode_length_without_loading_the_stay(tmp_path):
+    stay_path = str(tmp_path / 'stay.pkl')
+    with open(stay_path, 'wb') as stay_file:
+        pickle.dump(np.arange(12, dtype=float).reshape(6, 2), stay_file)
+    episode_path = create_episode_reference(stay_path, 3)
+
+    assert get_episode_length(episode_path) == len(load_episode_matrix(episode_path)) == 4
+    # The stay file is not read for the references
+    assert get_episode_length(create_episode_reference(str(tmp_path / 'missing.pkl'), 3)) == 4
+    assert get_episode_length(stay_path) == 6
@@ -0,0 +1,41 @@
+import csv
+
+import numpy as np
+import pandas as pd
+
+from resources.events_merge import merge_events_in_memory, stream_merge_events
+from resources.storage import get_stay_storage
+
+DATETIME_PATTERN = '%Y-%m-%d %H:%M:%S'
+
+
+def write_filtered_events(storage, icustay_id, times, values):
+    """
+    Write the events of a stay as dataset_filter_events.py does, with the itemids as columns
+    """
+    events = pd.DataFrame(values, index=pd.to_datetime(times, format=DATETIME_PATTERN))
+    storage.write(events.sort_index(kind='stable'), icustay_id, quoting=csv.QUOTE_NONNUMERIC)
+
+
+def test_stream_merge_csv_stays(tmp_path):
+    chartevents_storage = get_stay_storage(str(tmp_path / 'chartevents'))
+    labevents_storage = get_stay_storage(str(tmp_path / 'labevents'))
+    streamed_storage = get_stay_storage(str(tmp_path / 'streamed'))
+    in_memory_storage = get_stay_storage(str(tmp_path / 'in_memory'))
+    for directory in ['chartevents', 'labevents', 'streamed', 'in_memory']:
+        (tmp_path / directory).mkdir()
+    write_filtered_events(chartevents_storage, 1, ['2100-01-01 10:00:00', '2100-01-01 11:00:00'],
+                          {211: [80.0, 82.0], 618: [np.nan, 16.0]})
+    write_filtered_events(labevents_storage, 1, ['2100-01-01 11:00:00', '2100-01-01 12:00:00'],
+                          {50912: [1.1, np.nan], 50813: ['pos', 'neg']})
+
+    stream_merge_events(1, chartevents_storage, labevents_storage, streamed_storage, DATETIME_PATTERN)
+    merge_events_in_memory(1, chartevents_storage, labevents_storage, in_memory_storage, DATETIME_PATTERN)
+
+    streamed = streamed_storage.read(1)
+    in_memory = in_memory_storage.read(1)
+    assert list(streamed.columns) == ['Unnamed: 0', 'chartevents_211', 'chartevents_618', 'labevents_50912',
+                                      'labevents_50813']
+    pd.testing.assert_frame_equal(streamed, in_memory)
+    assert streamed['chartevents_211'].tolist()[:2] == [80.0, 82.0]
+    assert streamed['labevents_50813'].tolist()[1:] == ['pos', 'neg']
@@ -0,0 +1,26 @@
+import os
+
+import pandas as pd
+
+from resources.events_partition import partition_events
+
+DATETIME_PATTERN = '%Y-%m-%d %H:%M:%S'
+
+
+def test_partition_chunk_with_many_stays(tmp_path):
+    stays_number = 2000
+    stays = pd.DataFrame({'HADM_ID': range(stays_number), 'ICUSTAY_ID': range(100000, 100000 + stays_number),
+                          'INTIME': pd.Timestamp('2100-01-01 00:00:00'),
+                          'OUTTIME': pd.Timestamp('2100-01-02 00:00:00')})
+    chunk = pd.DataFrame({'ROW_ID': [str(i) for i in range(stays_number)],
+                          'HADM_ID': [str(i) for i in range(stays_number)],
+                          'ITEMID': '211', 'CHARTTIME': '2100-01-01 10:00:00', 'VALUE': '80'})
+    partitioned_events_path = str(tmp_path) + '/chartevents/'
+    os.mkdir(partitioned_events_path)
+
+    saved_events = partition_events(chunk, stays, partitioned_events_path, 0, datetime_pattern=DATETIME_PATTERN)
+
+    assert saved_events == stays_number
+    assert len(os.listdir(partitioned_events_path)) == stays_number
+    stay_events = pd.read_parquet(partitioned_events_path + 'ICUSTAY_ID=101999/')
+    assert stay_events['ROW_ID'].tolist() == [1999.0]